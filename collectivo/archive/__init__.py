@@ -0,0 +1 @@
+"""A built-in collectivo extension to archive inactive users."""
@@ -0,0 +1,199 @@
+"""Archival of inactive users."""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import serializers
+from django.db import router, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.deletion import (
+    Collector,
+    ProtectedError,
+    RestrictedError,
+)
+from django.utils import timezone
+
+from collectivo.utils.permissions import clear_permissions_cache
+
+from .models import ArchivedUser
+from .signals import user_archived, user_restored
+
+logger = logging.getLogger(__name__)
+User = get_user_model()
+
+INACTIVE_DAYS = 3650
+CHUNK_SIZE = 100
+
+
+def get_inactive_days() -> int:
+    """Get the number of days after which inactive users are archived."""
+    config = settings.COLLECTIVO["extensions"].get("collectivo.archive") or {}
+    return int(config.get("inactive_days", INACTIVE_DAYS))
+
+
+def get_inactive_users(days: int = None):
+    """Get users that have been inactive for longer than a number of days.
+
+    Users are inactive if they have not logged in during this time, have no
+    memberships that are running or ended during this time, and have no
+    open invoices or active subscriptions. Admins are never inactive.
+    """
+    cutoff = timezone.now() - timedelta(days=days or get_inactive_days())
+    users = User.objects.filter(is_superuser=False, is_staff=False).filter(
+        Q(last_login__lt=cutoff)
+        | Q(last_login__isnull=True, date_joined__lt=cutoff)
+    )
+    if apps.is_installed("collectivo.memberships"):
+        Membership = apps.get_model("memberships", "Membership")
+        running = Membership.objects.filter(
+            Q(date_ended__isnull=True) | Q(date_ended__gte=cutoff.date()),
+            user=OuterRef("pk"),
+        )
+        users = users.exclude(Exists(running))
+    if apps.is_installed("collectivo.payments"):
+        Invoice = apps.get_model("payments", "Invoice")
+        Subscription = apps.get_model("payments", "Subscription")
+        open_invoices = Invoice.objects.filter(
+            payment_from__user=OuterRef("pk"),
+            status__in=["draft", "open", "pending"],
+        )
+        subscriptions = Subscription.objects.filter(
+            payment_from__user=OuterRef("pk"), status__in=["active", "paused"]
+        )
+        users = users.exclude(Exists(open_invoices)).exclude(
+            Exists(subscriptions)
+        )
+    return users
+
+
+def serialize_objects(model, objects) -> list:
+    """Serialize the fields of objects, without their many-to-many fields.
+
+    Many-to-many relations are stored as rows of their through tables.
+    """
+    fields = [field.name for field in model._meta.local_fields]
+    return serializers.serialize("python", objects, fields=fields)
+
+
+def detach_accounts(user) -> list:
+    """Keep the payment accounts of a user without the user.
+
+    Accounts are referenced by invoices and are kept for accounting.
+    Returns the ids of the detached accounts.
+    """
+    if not apps.is_installed("collectivo.payments"):
+        return []
+    Account = apps.get_model("payments", "Account")
+    accounts = list(Account.objects.filter(user=user))
+    for account in accounts:
+        account.name = str(account)
+        account.user = None
+        account.save()
+    return [account.pk for account in accounts]
+
+
+@transaction.atomic
+def archive_user(user) -> ArchivedUser:
+    """Move a user and all objects that belong to the user to the archive.
+
+    Objects are collected like for a deletion. Objects that reference the
+    user without belonging to the user keep a note of the reference, so
+    that it can be restored. The signal user_archived is sent before the
+    user is deleted.
+    """
+    accounts = detach_accounts(user)
+    collector = Collector(using=router.db_for_write(User), origin=user)
+    collector.collect([user])
+    collector.sort()
+
+    # Parents are stored before their children
+    objects = []
+    for model, instances in reversed(collector.data.items()):
+        objects += serialize_objects(model, instances)
+    for queryset in collector.fast_deletes:
+        objects += serialize_objects(queryset.model, queryset)
+
+    # References that will be set to null
+    references = defaultdict(list)
+    for model, updates in collector.field_updates.items():
+        for (field, _), instances in updates.items():
+            for instance in instances:
+                value = getattr(instance, field.attname)
+                key = (model._meta.label_lower, field.attname, value)
+                references[key].append(instance.pk)
+
+    archived = ArchivedUser.objects.create(
+        user_id=user.pk,
+        username=user.username,
+        email=user.email,
+        first_name=user.first_name,
+        last_name=user.last_name,
+        last_activity=user.last_login or user.date_joined,
+        data={
+            "objects": objects,
+            "references": [
+                {"model": model, "field": field, "value": value, "pks": pks}
+                for (model, field, value), pks in references.items()
+            ],
+            "accounts": accounts,
+        },
+    )
+    user_archived.send(sender=User, user=user)
+    collector.delete()
+    return archived
+
+
+@transaction.atomic
+def restore_user(archived: ArchivedUser):
+    """Restore an archived user and all objects that belong to the user.
+
+    The signal user_restored is sent after the user has been restored.
+    """
+    data = archived.data
+    for obj in serializers.deserialize("python", data["objects"]):
+        obj.save()
+    for reference in data["references"]:
+        model = apps.get_model(reference["model"])
+        model.objects.filter(pk__in=reference["pks"]).update(
+            **{reference["field"]: reference["value"]}
+        )
+    if data["accounts"]:
+        Account = apps.get_model("payments", "Account")
+        Account.objects.filter(
+            pk__in=data["accounts"], user__isnull=True
+        ).update(user=archived.user_id)
+    clear_permissions_cache([archived.user_id])
+    archived.delete()
+    user = User.objects.get(pk=archived.user_id)
+    user_restored.send(sender=User, user=user)
+    return user
+
+
+def archive_inactive_users(
+    days: int = None, after: int = 0, chunk_size: int = CHUNK_SIZE
+) -> tuple[int, int | None]:
+    """Archive a chunk of inactive users with an id greater than after.
+
+    Each user is archived in a separate transaction. Users that cannot be
+    archived are skipped and logged. Returns the number of archived users
+    and the last id of the chunk, or None if there are no further users.
+    """
+    users = list(
+        get_inactive_users(days)
+        .filter(pk__gt=after)
+        .order_by("pk")[:chunk_size]
+    )
+    archived = 0
+    for user in users:
+        try:
+            archive_user(user)
+            archived += 1
+        except (ProtectedError, RestrictedError) as e:
+            logger.warning("User %s cannot be archived: %s", user.pk, e)
+        except Exception:
+            logger.exception("User %s could not be archived", user.pk)
+    last = users[-1].pk if len(users) == chunk_size else None
+    return archived, last
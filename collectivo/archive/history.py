@@ -0,0 +1,140 @@
+"""Archival of old historical records."""
+import json
+import logging
+import zlib
+from collections import defaultdict
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from simple_history.models import registered_models
+from simple_history.utils import get_history_model_for_model
+
+from .models import HistoryArchive
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DAYS = 730
+CHUNK_SIZE = 5000
+
+
+def get_history_days() -> int:
+    """Get the number of days after which historical records are archived."""
+    config = settings.COLLECTIVO["extensions"].get("collectivo.archive") or {}
+    return int(config.get("history_days", HISTORY_DAYS))
+
+
+def get_history_models() -> list:
+    """Get the history models of all models with historical records."""
+    history_models = {
+        get_history_model_for_model(model)
+        for model in registered_models.values()
+    }
+    return sorted(history_models, key=lambda model: model._meta.label)
+
+
+def get_history_watermark(history_model) -> int | None:
+    """Get the last record of a history model that has been processed.
+
+    Records of memberships after the watermark of the statistics rollups
+    are still needed to calculate the rollups, see
+    collectivo.memberships.statistics.update_statistics_rollups. Returns
+    None for history models without a watermark.
+    """
+    if not apps.is_installed("collectivo.memberships"):
+        return None
+    Membership = apps.get_model("memberships", "Membership")
+    if history_model is not Membership.history.model:
+        return None
+    Watermark = apps.get_model("memberships", "MembershipStatisticsWatermark")
+    return Watermark.objects.values_list("history_id", flat=True).first() or 0
+
+
+def get_archivable_records(history_model, cutoff):
+    """Get the historical records that were created before a date.
+
+    The latest record of each existing object is kept, so that the current
+    state of the object remains in the history. If the history model has a
+    watermark, the latest processed record of each object is kept as well.
+    """
+    id_field = history_model.instance_type._meta.pk.attname
+    newer = history_model._default_manager.filter(
+        **{id_field: OuterRef(id_field)},
+        history_id__gt=OuterRef("history_id"),
+    )
+    deleted = Q(history_type="-")
+    watermark = get_history_watermark(history_model)
+    if watermark is not None:
+        newer = newer.filter(history_id__lte=watermark)
+        deleted &= Q(history_id__lte=watermark)
+    return (
+        history_model._default_manager.filter(history_date__lt=cutoff)
+        .filter(deleted | Exists(newer))
+        .order_by("history_id")
+    )
+
+
+def compress_records(records: list[dict]) -> bytes:
+    """Compress historical records as JSON."""
+    data = json.dumps(records, cls=DjangoJSONEncoder, separators=(",", ":"))
+    return zlib.compress(data.encode())
+
+
+@transaction.atomic
+def archive_history_chunk(
+    history_model, cutoff, chunk_size: int = CHUNK_SIZE
+) -> int:
+    """Move a chunk of old records of a history model into the archive.
+
+    The records are stored with one archive row per month and deleted from
+    the history table. Returns the number of archived records.
+    """
+    records = list(
+        get_archivable_records(history_model, cutoff)
+        .select_for_update(skip_locked=True)
+        .values()[:chunk_size]
+    )
+    if not records:
+        return 0
+    periods = defaultdict(list)
+    for record in records:
+        periods[record["history_date"].date().replace(day=1)].append(record)
+    HistoryArchive.objects.bulk_create(
+        [
+            HistoryArchive(
+                model=history_model._meta.label,
+                period=period,
+                first_id=rows[0]["history_id"],
+                last_id=rows[-1]["history_id"],
+                count=len(rows),
+                data=compress_records(rows),
+            )
+            for period, rows in periods.items()
+        ]
+    )
+    history_model._default_manager.filter(
+        history_id__in=[record["history_id"] for record in records]
+    ).delete()
+    return len(records)
+
+
+def archive_history(days: int = None, chunk_size: int = CHUNK_SIZE) -> int:
+    """Archive the historical records that are older than a number of days.
+
+    Each chunk of records is archived in a separate transaction. Returns
+    the number of archived records.
+    """
+    cutoff = timezone.now() - timedelta(days=days or get_history_days())
+    archived = 0
+    for history_model in get_history_models():
+        while True:
+            n = archive_history_chunk(history_model, cutoff, chunk_size)
+            archived += n
+            if n < chunk_size:
+                break
+    logger.info("Archived %s historical records", archived)
+    return archived
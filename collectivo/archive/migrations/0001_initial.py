@@ -0,0 +1,29 @@
+# Generated by Django 4.1.13 on 2026-10-18 10:38
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedUser',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.PositiveIntegerField(unique=True)),
+                ('username', models.CharField(db_index=True, max_length=150)),
+                ('email', models.EmailField(blank=True, db_index=True, max_length=254)),
+                ('first_name', models.CharField(blank=True, max_length=150)),
+                ('last_name', models.CharField(blank=True, db_index=True, max_length=150)),
+                ('last_activity', models.DateTimeField(null=True)),
+                ('date_archived', models.DateTimeField(auto_now_add=True)),
+                ('data', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.1.13 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('archive', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoryArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=255)),
+                ('period', models.DateField(help_text='First day of the month.')),
+                ('first_id', models.PositiveIntegerField()),
+                ('last_id', models.PositiveIntegerField()),
+                ('count', models.PositiveIntegerField()),
+                ('date_archived', models.DateTimeField(auto_now_add=True)),
+                ('data', models.BinaryField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='historyarchive',
+            index=models.Index(fields=['period', 'model'], name='archive_his_period_09e7f4_idx'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+"""Models of the archive extension."""
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+
+
+class ArchivedUser(models.Model):
+    """A user that has been moved out of the active tables.
+
+    The rows of the user and of all objects that were removed together with
+    the user are stored as serialized data, so that they can be restored.
+    """
+
+    user_id = models.PositiveIntegerField(unique=True)
+    username = models.CharField(max_length=150, db_index=True)
+    email = models.EmailField(blank=True, db_index=True)
+    first_name = models.CharField(max_length=150, blank=True)
+    last_name = models.CharField(max_length=150, blank=True, db_index=True)
+    last_activity = models.DateTimeField(null=True)
+    date_archived = models.DateTimeField(auto_now_add=True)
+    data = models.JSONField(encoder=DjangoJSONEncoder)
+
+    def __str__(self):
+        """Return a string representation of the object."""
+        return f"{self.first_name} {self.last_name} ({self.username})"
+
+
+class HistoryArchive(models.Model):
+    """Historical records that have been moved out of the history tables.
+
+    Records are stored as compressed JSON, grouped by their history model and
+    the month in which they were created. Rows are only inserted and never
+    changed, so that the table can be partitioned by period.
+    """
+
+    model = models.CharField(max_length=255)
+    period = models.DateField(help_text="First day of the month.")
+    first_id = models.PositiveIntegerField()
+    last_id = models.PositiveIntegerField()
+    count = models.PositiveIntegerField()
+    date_archived = models.DateTimeField(auto_now_add=True)
+    data = models.BinaryField()
+
+    class Meta:
+        """Meta settings."""
+
+        indexes = [models.Index(fields=["period", "model"])]
+
+    def __str__(self):
+        """Return a string representation of the object."""
+        return f"{self.model} {self.period:%Y-%m} ({self.count})"
+
+    def get_records(self) -> list[dict]:
+        """Decompress the archived records."""
+        return json.loads(zlib.decompress(bytes(self.data)))
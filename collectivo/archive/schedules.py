@@ -0,0 +1,15 @@
+"""Celery schedules of the archive extension."""
+from celery.schedules import crontab
+
+schedules = {
+    # Archive inactive users every night
+    "collectivo_archive_archive_inactive_users_1d": {
+        "task": "collectivo_archive_archive_inactive_users",
+        "schedule": crontab(minute=0, hour=3),
+    },
+    # Archive old historical records every night
+    "collectivo_archive_archive_history_1d": {
+        "task": "collectivo_archive_archive_history",
+        "schedule": crontab(minute=0, hour=4),
+    },
+}
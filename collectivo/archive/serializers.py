@@ -0,0 +1,17 @@
+"""Serializers of the archive extension."""
+from rest_framework import serializers
+
+from . import models
+
+
+class ArchivedUserSerializer(serializers.ModelSerializer):
+    """Serializer for archived users."""
+
+    class Meta:
+        """Serializer settings."""
+
+        model = models.ArchivedUser
+        exclude = ["data"]
+        read_only_fields = [
+            field.name for field in models.ArchivedUser._meta.fields
+        ]
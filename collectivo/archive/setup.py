@@ -0,0 +1,14 @@
+"""Setup function for the archive extension."""
+from collectivo.extensions.models import Extension
+
+from .apps import ArchiveConfig
+
+
+def setup(sender, **kwargs):
+    """Initialize extension after database is ready."""
+
+    Extension.objects.register(
+        name=ArchiveConfig.name,
+        description=ArchiveConfig.description,
+        built_in=True,
+    )
@@ -0,0 +1,10 @@
+"""Signals of the archive extension."""
+from django.dispatch import Signal
+
+# Sent with the argument user before an archived user is deleted. Receivers
+# can keep external accounts of the user, e.g. by disabling them, so that
+# they can be restored. Exceptions cancel the archival of the user.
+user_archived = Signal()
+
+# Sent with the argument user after an archived user has been restored.
+user_restored = Signal()
@@ -0,0 +1,24 @@
+"""Celery tasks of the archive extension."""
+from celery import shared_task
+
+from collectivo.utils.tasks import LogErrorTask
+
+from .archive import archive_inactive_users
+from .history import archive_history
+
+
+@shared_task(
+    name="collectivo_archive_archive_inactive_users", base=LogErrorTask
+)
+def archive_inactive_users_async(after: int = 0):
+    """Archive a chunk of inactive users and queue the next chunk."""
+    archived, last = archive_inactive_users(after=after)
+    if last is not None:
+        archive_inactive_users_async.delay(last)
+    return archived
+
+
+@shared_task(name="collectivo_archive_archive_history", base=LogErrorTask)
+def archive_history_async():
+    """Archive old historical records of all models."""
+    return archive_history()
@@ -0,0 +1,189 @@
+"""Tests of the archive extension."""
+from datetime import date, timedelta
+from unittest.mock import MagicMock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from collectivo.memberships.models import Membership, MembershipType
+from collectivo.memberships.statistics import update_statistics_rollups
+from collectivo.payments.models import Account, Invoice
+from collectivo.profiles.models import UserProfile
+from collectivo.tags.models import Tag
+from collectivo.utils.test import create_testadmin
+
+from .archive import (
+    archive_inactive_users,
+    get_inactive_users,
+    restore_user,
+)
+from .history import archive_history
+from .models import ArchivedUser, HistoryArchive
+from .signals import user_archived, user_restored
+
+User = get_user_model()
+
+ARCHIVE_URL = reverse("collectivo.archive:user-list")
+
+
+class ArchiveTests(TestCase):
+    """Test the archival of inactive users."""
+
+    def setUp(self):
+        """Create an inactive and an active user."""
+        self.client = APIClient()
+        self.client.force_authenticate(create_testadmin())
+        long_ago = timezone.now() - timedelta(days=1000)
+        self.user = User.objects.create_user(
+            "inactive", email="inactive@example.com", last_name="Old"
+        )
+        self.active = User.objects.create_user("active")
+        User.objects.filter(pk__in=[self.user.pk, self.active.pk]).update(
+            date_joined=long_ago
+        )
+        User.objects.filter(pk=self.active.pk).update(
+            last_login=timezone.now()
+        )
+        self.membership_type = MembershipType.objects.create(name="Test")
+        self.membership = Membership.objects.create(
+            user=self.user,
+            type=self.membership_type,
+            date_ended=date.today() - timedelta(days=500),
+        )
+        self.tag = Tag.objects.create(name="archive_test_tag")
+        self.tag.users.add(self.user)
+        self.account = Account.objects.get(user=self.user)
+        self.invoice = Invoice.objects.create(
+            payment_from=self.account, status="paid"
+        )
+
+    def test_inactive_users(self):
+        """Test that only inactive users are selected."""
+        users = get_inactive_users(days=365)
+        self.assertIn(self.user, users)
+        self.assertNotIn(self.active, users)
+        self.assertNotIn(self.user, get_inactive_users(days=600))
+
+        for status in ["open", "pending"]:
+            self.invoice.status = status
+            self.invoice.save()
+            self.assertNotIn(self.user, get_inactive_users(days=365))
+
+    def test_archive_and_restore(self):
+        """Test that users are moved to the archive and can be restored."""
+        archived, last = archive_inactive_users(days=365)
+        self.assertEqual(archived, 1)
+        self.assertIsNone(last)
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(Membership.objects.filter(user=self.user).exists())
+        self.assertFalse(self.tag.users.exists())
+        self.account.refresh_from_db()
+        self.assertIsNone(self.account.user)
+        self.assertTrue(Invoice.objects.filter(pk=self.invoice.pk).exists())
+
+        # Search the archive
+        res = self.client.get(ARCHIVE_URL + "?last_name=Old")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data[0]["user_id"], self.user.pk)
+        self.assertNotIn("data", res.data[0])
+
+        # Restore the user
+        archived = ArchivedUser.objects.get(user_id=self.user.pk)
+        url = reverse("collectivo.archive:user-restore", args=[archived.pk])
+        res = self.client.post(url)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data["id"], self.user.pk)
+        self.assertFalse(ArchivedUser.objects.exists())
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(user.email, "inactive@example.com")
+        self.assertTrue(UserProfile.objects.filter(user=user).exists())
+        self.assertEqual(
+            Membership.objects.get(user=user).pk, self.membership.pk
+        )
+        self.assertEqual(list(self.tag.users.all()), [user])
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.user, user)
+
+    def test_signals(self):
+        """Test that receivers are notified of archived and restored users."""
+        on_archived, on_restored = MagicMock(), MagicMock()
+        user_archived.connect(on_archived, weak=False)
+        self.addCleanup(user_archived.disconnect, on_archived)
+        user_restored.connect(on_restored, weak=False)
+        self.addCleanup(user_restored.disconnect, on_restored)
+
+        archive_inactive_users(days=365)
+        archived_user = on_archived.call_args.kwargs["user"]
+        self.assertEqual(archived_user.username, self.user.username)
+        restore_user(ArchivedUser.objects.get(user_id=self.user.pk))
+        restored_user = on_restored.call_args.kwargs["user"]
+        self.assertEqual(restored_user.pk, self.user.pk)
+
+    def test_archive_error(self):
+        """Test that users that cause errors are skipped and logged."""
+        other = User.objects.create_user("inactive_2")
+        User.objects.filter(pk=other.pk).update(
+            date_joined=timezone.now() - timedelta(days=1000)
+        )
+
+        def fail(sender, user, **kwargs):
+            if user.pk == self.user.pk:
+                raise RuntimeError("Service unavailable")
+
+        user_archived.connect(fail, weak=False)
+        self.addCleanup(user_archived.disconnect, fail)
+        with self.assertLogs("collectivo.archive.archive", "ERROR"):
+            archived, _ = archive_inactive_users(days=365)
+        self.assertEqual(archived, 1)
+        self.assertTrue(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(User.objects.filter(pk=other.pk).exists())
+        self.assertFalse(ArchivedUser.objects.filter(user_id=self.user.pk))
+
+
+class HistoryArchiveTests(TestCase):
+    """Test the archival of old historical records."""
+
+    def setUp(self):
+        """Create a tag with old and new historical records."""
+        self.tag = Tag.objects.create(name="history_1")
+        for name in ["history_2", "history_3"]:
+            self.tag.name = name
+            self.tag.save()
+        long_ago = timezone.now() - timedelta(days=1000)
+        self.tag.history.all().update(history_date=long_ago)
+
+    def test_archive_history(self):
+        """Test that old records are archived except the latest one."""
+        self.assertEqual(archive_history(days=365), 2)
+        self.assertEqual(self.tag.history.get().name, "history_3")
+        archive = HistoryArchive.objects.get()
+        self.assertEqual(archive.model, "tags.HistoricalTag")
+        self.assertEqual(archive.count, 2)
+        self.assertEqual(
+            [record["name"] for record in archive.get_records()],
+            ["history_1", "history_2"],
+        )
+        self.assertEqual(archive_history(days=365), 0)
+
+    def test_archive_membership_history(self):
+        """Test that records of memberships are kept until rolled up."""
+        user = User.objects.create_user("history_user")
+        membership = Membership.objects.create(
+            user=user, type=MembershipType.objects.create(name="History")
+        )
+        membership.shares_signed = 1
+        membership.save()
+        long_ago = timezone.now() - timedelta(days=1000)
+        membership.history.update(history_date=long_ago)
+        self.assertEqual(membership.history.count(), 2)
+
+        # Records after the watermark of the rollups are not archived
+        archive_history(days=365)
+        self.assertEqual(membership.history.count(), 2)
+
+        update_statistics_rollups()
+        archive_history(days=365)
+        self.assertEqual(membership.history.get().shares_signed, 1)
@@ -0,0 +1,14 @@
+"""URL patterns of the archive extension."""
+from django.urls import include, path
+from rest_framework.routers import DefaultRouter
+
+from . import views
+
+app_name = "collectivo.archive"
+
+router = DefaultRouter()
+router.register("users", views.ArchivedUserViewSet, basename="user")
+
+urlpatterns = [
+    path("api/archive/", include(router.urls)),
+]
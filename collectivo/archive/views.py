@@ -0,0 +1,44 @@
+"""Views of the archive extension."""
+from django.db import IntegrityError
+from drf_spectacular.utils import OpenApiResponse, extend_schema
+from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from collectivo.utils.filters import get_filterset, get_ordering_fields
+from collectivo.utils.mixins import SchemaMixin
+from collectivo.utils.permissions import HasPerm
+
+from . import models, serializers
+from .archive import restore_user
+
+
+class ArchivedUserViewSet(SchemaMixin, viewsets.ReadOnlyModelViewSet):
+    """Search archived users and restore them."""
+
+    permission_classes = [HasPerm]
+    required_perms = {
+        "GET": [("view_users", "core")],
+        "ALL": [("edit_users", "core")],
+    }
+    serializer_class = serializers.ArchivedUserSerializer
+    queryset = models.ArchivedUser.objects.all()
+    filterset_class = get_filterset(serializers.ArchivedUserSerializer)
+    ordering_fields = get_ordering_fields(serializers.ArchivedUserSerializer)
+
+    @extend_schema(responses={200: OpenApiResponse()})
+    @action(
+        detail=True,
+        methods=["POST"],
+        url_path="restore",
+        url_name="restore",
+    )
+    def restore(self, request, pk=None):
+        """Move an archived user and their data back to the active tables."""
+        archived = self.get_object()
+        try:
+            user = restore_user(archived)
+        except IntegrityError as e:
+            raise ValidationError(f"User cannot be restored: {e}")
+        return Response({"id": user.pk})
@@ -82,6 +82,7 @@ class KeycloakAPI:
         email: str = None,
         email_verified: bool = None,
         roles: List[str] = None,
+        enabled: bool = None,
     ) -> None:
         """Update a keycloak user."""
         payload = {
@@ -89,6 +90,7 @@ class KeycloakAPI:
             "lastName": last_name,
             "email": email,
             "emailVerified": email_verified,
+            "enabled": enabled,
         }
         payload = {k: v for k, v in payload.items() if v is not None}
 
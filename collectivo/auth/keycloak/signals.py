@@ -1,13 +1,18 @@
 """Signals of the keycloak extension."""
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from django.db.models import signals
 
+from collectivo.archive.signals import user_archived, user_restored
+
 from .api import KeycloakAPI
 from .models import KeycloakUser
 
 
 def update_keycloak_user(sender, instance, created, **kwargs):
     """Create or update related keycloak user when a django user is changed."""
+    if kwargs.get("raw"):
+        return
     try:
         instance.keycloak.save()
     except KeycloakUser.DoesNotExist:
@@ -15,12 +20,52 @@ def update_keycloak_user(sender, instance, created, **kwargs):
 
 
 def delete_keycloak_user(sender, instance, *args, **kwargs):
-    """Delete model and synchronize with keycloak."""
+    """Delete model and synchronize with keycloak.
+
+    The accounts of archived users are kept, see disable_keycloak_user.
+    """
+    if getattr(instance, "_keycloak_archived", False):
+        return
     keycloak = KeycloakAPI()
     uuid = keycloak.get_user_id(instance.email)
     keycloak.delete_user(uuid)
 
 
+def disable_keycloak_user(sender, user, **kwargs):
+    """Disable the keycloak account of a user that is archived.
+
+    The account is disabled after the archive has been committed, so that
+    it stays active if archiving the user fails.
+    """
+    keycloak = KeycloakAPI()
+    uuid = (
+        KeycloakUser.objects.filter(user=user)
+        .values_list("uuid", flat=True)
+        .first()
+    ) or keycloak.get_user_id(user.email)
+    if uuid is not None:
+        transaction.on_commit(
+            lambda: keycloak.update_user(uuid, enabled=False)
+        )
+    user._keycloak_archived = True
+
+
+def enable_keycloak_user(sender, user, **kwargs):
+    """Enable or recreate the keycloak account of a restored user.
+
+    An existing account is enabled after the restore has been committed.
+    """
+    try:
+        keycloak_user = KeycloakUser.objects.get(user=user)
+    except KeycloakUser.DoesNotExist:
+        keycloak_user = KeycloakUser(user=user)
+    keycloak_user.save()
+    if keycloak_user.uuid is not None:
+        transaction.on_commit(
+            lambda: KeycloakAPI().update_user(keycloak_user.uuid, enabled=True)
+        )
+
+
 signals.post_save.connect(
     update_keycloak_user,
     sender=get_user_model(),
@@ -34,3 +79,15 @@ signals.post_delete.connect(
     dispatch_uid="delete_keycloak_user",
     weak=False,
 )
+
+user_archived.connect(
+    disable_keycloak_user,
+    dispatch_uid="disable_keycloak_user",
+    weak=False,
+)
+
+user_restored.connect(
+    enable_keycloak_user,
+    dispatch_uid="enable_keycloak_user",
+    weak=False,
+)
@@ -1,16 +1,17 @@
 """Models of the core extension."""
 from django.contrib.auth import get_user_model
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from simple_history import register
-from simple_history.models import HistoricalRecords
 
+from collectivo.utils.history import HistoricalRecords
 from collectivo.utils.managers import NameManager
 from collectivo.utils.models import SingleInstance
 from collectivo.utils.texts import EXTENSION_HELP_TEXT
 
 # Create a history for the default user model
 User = get_user_model()
-register(User, app=__package__)
+register(User, app=__package__, records_class=HistoricalRecords)
 
 
 class CoreSettings(SingleInstance, models.Model):
@@ -144,3 +145,43 @@ class PermissionGroup(models.Model):
         if not self.label:
             self.label = self.name.replace("_", " ").capitalize()
         super().save(*args, **kwargs)
+
+
+class Job(models.Model):
+    """A long-running action that is run in chunks by Celery.
+
+    The progress of the job is stored after each chunk, so that it can be
+    followed by the client, see collectivo.utils.jobs.
+    """
+
+    action = models.CharField(
+        max_length=255,
+        help_text="Import path of the viewset method that runs the job.",
+    )
+    user = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, related_name="jobs"
+    )
+    status = models.CharField(
+        max_length=10,
+        default="pending",
+        choices=[
+            ("pending", "pending"),
+            ("running", "running"),
+            ("success", "success"),
+            ("failure", "failure"),
+        ],
+    )
+    status_message = models.CharField(max_length=255, blank=True)
+    total = models.PositiveIntegerField(default=0)
+    done = models.PositiveIntegerField(default=0)
+    chunk_size = models.PositiveIntegerField(default=500)
+    data = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+    options = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    result = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    errors = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_finished = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        """Return the string representation."""
+        return f"{self.action} ({self.done}/{self.total})"
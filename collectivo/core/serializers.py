@@ -7,10 +7,11 @@ from django.db import models
 from django.utils.module_loading import import_string
 from rest_framework import serializers
 
+from collectivo.utils.permissions import get_user_permissions
 from collectivo.utils.schema import SchemaCondition
 from collectivo.utils.serializers import create_history_serializer
 
-from .models import CoreSettings, Permission, PermissionGroup
+from .models import CoreSettings, Job, Permission, PermissionGroup
 
 User = get_user_model()
 Group = User.groups.field.related_model
@@ -124,9 +125,9 @@ class UserSelfSerializer(serializers.ModelSerializer):
         This field is used internally to determine the permissions of the user.
         """
         perms = {}
-        for name, ext in Permission.objects.filter(
-            groups__in=obj.permission_groups.all()
-        ).values_list("name", "extension__name"):
+        for ext, name in sorted(
+            get_user_permissions(obj).perms, key=lambda p: (p[0] or "", p[1])
+        ):
             if ext in perms:
                 perms[ext].append(name)
             else:
@@ -232,6 +233,16 @@ class UserProfilesSerializer(serializers.ModelSerializer):
         read_only_fields = ["user"]
 
 
+class JobSerializer(serializers.ModelSerializer):
+    """Serializer for the progress of background jobs."""
+
+    class Meta:
+        """Serializer settings."""
+
+        model = Job
+        exclude = ["data", "options"]
+
+
 UserHistorySerializer = create_history_serializer(User)
 PermissionHistorySerializer = create_history_serializer(Permission)
 PermissionGroupHistorySerializer = create_history_serializer(PermissionGroup)
@@ -1,7 +1,23 @@
 """Signals of the core extension."""
 
 from django.contrib.auth.models import User
-from django.db.models.signals import pre_save
+from django.core.signals import request_finished, request_started
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+
+from collectivo.utils.permissions import (
+    clear_permissions_cache,
+    end_request_permissions,
+    start_request_permissions,
+)
+from collectivo.utils.schema import get_choices_models, update_schema_version
+
+from .models import Permission, PermissionGroup
 
 
 def capitalize(value):
@@ -22,3 +38,112 @@ def update_username(sender, instance, **kwargs):
 # Connect the signal to the user model
 # This will only apply if the default user model is used
 pre_save.connect(update_username, sender=User)
+
+
+def clear_groups_permissions_cache(group_ids):
+    """Clear the cached permissions of all users of the given groups."""
+    clear_permissions_cache(
+        User.objects.filter(permission_groups__in=group_ids)
+        .values_list("pk", flat=True)
+        .distinct()
+    )
+
+
+def clear_user_permissions_cache(sender, instance, **kwargs):
+    """Clear the cached permissions of a created or deleted user."""
+    if kwargs.get("created", True):
+        clear_permissions_cache([instance.pk])
+
+
+def clear_group_permissions_cache(sender, instance, **kwargs):
+    """Clear the cached permissions of the users of a changed group."""
+    if not kwargs.get("created", False):
+        clear_groups_permissions_cache([instance.pk])
+
+
+def clear_perm_permissions_cache(sender, instance, **kwargs):
+    """Clear the cached permissions of the users of a changed permission."""
+    if not kwargs.get("created", False):
+        clear_groups_permissions_cache(instance.groups.all())
+
+
+def clear_group_users_cache(sender, instance, action, reverse, pk_set, **kw):
+    """Clear the cached permissions of users that join or leave a group."""
+    if action in ("post_add", "post_remove"):
+        clear_permissions_cache([instance.pk] if reverse else pk_set)
+    elif action == "pre_clear":
+        clear_permissions_cache(
+            [instance.pk]
+            if reverse
+            else instance.users.values_list("pk", flat=True)
+        )
+
+
+def clear_group_perms_cache(sender, instance, action, reverse, pk_set, **kw):
+    """Clear the cached permissions of users whose group permissions change."""
+    if action in ("post_add", "post_remove"):
+        clear_groups_permissions_cache(pk_set if reverse else [instance.pk])
+    elif action == "pre_clear":
+        clear_groups_permissions_cache(
+            instance.groups.all() if reverse else [instance.pk]
+        )
+
+
+request_started.connect(
+    start_request_permissions, dispatch_uid="start_request_permissions"
+)
+request_finished.connect(
+    end_request_permissions, dispatch_uid="end_request_permissions"
+)
+post_save.connect(
+    clear_user_permissions_cache,
+    sender=User,
+    dispatch_uid="clear_user_permissions_cache_save",
+)
+post_delete.connect(
+    clear_user_permissions_cache,
+    sender=User,
+    dispatch_uid="clear_user_permissions_cache_delete",
+)
+post_save.connect(
+    clear_group_permissions_cache,
+    sender=PermissionGroup,
+    dispatch_uid="clear_group_permissions_cache_save",
+)
+pre_delete.connect(
+    clear_group_permissions_cache,
+    sender=PermissionGroup,
+    dispatch_uid="clear_group_permissions_cache_delete",
+)
+post_save.connect(
+    clear_perm_permissions_cache,
+    sender=Permission,
+    dispatch_uid="clear_perm_permissions_cache_save",
+)
+pre_delete.connect(
+    clear_perm_permissions_cache,
+    sender=Permission,
+    dispatch_uid="clear_perm_permissions_cache_delete",
+)
+m2m_changed.connect(
+    clear_group_users_cache,
+    sender=PermissionGroup.users.through,
+    dispatch_uid="clear_group_users_cache",
+)
+m2m_changed.connect(
+    clear_group_perms_cache,
+    sender=PermissionGroup.permissions.through,
+    dispatch_uid="clear_group_perms_cache",
+)
+for model in get_choices_models():
+    label = model._meta.label_lower
+    post_save.connect(
+        update_schema_version,
+        sender=model,
+        dispatch_uid=f"update_schema_version_save_{label}",
+    )
+    post_delete.connect(
+        update_schema_version,
+        sender=model,
+        dispatch_uid=f"update_schema_version_delete_{label}",
+    )
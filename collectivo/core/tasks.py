@@ -3,6 +3,8 @@
 import ping3
 from celery import shared_task
 
+from collectivo.utils.jobs import JobTask, run_job_chunk
+
 
 @shared_task(name="collectivo_core_ping")
 def collectivo_core_ping():
@@ -13,3 +15,14 @@ def collectivo_core_ping():
     except Exception as e:
         print("Task ping collectivo failed with {}".format(e))
         # Todo Send an email to the admins -> should we use the email module?
+
+
+@shared_task(name="collectivo_core_run_job", base=JobTask)
+def run_job_async(job_id: int, start: int = 0):
+    """Run a chunk of a job and queue the next chunk.
+
+    Failed chunks are retried, see collectivo.utils.jobs.JobTask.
+    """
+    next_start = run_job_chunk(job_id, start)
+    if next_start is not None:
+        run_job_async.delay(job_id, next_start)
@@ -1,20 +1,36 @@
 """Tests for the core extension."""
+import json
+
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from keycloak.exceptions import KeycloakDeleteError
 from rest_framework.test import APIClient
 
 from collectivo.auth.keycloak.api import KeycloakAPI
-from collectivo.core.models import Permission, PermissionGroup
+from collectivo.core.models import Job, Permission, PermissionGroup
+from collectivo.core.tasks import run_job_async
 from collectivo.extensions.models import Extension
 from collectivo.menus.models import Menu
-from collectivo.utils.permissions import HasPerm, IsSuperuser
+from collectivo.utils.history import bulk_update_with_history
+from collectivo.utils.permissions import (
+    PERMISSIONS_CACHE_TIMEOUT,
+    PERMISSIONS_LOCAL_CACHE_TIMEOUT,
+    HasPerm,
+    IsSuperuser,
+    get_permissions_cache_timeout,
+)
+from collectivo.utils.schema import get_choices_models
 from collectivo.utils.test import create_testuser
 from collectivo.version import __version__
 
 PROFILES_URL = reverse("collectivo.core:users-extended-list")
+USERS_URL = reverse("collectivo.core:user-list")
+USERS_SCHEMA_URL = reverse("collectivo.core:user-schema")
+JOBS_URL = reverse("collectivo.core:job-list")
 
 
 class CoreSetupTests(TestCase):
@@ -49,6 +65,44 @@ class UserApiTests(TestCase):
         res = self.client.get(PROFILES_URL)
         self.assertEqual(res.status_code, 200)
 
+    def test_users_extended_queries_are_constant(self):
+        """Test that the number of queries does not grow with the users."""
+        self.client.get(PROFILES_URL)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(PROFILES_URL)
+        for i in range(10):
+            get_user_model().objects.create(username=f"user_{i}")
+        with self.assertNumQueries(len(queries)):
+            res = self.client.get(PROFILES_URL)
+        self.assertEqual(res.status_code, 200)
+
+    def test_schema_is_cached(self):
+        """Test that an unchanged schema is served from the cache."""
+        res = self.client.get(USERS_SCHEMA_URL)
+        self.assertEqual(res.status_code, 200)
+        etag = res["ETag"]
+        with self.assertNumQueries(0):
+            res = self.client.get(USERS_SCHEMA_URL)
+        self.assertEqual(res["ETag"], etag)
+        res = self.client.get(USERS_SCHEMA_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 304)
+
+        # Choices are updated when a related object changes
+        group = PermissionGroup.objects.create(name="new group")
+        res = self.client.get(USERS_SCHEMA_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res["ETag"], etag)
+        choices = res.data["fields"]["permission_groups"]["choices"]
+        self.assertIn(str(group.pk), choices)
+
+    def test_schema_choices_models(self):
+        """Test that only models that can be choices invalidate schemas."""
+        choice_models = get_choices_models()
+        self.assertIn(get_user_model(), choice_models)
+        self.assertIn(PermissionGroup, choice_models)
+        self.assertNotIn(Job, choice_models)
+        self.assertNotIn(PermissionGroup.history.model, choice_models)
+
 
 class CoreApiTests(TestCase):
     """Test the core API."""
@@ -124,3 +178,205 @@ class CoreApiTests(TestCase):
         group.save()
         self.user.permission_groups.add(group)
         self.assertTrue(HasPerm().has_permission(request, view))
+
+    def test_permissions_are_cached(self):
+        """Test that permission checks are set lookups after the first one."""
+
+        class SomeGroupView:
+            """View that requires some group."""
+
+            required_perms = {
+                "ALL": [("cached perm", None)],
+            }
+
+        request = RequestFactory().get("/")
+        request.user = self.user
+        view = SomeGroupView()
+        group = PermissionGroup.objects.create(name="cached group")
+        perm = Permission.objects.create(name="cached perm")
+        group.permissions.add(perm)
+        group.users.add(self.user)
+        self.assertTrue(HasPerm().has_permission(request, view))
+        with self.assertNumQueries(0):
+            self.assertTrue(HasPerm().has_permission(request, view))
+            self.assertFalse(IsSuperuser().has_permission(request, view))
+
+        # Cache is cleared when the permissions of a group change
+        group.permissions.remove(perm)
+        self.assertFalse(HasPerm().has_permission(request, view))
+        group.permissions.add(perm)
+        self.assertTrue(HasPerm().has_permission(request, view))
+
+        # Cache is cleared when the users of a group change
+        group.users.clear()
+        self.assertFalse(HasPerm().has_permission(request, view))
+
+    def test_permissions_cache_timeout(self):
+        """Test that a process-local cache only keeps permissions shortly."""
+        self.assertEqual(
+            get_permissions_cache_timeout(), PERMISSIONS_LOCAL_CACHE_TIMEOUT
+        )
+        redis = "django.core.cache.backends.redis.RedisCache"
+        with self.settings(
+            CACHES={"default": {"BACKEND": redis, "LOCATION": "redis://"}}
+        ):
+            self.assertEqual(
+                get_permissions_cache_timeout(), PERMISSIONS_CACHE_TIMEOUT
+            )
+
+
+class PaginationTests(TestCase):
+    """Test the pagination of list endpoints."""
+
+    def setUp(self):
+        """Create users with equal and empty ordering values."""
+        self.client = APIClient()
+        self.client.force_authenticate(create_testuser(superuser=True))
+        for i in range(12):
+            get_user_model().objects.create(
+                username=f"page_{i:02d}",
+                last_name=f"Page {11 - i:02d}",
+                first_name=f"Name {i % 3}" if i % 4 else "",
+            )
+
+    def get_all_pages(self, ordering, limit=5):
+        """Get the ids of all users page by page with a cursor."""
+        url = USERS_URL + f"?cursor=&limit={limit}&ordering={ordering}"
+        ids = []
+        while url:
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, 200)
+            self.assertIsNone(res.data["count"])
+            self.assertLessEqual(len(res.data["results"]), limit)
+            ids += [user["id"] for user in res.data["results"]]
+            url = res.data["next"]
+        return ids
+
+    def test_cursor_pagination(self):
+        """Test that cursor pages contain each object once and in order."""
+        users = get_user_model().objects.all()
+        self.assertEqual(
+            self.get_all_pages("last_name"),
+            list(
+                users.order_by("last_name", "pk").values_list("pk", flat=True)
+            ),
+        )
+        self.assertEqual(
+            self.get_all_pages("-id", limit=4),
+            list(users.order_by("-pk").values_list("pk", flat=True)),
+        )
+        ids = self.get_all_pages("first_name")
+        self.assertEqual(
+            sorted(ids), sorted(users.values_list("pk", flat=True))
+        )
+
+    def test_cursor_validation(self):
+        """Test that invalid orderings and cursors are rejected."""
+        for query in [
+            "ordering=password",
+            "ordering=username,id",
+            "cursor=invalid",
+            "count=all",
+        ]:
+            res = self.client.get(USERS_URL + f"?cursor=&{query}")
+            self.assertEqual(res.status_code, 400, query)
+
+    def test_count_modes(self):
+        """Test that counting objects can be skipped or estimated."""
+        total = get_user_model().objects.count()
+        res = self.client.get(USERS_URL + "?limit=5")
+        self.assertEqual(res.data["count"], total)
+        res = self.client.get(USERS_URL + "?cursor=&limit=5&count=estimate")
+        self.assertEqual(res.data["count"], total)
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(USERS_URL + "?limit=5&offset=5&count=none")
+        self.assertIsNone(res.data["count"])
+        self.assertIn("offset=10", res.data["next"])
+        self.assertFalse(
+            any("COUNT" in q["sql"] for q in queries.captured_queries)
+        )
+
+
+class HistoryTests(TestCase):
+    """Test that historical records are only written for changes."""
+
+    def setUp(self):
+        """Create users with a history."""
+        self.user = get_user_model().objects.create(username="history_1")
+        self.other = get_user_model().objects.create(username="history_2")
+
+    def test_unchanged_save(self):
+        """Test that saves without changes do not write a record."""
+        self.user.save()
+        self.assertEqual(self.user.history.count(), 1)
+        self.user.first_name = "Changed"
+        self.user.save()
+        self.assertEqual(self.user.history.count(), 2)
+        self.assertEqual(self.user.history.first().first_name, "Changed")
+
+    def test_register_unchanged(self):
+        """Test that registering an unchanged object does not save it."""
+        perm = Permission.objects.register(name="history_test", label="A")
+        Permission.objects.register(name="history_test", label="A")
+        self.assertEqual(perm.history.count(), 1)
+        Permission.objects.register(name="history_test", label="B")
+        self.assertEqual(perm.history.count(), 2)
+
+    def test_bulk_update_with_history(self):
+        """Test that bulk updates only record changed objects."""
+        self.user.first_name = "Changed"
+        changed = bulk_update_with_history(
+            [self.user, self.other], get_user_model(), ["first_name"]
+        )
+        self.assertEqual(changed, [self.user])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, "Changed")
+        self.assertEqual(self.user.history.count(), 2)
+        self.assertEqual(self.other.history.count(), 1)
+
+
+class JobTests(TestCase):
+    """Test the progress of background jobs."""
+
+    def setUp(self):
+        """Create a user with a job and a job of another user."""
+        self.client = APIClient()
+        self.user = create_testuser()
+        self.client.force_authenticate(self.user)
+        self.job = Job.objects.create(
+            action="view.method", user=self.user, total=2, data=[1, 2]
+        )
+        self.other = Job.objects.create(action="view.method", total=1)
+
+    def test_list_own_jobs(self):
+        """Test that users can only see their own jobs."""
+        res = self.client.get(JOBS_URL)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([job["id"] for job in res.data], [self.job.pk])
+        self.assertNotIn("data", res.data[0])
+        url = reverse("collectivo.core:job-detail", args=[self.other.pk])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_events(self):
+        """Test that the state of a finished job is streamed as an event."""
+        self.job.status = "success"
+        self.job.done = 2
+        self.job.save()
+        url = reverse("collectivo.core:job-events", args=[self.job.pk])
+        res = self.client.get(url, HTTP_ACCEPT="text/event-stream")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res["Content-Type"], "text/event-stream")
+        events = b"".join(res.streaming_content).decode().split("\n\n")
+        self.assertEqual(len(events), 2)
+        self.assertTrue(events[0].startswith("data: "))
+        self.assertEqual(json.loads(events[0][6:])["status"], "success")
+
+    def test_failure(self):
+        """Test that a job is marked as failed after its last retry."""
+        run_job_async.on_failure(
+            ValueError("Error"), "task", (self.job.pk,), {}, None
+        )
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, "failure")
+        self.assertEqual(self.job.status_message, "Error")
+        self.assertIsNotNone(self.job.date_finished)
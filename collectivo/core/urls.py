@@ -24,6 +24,7 @@ router.register(
     views.PermissionGroupHistoryViewSet,
     basename="groups-history",
 )
+router.register("jobs", views.JobViewSet, basename="job")
 
 router_dd = DirectDetailRouter()
 router_dd.register("settings", views.CoreSettingsViewSet, basename="settings")
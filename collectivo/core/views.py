@@ -1,13 +1,17 @@
 """Views of the core extension."""
 from django.contrib.auth import get_user_model
+from django.http import StreamingHttpResponse
 from drf_spectacular.utils import OpenApiResponse, extend_schema
 from rest_framework import mixins, viewsets
+from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from collectivo.utils.filters import get_filterset, get_ordering_fields
-from collectivo.utils.mixins import SchemaMixin
+from collectivo.utils.jobs import EventStreamRenderer, stream_job_events
+from collectivo.utils.mixins import OptimizeQuerysetMixin, SchemaMixin
 from collectivo.utils.permissions import (
     HasPerm,
     IsSuperuser,
@@ -157,7 +161,10 @@ class UserProfileViewSet(
 
 
 class UserProfilesViewSet(
-    SchemaMixin, mixins.ListModelMixin, viewsets.GenericViewSet
+    SchemaMixin,
+    OptimizeQuerysetMixin,
+    mixins.ListModelMixin,
+    viewsets.GenericViewSet,
 ):
     """Viewset for django users including all their profiles."""
 
@@ -169,3 +176,44 @@ class UserProfilesViewSet(
     }
     filterset_class = get_filterset(serializers.UserProfilesSerializer)
     ordering_fields = get_ordering_fields(serializers.UserProfilesSerializer)
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """Viewset for the progress of background jobs.
+
+    Users can see their own jobs, superusers can see all jobs. The action
+    'events' streams the progress of a job as server-sent events.
+    """
+
+    queryset = models.Job.objects.all()
+    serializer_class = serializers.JobSerializer
+    permission_classes = [IsAuthenticated]
+    filterset_class = get_filterset(serializers.JobSerializer)
+    ordering_fields = get_ordering_fields(serializers.JobSerializer)
+
+    def get_queryset(self):
+        """Return the jobs of the user, or all jobs for superusers."""
+        queryset = super().get_queryset()
+        if not self.request.user.is_superuser:
+            queryset = queryset.filter(user=self.request.user)
+        return queryset
+
+    @extend_schema(responses={200: OpenApiResponse()})
+    @action(
+        detail=True,
+        url_path="events",
+        url_name="events",
+        renderer_classes=[JSONRenderer, EventStreamRenderer],
+    )
+    def events(self, request, pk=None):
+        """Stream the state of a job until it is finished."""
+        job = self.get_object()
+        response = StreamingHttpResponse(
+            stream_job_events(
+                job.pk, lambda job: self.get_serializer(job).data
+            ),
+            content_type="text/event-stream",
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
@@ -1,10 +1,10 @@
 """Models of the dashboard extension."""
 from django.db import models
-from simple_history.models import HistoricalRecords
 
 from collectivo.core.models import Permission
 from collectivo.extensions.models import Extension
 from collectivo.utils import get_instance
+from collectivo.utils.history import HistoricalRecords
 from collectivo.utils.managers import NameManager
 from collectivo.utils.models import NameLabelModel
 
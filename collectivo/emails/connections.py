@@ -0,0 +1,141 @@
+"""Pooled connections to the email backend."""
+import logging
+import threading
+import time
+from collections import deque
+from smtplib import SMTPServerDisconnected
+
+from celery.signals import worker_process_shutdown
+from django.core import mail
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = 2
+MAX_IDLE_TIME = 60  # Seconds
+RECONNECT_ERRORS = (SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+class ConnectionPool:
+    """A pool of open connections to the email backend of a worker.
+
+    Connections stay open between batches, so that each batch does not need
+    its own handshake with the server. Idle connections are checked before
+    they are reused, and lost connections are opened again.
+    """
+
+    def __init__(self, size: int = POOL_SIZE, max_idle_time=MAX_IDLE_TIME):
+        """Initialize an empty pool."""
+        self.size = size
+        self.max_idle_time = max_idle_time
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self.metrics = {
+            "handshakes": 0,
+            "reconnects": 0,
+            "batches": 0,
+            "messages": 0,
+            "send_time": 0.0,
+        }
+
+    def open(self):
+        """Open a new connection."""
+        connection = mail.get_connection()
+        connection.open()
+        with self._lock:
+            self.metrics["handshakes"] += 1
+        return connection
+
+    def close(self, connection):
+        """Close a connection and ignore errors of lost connections."""
+        try:
+            connection.close()
+        except Exception as e:
+            logger.debug("Error closing email connection: %s", e)
+
+    def is_healthy(self, connection, last_used: float) -> bool:
+        """Check if an idle connection can be reused."""
+        if time.monotonic() - last_used > self.max_idle_time:
+            return False
+        server = getattr(connection, "connection", None)
+        if server is None:
+            # Backends without a server connection, e.g. for tests
+            return True
+        try:
+            return server.noop()[0] == 250
+        except Exception:
+            return False
+
+    def acquire(self):
+        """Get a healthy connection from the pool or open a new one."""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                connection, last_used = self._idle.pop()
+            if self.is_healthy(connection, last_used):
+                return connection
+            self.close(connection)
+        return self.open()
+
+    def release(self, connection):
+        """Return a connection to the pool or close it if the pool is full."""
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((connection, time.monotonic()))
+                return
+        self.close(connection)
+
+    def close_all(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+        for connection, _ in idle:
+            self.close(connection)
+
+    def send_messages(self, emails: list) -> int:
+        """Send emails with a pooled connection.
+
+        If the connection is lost, a new connection is opened and the
+        remaining emails are sent again once. Returns the number of sent
+        emails.
+        """
+        start = time.monotonic()
+        connection = self.acquire()
+        n_sent = 0
+        try:
+            for email in emails:
+                try:
+                    n_sent += connection.send_messages([email]) or 0
+                except RECONNECT_ERRORS as e:
+                    logger.warning("Reconnecting to email server: %s", e)
+                    self.close(connection)
+                    connection = self.open()
+                    with self._lock:
+                        self.metrics["reconnects"] += 1
+                    n_sent += connection.send_messages([email]) or 0
+        except Exception:
+            self.close(connection)
+            raise
+        self.release(connection)
+        with self._lock:
+            self.metrics["batches"] += 1
+            self.metrics["messages"] += n_sent
+            self.metrics["send_time"] += time.monotonic() - start
+        return n_sent
+
+    def get_metrics(self) -> dict:
+        """Get the metrics of this pool, including the average latency."""
+        with self._lock:
+            metrics = dict(self.metrics)
+        batches = metrics["batches"]
+        metrics["latency"] = metrics["send_time"] / batches if batches else 0
+        return metrics
+
+
+pool = ConnectionPool()
+
+
+@worker_process_shutdown.connect(weak=False)
+def close_connections(**kwargs):
+    """Close the pooled connections when a worker stops."""
+    pool.close_all()
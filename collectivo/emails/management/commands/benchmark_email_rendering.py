@@ -0,0 +1,104 @@
+"""Command to benchmark the rendering of emails."""
+import time
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.core.mail import EmailMultiAlternatives
+from django.core.management.base import BaseCommand
+from django.template import Context, Template
+from html2text import html2text
+
+from collectivo.emails.rendering import EMAIL_BATCH_SIZE, EmailRenderer
+
+User = get_user_model()
+
+DESIGN = "<html><body><h1>Newsletter</h1>{{content}}</body></html>"
+BODY = "<p>Hello {{ user.first_name }},</p>" + "<p>Some news.</p>" * 20
+STATIC_BODY = "<p>Hello everyone,</p>" + "<p>Some news.</p>" * 20
+
+
+def render_per_recipient(body, recipients):
+    """Render emails with a template compiled for each recipient."""
+    body = DESIGN.replace("{{content}}", body)
+    emails = []
+    for recipient in recipients:
+        body_html = Template(body).render(Context({"user": recipient}))
+        email = EmailMultiAlternatives(
+            "Subject", html2text(body_html), None, [recipient.email]
+        )
+        email.attach_alternative(body_html, "text/html")
+        emails.append(email)
+    n = EMAIL_BATCH_SIZE
+    for i in range(0, len(emails), n):
+        yield emails[i : i + n]
+
+
+def render_with_renderer(body, recipients):
+    """Render emails with a compiled template, batch by batch."""
+
+    class Design:
+        body = DESIGN
+
+    yield from EmailRenderer(Design, "Subject", body).render_batches(
+        recipients
+    )
+
+
+class Command(BaseCommand):
+    """Compare the rendering of emails per recipient and per campaign."""
+
+    help = "Benchmark the rendering of emails for synthetic recipients."
+
+    def add_arguments(self, parser):
+        """Add arguments of the command."""
+        parser.add_argument(
+            "--recipients",
+            type=int,
+            default=10000,
+            help="Number of synthetic recipients.",
+        )
+        parser.add_argument(
+            "--memory",
+            action="store_true",
+            help="Measure peak memory (slows down rendering).",
+        )
+
+    def measure(self, render, body, recipients, memory=False):
+        """Return seconds and peak memory to render and consume batches."""
+        if memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        for batch in render(body, recipients):
+            pass
+        seconds = time.perf_counter() - start
+        if not memory:
+            return seconds, None
+        peak = tracemalloc.get_traced_memory()[1] / 1024**2
+        tracemalloc.stop()
+        return seconds, peak
+
+    def handle(self, *args, **options):
+        """Run the benchmark and print the results."""
+        recipients = [
+            User(
+                pk=i,
+                first_name=f"Recipient {i}",
+                email=f"recipient_{i}@example.com",
+            )
+            for i in range(options["recipients"])
+        ]
+        for label, body in [
+            ("personalized", BODY),
+            ("static", STATIC_BODY),
+        ]:
+            for name, render in [
+                ("per recipient", render_per_recipient),
+                ("renderer", render_with_renderer),
+            ]:
+                seconds, peak = self.measure(
+                    render, body, recipients, options["memory"]
+                )
+                result = f"{label} body, {name}: {seconds:.2f}s"
+                if peak is not None:
+                    result += f", peak memory {peak:.1f} MiB"
+                self.stdout.write(result)
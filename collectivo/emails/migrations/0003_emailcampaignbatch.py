@@ -0,0 +1,46 @@
+# Generated by Django 4.1.13 on 2026-10-18 10:28
+
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0002_alter_emailcampaign_recipients_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailcampaign',
+            name='context',
+            field=models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder, help_text='The context that is used to render the emails.'),
+        ),
+        migrations.AddField(
+            model_name='historicalemailcampaign',
+            name='context',
+            field=models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder, help_text='The context that is used to render the emails.'),
+        ),
+        migrations.CreateModel(
+            name='EmailCampaignBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('admin', models.BooleanField(default=False, help_text='If checked, the batch is sent to the admin recipients.')),
+                ('first_recipient', models.PositiveIntegerField()),
+                ('last_recipient', models.PositiveIntegerField()),
+                ('size', models.PositiveIntegerField()),
+                ('recipient_contexts', models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('success', 'success'), ('failure', 'failure')], default='pending', max_length=10)),
+                ('status_message', models.CharField(max_length=255, null=True)),
+                ('n_sent', models.PositiveIntegerField(default=0)),
+                ('sent', models.DateTimeField(null=True)),
+                ('campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='batches', to='emails.emailcampaign')),
+            ],
+            options={
+                'ordering': ['campaign', 'index'],
+                'unique_together': {('campaign', 'index')},
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.1.13 on 2026-10-18 10:35
+
+from django.conf import settings
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('emails', '0003_emailcampaignbatch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailTrigger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(blank=True, help_text='Triggers with the same key are merged, e.g. per object.', max_length=255)),
+                ('context', models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('automation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='triggers', to='emails.emailautomation')),
+                ('recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='email_triggers', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('automation', 'recipient', 'key')},
+            },
+        ),
+    ]
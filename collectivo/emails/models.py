@@ -1,17 +1,28 @@
 """Models of the emails module."""
-from celery import chain
-from django.conf import settings
+import logging
+from datetime import timedelta
+
+from celery import chord
 from django.contrib.auth import get_user_model
-from django.core.mail import EmailMultiAlternatives
-from django.db import models
-from django.template import Context, Template
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models import Q
 from django.utils import timezone
-from html2text import html2text
-from simple_history.models import HistoricalRecords
 
+from collectivo.utils.history import HistoricalRecords
 from collectivo.utils.managers import NameManager
 
-from .tasks import send_mails_async, send_mails_async_end
+from .rendering import (
+    EMAIL_BATCH_SIZE,
+    EmailRenderer,
+    deserialize_contexts,
+    serialize_context,
+)
+from .tasks import complete_campaign, fail_campaign, send_mails_async
+
+logger = logging.getLogger(__name__)
+
+EMAIL_TRIGGER_DELAY = 60  # Seconds
 
 
 class EmailAutomation(models.Model):
@@ -74,8 +85,11 @@ class EmailAutomation(models.Model):
         blank=True,
     )
 
-    def send(self, recipients, context=None):
-        """Send emails to recipients."""
+    def send(self, recipients, context=None, recipient_contexts=None):
+        """Send emails to recipients.
+
+        The optional recipient_contexts map recipient ids to extra context.
+        """
         if self.is_active:
             campaign = EmailCampaign.objects.create(
                 automation=self,
@@ -83,7 +97,30 @@ class EmailAutomation(models.Model):
             )
             campaign.recipients.set(recipients)
             campaign.save()
-            campaign.send(context=context)
+            campaign.send(
+                context=context, recipient_contexts=recipient_contexts
+            )
+
+    def queue(self, recipients, context=None, key=""):
+        """Record a trigger to send emails to recipients later.
+
+        Triggers are collected and sent together by EmailTrigger.send_all.
+        Triggers with the same key for the same recipient are recorded once.
+        The context is used as the recipient context of the emails.
+        """
+        if self.is_active:
+            EmailTrigger.objects.bulk_create(
+                [
+                    EmailTrigger(
+                        automation=self,
+                        recipient_id=getattr(recipient, "pk", recipient),
+                        key=key,
+                        context=serialize_context(context),
+                    )
+                    for recipient in recipients
+                ],
+                ignore_conflicts=True,
+            )
 
 
 class EmailDesign(models.Model):
@@ -151,86 +188,298 @@ class EmailCampaign(models.Model):
         blank=True,
         help_text="The extension that created this campaign.",
     )
+    context = models.JSONField(
+        default=dict,
+        blank=True,
+        encoder=DjangoJSONEncoder,
+        help_text="The context that is used to render the emails.",
+    )
 
     def __str__(self):
         """Return a string representation of the object."""
         return f"{self.template.name} ({self.sent})"
 
-    def send(self, context=None):
-        """Send emails to recipients."""
+    def send(self, context=None, recipient_contexts=None):
+        """Send emails to recipients.
+
+        The campaign is split into batches of recipient id ranges, which are
+        rendered and sent in parallel by a chord of async tasks. The tasks
+        are queued after the current transaction has been committed. Model
+        instances in the contexts are stored as references and loaded again
+        by the workers.
+        """
         campaign = self
+        recipients = self.recipients.all()
+        missing = recipients.filter(Q(email__isnull=True) | Q(email=""))
+        if missing.exists():
+            self.status = "failure"
+            self.status_message = f"{missing.first()} has no email."
+            self.save()
+            raise ValueError(self.status_message)
+
         campaign.sent = timezone.now()
         campaign.status = "pending"
+        campaign.context = serialize_context(context)
         campaign.save()
+        campaign.batches.all().delete()
 
-        # Generate emails from automation
+        # Create batches from automation or template
+        batches = []
         if self.automation:
-            email_batches = self.create_email_batches(
-                self.automation.admin_design,
-                self.automation.admin_subject,
-                self.automation.admin_body,
-                self.automation.admin_recipients.all(),
-                context=context,
+            batches += self.create_email_batches(
+                self.automation.admin_recipients.all(), admin=True
             )
-            if not self.automation.admin_only:
-                email_batches += self.create_email_batches(
-                    self.automation.design,
-                    self.automation.subject,
-                    self.automation.body,
-                    self.recipients.all(),
-                    context=context,
-                )
-
-        # Generate emails from template
-        else:
-            email_batches = self.create_email_batches(
-                self.campaign.template.design,
-                self.campaign.template.subject,
-                self.campaign.template.body,
-                self.recipients.all(),
-                context=context,
+        if not (self.automation and self.automation.admin_only):
+            batches += self.create_email_batches(
+                recipients, recipient_contexts=recipient_contexts
             )
+        for index, batch in enumerate(batches):
+            batch.index = index
+        EmailCampaignBatch.objects.bulk_create(batches)
+
+        # Send batches in parallel and complete the campaign afterwards
+        tasks = [send_mails_async.s(self.pk, batch.pk) for batch in batches]
+
+        def send_batches():
+            try:
+                chord(tasks)(
+                    complete_campaign.s(campaign.pk).on_error(
+                        fail_campaign.s(campaign.pk)
+                    )
+                )
+            except Exception as e:
+                EmailCampaign.objects.filter(pk=campaign.pk).update(
+                    status="failure", status_message=str(e)[:255]
+                )
+                raise e
 
-        # Create a chain of async tasks to send emails
-        results = {"n_sent": 0, "campaign": self}
-        tasks = []
-        tasks.append(send_mails_async.s(results, email_batches.pop(0)))
-        for email_batch in email_batches:
-            tasks.append(send_mails_async.s(email_batch))
-        tasks.append(send_mails_async_end.s())
-        try:
-            chain(*tasks)()
-        except Exception as e:
-            self.status = "failure"
-            self.status_message = str(e)
-            self.save()
-            raise e
+        # Workers can only load the batches once they have been committed
+        transaction.on_commit(send_batches)
 
     def create_email_batches(
-        self, design, subject, body, recipients, context=None
+        self, recipients, admin=False, recipient_contexts=None
     ):
-        """Create a list of emails, split into batches."""
-
-        if design is not None:
-            body = design.body.replace("{{content}}", body)
-        from_email = settings.DEFAULT_FROM_EMAIL
-        emails = []
-        for recipient in recipients:
-            body_html = Template(body).render(
-                Context({"user": recipient, **(context or {})})
-            )
-            body_text = html2text(body_html)
-            if recipient.email in (None, ""):
-                self.status = "failure"
-                self.status_message = f"{recipient} has no email."
-                self.save()
-                raise ValueError(self.status_message)
-            email = EmailMultiAlternatives(
-                subject, body_text, from_email, [recipient.email]
+        """Split recipients into batches of recipient id ranges."""
+        recipient_contexts = recipient_contexts or {}
+        pks = list(recipients.order_by("pk").values_list("pk", flat=True))
+        batches = []
+        for i in range(0, len(pks), EMAIL_BATCH_SIZE):
+            batch_pks = pks[i : i + EMAIL_BATCH_SIZE]
+            batches.append(
+                EmailCampaignBatch(
+                    campaign=self,
+                    admin=admin,
+                    first_recipient=batch_pks[0],
+                    last_recipient=batch_pks[-1],
+                    size=len(batch_pks),
+                    recipient_contexts={
+                        pk: serialize_context(recipient_contexts[pk])
+                        for pk in batch_pks
+                        if pk in recipient_contexts
+                    },
+                )
             )
-            email.attach_alternative(body_html, "text/html")
-            emails.append(email)
+        return batches
+
+    def get_tag(self):
+        """Get the tag that is added to the recipients, if any."""
+        # TODO: Make tag optional for loose coupling
+        template_tag = getattr(self.template, "tag", None)
+        return getattr(template_tag, "tag", None)
+
+    def get_renderer(self, admin=False, recipient_contexts=None):
+        """Get a renderer for the emails of this campaign."""
+        if self.automation and admin:
+            source = [
+                self.automation.admin_design,
+                self.automation.admin_subject,
+                self.automation.admin_body,
+            ]
+        elif self.automation:
+            source = [
+                self.automation.design,
+                self.automation.subject,
+                self.automation.body,
+            ]
+        else:
+            source = [
+                self.template.design,
+                self.template.subject,
+                self.template.body,
+            ]
+        return EmailRenderer(
+            *source,
+            context=deserialize_contexts([self.context])[0],
+            recipient_contexts=recipient_contexts,
+        )
+
+
+class EmailCampaignBatch(models.Model):
+    """A batch of emails of a campaign that is sent by one task.
+
+    Recipients are stored as a range of ids, since workers render the emails
+    of a batch from the database.
+    """
+
+    class Meta:
+        """Model settings."""
+
+        ordering = ["campaign", "index"]
+        unique_together = ("campaign", "index")
 
-        # Split recipients into batches
-        n = 20  # TODO Get this number from the settings
-        return [emails[i : i + n] for i in range(0, len(emails), n)]
+    campaign = models.ForeignKey(
+        "emails.EmailCampaign",
+        on_delete=models.CASCADE,
+        related_name="batches",
+    )
+    index = models.PositiveIntegerField()
+    admin = models.BooleanField(
+        default=False,
+        help_text="If checked, the batch is sent to the admin recipients.",
+    )
+    first_recipient = models.PositiveIntegerField()
+    last_recipient = models.PositiveIntegerField()
+    size = models.PositiveIntegerField()
+    recipient_contexts = models.JSONField(
+        default=dict, blank=True, encoder=DjangoJSONEncoder
+    )
+    status = models.CharField(
+        max_length=10,
+        default="pending",
+        choices=[
+            ("pending", "pending"),
+            ("success", "success"),
+            ("failure", "failure"),
+        ],
+    )
+    status_message = models.CharField(max_length=255, null=True)
+    n_sent = models.PositiveIntegerField(default=0)
+    sent = models.DateTimeField(null=True)
+
+    def __str__(self):
+        """Return a string representation of the object."""
+        return f"{self.campaign_id} ({self.index})"
+
+    def get_recipients(self):
+        """Get the recipients of this batch."""
+        if self.admin:
+            recipients = self.campaign.automation.admin_recipients.all()
+        else:
+            recipients = self.campaign.recipients.all()
+        return recipients.filter(
+            pk__gte=self.first_recipient, pk__lte=self.last_recipient
+        ).order_by("pk")
+
+    def render(self, recipients) -> list:
+        """Render the emails of this batch."""
+        pks = list(self.recipient_contexts.keys())
+        contexts = deserialize_contexts(list(self.recipient_contexts.values()))
+        renderer = self.campaign.get_renderer(
+            admin=self.admin,
+            recipient_contexts={
+                int(pk): context for pk, context in zip(pks, contexts)
+            },
+        )
+        return [renderer.render(recipient) for recipient in recipients]
+
+
+class EmailTrigger(models.Model):
+    """A triggered automation that waits to be sent to a recipient."""
+
+    class Meta:
+        """Model settings."""
+
+        unique_together = ("automation", "recipient", "key")
+
+    automation = models.ForeignKey(
+        "emails.EmailAutomation",
+        on_delete=models.CASCADE,
+        related_name="triggers",
+    )
+    recipient = models.ForeignKey(
+        get_user_model(),
+        on_delete=models.CASCADE,
+        related_name="email_triggers",
+    )
+    key = models.CharField(
+        max_length=255,
+        blank=True,
+        help_text="Triggers with the same key are merged, e.g. per object.",
+    )
+    context = models.JSONField(
+        default=dict, blank=True, encoder=DjangoJSONEncoder
+    )
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        """Return a string representation of the object."""
+        return f"{self.automation_id} ({self.recipient_id})"
+
+    @classmethod
+    def send_all(cls, delay: int = EMAIL_TRIGGER_DELAY) -> int:
+        """Send triggered automations as one campaign per automation.
+
+        Only triggers that are older than the delay in seconds are sent, so
+        that triggers of successive changes are merged. If a recipient has
+        multiple triggers of one automation, the others are sent in the next
+        run. Automations that cannot be sent are logged and their triggers
+        are kept for the next run. Triggers of recipients without an email
+        are dropped. Returns the number of sent triggers.
+        """
+        before = timezone.now() - timedelta(seconds=delay)
+        automations = (
+            cls.objects.filter(created__lte=before)
+            .values_list("automation", flat=True)
+            .distinct()
+            .order_by()
+        )
+        sent = 0
+        for automation_id in list(automations):
+            try:
+                sent += cls.send_automation(automation_id, before)
+            except Exception:
+                logger.exception(
+                    "Triggers of automation %s could not be sent",
+                    automation_id,
+                )
+        return sent
+
+    @classmethod
+    @transaction.atomic
+    def send_automation(cls, automation_id: int, before) -> int:
+        """Send the triggers of an automation that were created before a date.
+
+        The triggers are locked while they are sent and deleted afterwards
+        in the same transaction. Triggers of recipients without an email
+        are logged and deleted without being sent. Returns the number of
+        sent triggers.
+        """
+        triggers = (
+            cls.objects.select_for_update(skip_locked=True, of=("self",))
+            .filter(automation=automation_id, created__lte=before)
+            .select_related("automation", "recipient")
+            .order_by("pk")
+        )
+        group = {}
+        dropped = []
+        for trigger in triggers:
+            if not trigger.recipient.email:
+                logger.warning(
+                    "Trigger of automation %s dropped, %s has no email",
+                    automation_id,
+                    trigger.recipient,
+                )
+                dropped.append(trigger.pk)
+            else:
+                group.setdefault(trigger.recipient_id, trigger)
+        if group:
+            automation = next(iter(group.values())).automation
+            automation.send(
+                list(group.keys()),
+                recipient_contexts={
+                    pk: trigger.context for pk, trigger in group.items()
+                },
+            )
+        sent = [trigger.pk for trigger in group.values()]
+        cls.objects.filter(pk__in=sent + dropped).delete()
+        return len(group)
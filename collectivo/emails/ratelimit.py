@@ -0,0 +1,113 @@
+"""Rate limiting of emails that are sent by multiple workers."""
+import logging
+import threading
+import time
+
+from celery import current_app
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATE_LIMIT = 20  # Messages per second
+RATE_LIMIT_KEY = "collectivo.emails.ratelimit.{}"
+
+# Token bucket that refills and reserves tokens atomically with the clock of
+# the redis server. Tokens can become negative, the caller then waits until
+# they are refilled.
+RATE_LIMIT_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "time")
+local tokens = tonumber(bucket[1]) or capacity
+local last = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - last) * rate)
+tokens = tokens - requested
+redis.call("HSET", KEYS[1], "tokens", tokens, "time", now)
+redis.call("EXPIRE", KEYS[1], math.ceil(capacity / rate) + 60)
+if tokens >= 0 then
+    return "0"
+end
+return tostring(-tokens / rate)
+"""
+
+
+def get_rate_limit(backend: str = None) -> float:
+    """Get the messages per second that can be sent with an email backend.
+
+    Limits are configured per backend in the settings of the extension,
+    e.g. {"rate_limits": {"default": 20}}.
+    """
+    config = settings.COLLECTIVO["extensions"].get("collectivo.emails") or {}
+    limits = config.get("rate_limits") or {}
+    backend = backend or settings.EMAIL_BACKEND
+    return float(
+        limits.get(backend, limits.get("default", DEFAULT_RATE_LIMIT))
+    )
+
+
+class TokenBucket:
+    """A token bucket that is shared between workers.
+
+    The bucket is stored in the result backend of celery if it is a redis
+    backend. Otherwise, or if the backend cannot be reached, it is only
+    shared between the threads of one process.
+    """
+
+    _buckets = {}
+    _lock = threading.Lock()
+    _scripts = {}
+
+    def __init__(self, name: str, rate: float, capacity: float = None):
+        """Set the refill rate per second and the capacity of the bucket."""
+        self.key = RATE_LIMIT_KEY.format(name)
+        self.rate = rate
+        self.capacity = capacity or rate
+
+    def get_script(self):
+        """Get the token bucket script of the result backend, if possible."""
+        client = getattr(current_app.backend, "client", None)
+        if client is None or not hasattr(client, "register_script"):
+            return None
+        if id(client) not in self._scripts:
+            self._scripts[id(client)] = client.register_script(
+                RATE_LIMIT_SCRIPT
+            )
+        return self._scripts[id(client)]
+
+    def reserve(self, tokens: int) -> float:
+        """Reserve tokens and return the seconds to wait until they exist."""
+        script = self.get_script()
+        if script is not None:
+            try:
+                return float(
+                    script(
+                        keys=[self.key],
+                        args=[self.rate, self.capacity, tokens],
+                    )
+                )
+            except Exception as e:
+                logger.warning("Using a local rate limit: %s", e)
+        with self._lock:
+            now = time.monotonic()
+            available, last = self._buckets.get(self.key, (self.capacity, now))
+            available = min(
+                self.capacity, available + max(0, now - last) * self.rate
+            )
+            available -= tokens
+            self._buckets[self.key] = (available, now)
+        return max(0, -available / self.rate)
+
+    def acquire(self, tokens: int):
+        """Wait until tokens are available."""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+
+def get_token_bucket(backend: str = None) -> TokenBucket:
+    """Get the shared token bucket of an email backend."""
+    backend = backend or settings.EMAIL_BACKEND
+    return TokenBucket(backend, get_rate_limit(backend))
@@ -0,0 +1,122 @@
+"""Rendering of emails."""
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.db import models
+from django.template import Context, Template
+from html2text import html2text
+
+EMAIL_BATCH_SIZE = 20  # TODO Get this number from the settings
+
+
+class EmailRenderer:
+    """Render emails for recipients with a template that is compiled once.
+
+    The text alternative of an email is reused as long as the rendered HTML
+    does not change, e.g. if the body does not depend on the recipient.
+    """
+
+    def __init__(
+        self,
+        design,
+        subject,
+        body,
+        context=None,
+        recipient_contexts=None,
+    ):
+        """Merge design and body and compile the template."""
+        if design is not None:
+            body = design.body.replace("{{content}}", body)
+        self.subject = subject
+        self.template = Template(body)
+        self.context = context or {}
+        self.recipient_contexts = recipient_contexts or {}
+        self.from_email = settings.DEFAULT_FROM_EMAIL
+        self._html = None
+        self._text = None
+
+    def render_text(self, body_html: str) -> str:
+        """Convert HTML to text, reusing the last result if possible."""
+        if body_html != self._html:
+            self._html = body_html
+            self._text = html2text(body_html)
+        return self._text
+
+    def render(self, recipient) -> EmailMultiAlternatives:
+        """Render the email for a recipient."""
+        if recipient.email in (None, ""):
+            raise ValueError(f"{recipient} has no email.")
+        body_html = self.template.render(
+            Context(
+                {
+                    "user": recipient,
+                    **self.context,
+                    **self.recipient_contexts.get(recipient.pk, {}),
+                }
+            )
+        )
+        email = EmailMultiAlternatives(
+            self.subject,
+            self.render_text(body_html),
+            self.from_email,
+            [recipient.email],
+        )
+        email.attach_alternative(body_html, "text/html")
+        return email
+
+    def render_batches(self, recipients, batch_size=EMAIL_BATCH_SIZE):
+        """Render emails lazily and yield them in batches."""
+        batch = []
+        for recipient in recipients:
+            batch.append(self.render(recipient))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def serialize_context(context: dict) -> dict:
+    """Replace model instances in a context with references to them.
+
+    The result can be stored as JSON and passed to workers, which load the
+    referenced objects again with deserialize_contexts.
+    """
+    return {
+        key: {"model": value._meta.label_lower, "pk": value.pk}
+        if isinstance(value, models.Model)
+        else value
+        for key, value in (context or {}).items()
+    }
+
+
+def _is_reference(value) -> bool:
+    """Check if a context value is a reference to a model instance."""
+    return isinstance(value, dict) and value.keys() == {"model", "pk"}
+
+
+def deserialize_contexts(contexts: list[dict]) -> list[dict]:
+    """Load the model instances that are referenced in contexts.
+
+    Instances are loaded with one query per model for all contexts.
+    """
+    pks = defaultdict(set)
+    for context in contexts:
+        for value in context.values():
+            if _is_reference(value):
+                pks[value["model"]].add(value["pk"])
+    instances = {
+        label: apps.get_model(label).objects.in_bulk(label_pks)
+        for label, label_pks in pks.items()
+    }
+    return [
+        {
+            key: instances[value["model"]].get(value["pk"])
+            if _is_reference(value)
+            else value
+            for key, value in context.items()
+        }
+        for context in contexts
+    ]
@@ -0,0 +1,10 @@
+"""Celery schedules of the emails module."""
+from celery.schedules import crontab
+
+schedules = {
+    # Send triggered automations every minute
+    "collectivo_emails_send_triggered_emails_1min": {
+        "task": "collectivo_emails_send_triggered_emails",
+        "schedule": crontab(minute="*/1"),
+    },
+}
@@ -1,56 +1,122 @@
-"""Celery tasks of the emails module."""
-import time
+"""Celery tasks of the emails module.
 
+Tasks only receive ids and use the JSON serializer, so that neither model
+instances nor rendered emails are passed through the broker.
+"""
 from celery import shared_task
 from celery.utils.log import get_task_logger
-from django.contrib.auth import get_user_model
-from django.core import mail
+from django.db.models import Sum
+from django.utils import timezone
+
+from collectivo.tags.models import Tag
+from collectivo.utils.tasks import LogErrorTask
+
+from .connections import pool
+from .ratelimit import get_token_bucket
 
 logger = get_task_logger(__name__)
-User = get_user_model()
 
 
-@shared_task
-def send_mails_async(results, emails):
-    """Send a mass email."""
-    connection = mail.get_connection()
-    campaign = results["campaign"]
+@shared_task(serializer="json")
+def send_mails_async(campaign_id, batch_id):
+    """Render and send a batch of emails of a campaign.
+
+    Batches are sent in parallel, limited by the shared rate limit of the
+    email backend. Returns the number of sent emails.
+    """
+    from .models import EmailCampaign, EmailCampaignBatch
 
+    batch = None
     try:
-        time.sleep(1)  # TODO Get this number from the settings
-        results["n_sent"] += connection.send_messages(emails)
+        batch = EmailCampaignBatch.objects.select_related(
+            "campaign__automation", "campaign__template__design"
+        ).get(pk=batch_id, campaign=campaign_id)
+        recipients = list(batch.get_recipients())
+        emails = batch.render(recipients)
+        get_token_bucket().acquire(len(emails))
+        batch.n_sent = pool.send_messages(emails)
+        batch.status = "success"
     except Exception as e:
-        campaign.status = "failure"
-        campaign.status_message = str(e)
-        campaign.save()
+        EmailCampaign.objects.filter(pk=campaign_id).update(
+            status="failure", status_message=str(e)[:255]
+        )
         logger.error("Error sending emails: %s", e)
         # TODO Send an email to the admins
+        if batch is None:
+            return 0
+        batch.status = "failure"
+        batch.status_message = str(e)[:255]
+    batch.sent = timezone.now()
+    batch.save()
+    logger.info("Email connection metrics: %s", pool.get_metrics())
 
     # Add optional tag to recipients if batch is successful
-    # TODO: Make tag optional for loose coupling
-    if campaign.template.tag.tag is not None:
-        for email in emails:
-            user = User.objects.get(email=email.to[0])
-            tag = campaign.template.tag.tag
-            tag.refresh_from_db()
-            tag.users.add(user)
-            tag.save()
-
-    return results
-
-
-@shared_task
-def send_mails_async_end(results):
-    """Document results of sending emails in the database."""
-    campaign = results["campaign"]
-    campaign.refresh_from_db()
-    if results["n_sent"] != campaign.recipients.count():
+    tag = batch.campaign.get_tag()
+    if batch.status == "success" and tag is not None and not batch.admin:
+        add_tag(tag, [recipient.pk for recipient in recipients])
+
+    return batch.n_sent
+
+
+@shared_task(serializer="json")
+def complete_campaign(results, campaign_id):
+    """Document results of sending emails in the database.
+
+    This is the callback of the chord of batches. The results of the batches
+    are the numbers of sent emails, which are also stored in the database.
+    """
+    from .models import EmailCampaign
+
+    campaign = EmailCampaign.objects.get(pk=campaign_id)
+    totals = campaign.batches.aggregate(n_sent=Sum("n_sent"), size=Sum("size"))
+    n_sent, size = totals["n_sent"] or 0, totals["size"] or 0
+    if n_sent != size:
         campaign.status = "failure"
-        campaign.status_message = (
-            "Not all emails were sent"
-            f"({results['n_sent']}/{campaign.recipients.count()})"
-        )
+        campaign.status_message = f"Not all emails were sent({n_sent}/{size})"
         # TODO Send an email to the admins
     else:
         campaign.status = "success"
     campaign.save()
+
+    # Document the tag assignment once per campaign
+    tag = campaign.get_tag()
+    if tag is not None and n_sent:
+        tag._change_reason = f"Added to recipients of campaign {campaign.pk}"
+        tag.save()
+
+
+@shared_task(serializer="json")
+def fail_campaign(request, exc, traceback, campaign_id):
+    """Mark a campaign as failed if a task of its chord has raised.
+
+    This is the error callback of the chord of batches. Without it, the
+    campaign would stay pending, since the chord callback is not called.
+    """
+    from .models import EmailCampaign
+
+    EmailCampaign.objects.filter(pk=campaign_id).update(
+        status="failure", status_message=str(exc)[:255]
+    )
+    logger.error("Error sending campaign %s: %s", campaign_id, exc)
+
+
+def add_tag(tag, user_ids: list):
+    """Add a tag to users with a single query."""
+    through = Tag.users.through
+    tag_field = Tag.users.field.m2m_field_name()
+    user_field = Tag.users.field.m2m_reverse_field_name()
+    through.objects.bulk_create(
+        [
+            through(**{f"{tag_field}_id": tag.pk, f"{user_field}_id": pk})
+            for pk in user_ids
+        ],
+        ignore_conflicts=True,
+    )
+
+
+@shared_task(name="collectivo_emails_send_triggered_emails", base=LogErrorTask)
+def send_triggered_emails():
+    """Send the triggered automations as one campaign per automation."""
+    from .models import EmailTrigger
+
+    return EmailTrigger.send_all()
@@ -1,8 +1,11 @@
 """Test the features of the emails API."""
+from smtplib import SMTPServerDisconnected
 from unittest.mock import patch
 
+from celery import signature
 from django.contrib.auth import get_user_model
 from django.core import mail
+from django.core.mail import EmailMultiAlternatives
 from django.db.models import signals
 from django.test import TestCase
 from django.urls import reverse
@@ -11,7 +14,12 @@ from rest_framework.test import APIClient
 from collectivo.tags.models import Tag
 from collectivo.utils.test import create_testuser
 
-from .models import EmailCampaign
+from . import ratelimit, rendering
+from .connections import ConnectionPool
+from .models import EmailCampaign, EmailTemplate
+from .ratelimit import TokenBucket
+from .rendering import EmailRenderer, deserialize_contexts, serialize_context
+from .tasks import send_mails_async
 
 TEMPLATES_URL = reverse("collectivo.emails:template-list")
 CAMPAIGNS_URL = reverse("collectivo.emails:campaign-list")
@@ -20,14 +28,13 @@ DESIGNS_URL = reverse("collectivo.emails:design-list")
 User = get_user_model()
 
 
-def run_mocked_celery_chain(mocked_chain):
-    """Take a called mocked celery chain and run it locally."""
-    if mocked_chain.call_args:
-        args = list(mocked_chain.call_args[0])
-        task = args.pop(0).apply()
-        for arg in args:
-            task = arg.apply((task.result,))
-        return task.result
+def run_mocked_celery_chord(mocked_chord):
+    """Take a called mocked celery chord and run it locally."""
+    if mocked_chord.call_args:
+        header = mocked_chord.call_args[0][0]
+        body = mocked_chord.return_value.call_args[0][0]
+        results = [task.apply().result for task in header]
+        return body.apply((results,)).result
 
 
 class EmailsTests(TestCase):
@@ -87,8 +94,8 @@ class EmailsTests(TestCase):
             self.recipient_objects[0].tags.filter(pk=self.tag.pk).exists()
         )
 
-    @patch("collectivo.emails.serializers.chain")
-    def test_email_batch_template(self, chain):
+    @patch("collectivo.emails.models.chord")
+    def test_email_batch_template(self, chord):
         """Test sending a batch of emails using a template."""
         res = self.client.post(TEMPLATES_URL, self.template_data)
         self.assertEqual(res.status_code, 201)
@@ -97,7 +104,254 @@ class EmailsTests(TestCase):
             "template": res.data["id"],
             "recipients": self.recipients,
         }
-        res = self.client.post(CAMPAIGNS_URL, payload)
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(CAMPAIGNS_URL, payload)
         self.assertEqual(res.status_code, 201)
-        run_mocked_celery_chain(chain)
+        run_mocked_celery_chord(chord)
         self._batch_assertions(res)
+
+    @patch("collectivo.emails.models.chord")
+    def test_email_tasks_receive_ids(self, chord):
+        """Test that tasks receive ids and batch progress is stored."""
+        template = EmailTemplate.objects.create(
+            name="ids", subject="Test", body="{{ user.first_name }} {{ x }}"
+        )
+        campaign = EmailCampaign.objects.create(template=template)
+        campaign.recipients.set(self.recipient_objects)
+        with self.captureOnCommitCallbacks(execute=True):
+            with patch("collectivo.emails.models.EMAIL_BATCH_SIZE", 1):
+                campaign.send(
+                    context={"x": "shared"},
+                    recipient_contexts={self.recipients[1]: {"x": self.tag}},
+                )
+        tasks = chord.call_args[0][0]
+        callback = chord.return_value.call_args[0][0]
+        self.assertEqual(
+            [task.args for task in tasks],
+            [(campaign.pk, batch.pk) for batch in campaign.batches.all()],
+        )
+        self.assertEqual(callback.args, (campaign.pk,))
+
+        run_mocked_celery_chord(chord)
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.status, "success")
+        bodies = sorted(email.body.strip() for email in mail.outbox)
+        self.assertEqual(
+            bodies, ["Recipient_01 shared", "Recipient_02 email_test_tag"]
+        )
+        batches = campaign.batches.all()
+        self.assertEqual([b.n_sent for b in batches], [1, 1])
+        self.assertEqual({b.status for b in batches}, {"success"})
+
+    @patch("collectivo.emails.models.chord")
+    def test_email_tag_history(self, chord):
+        """Test that tags are added in bulk with one history entry."""
+        res = self.client.post(TEMPLATES_URL, self.template_data)
+        template = EmailTemplate.objects.get(pk=res.data["id"])
+        campaign = EmailCampaign.objects.create(template=template)
+        campaign.recipients.set(self.recipient_objects)
+        n_history = self.tag.history.count()
+        with self.captureOnCommitCallbacks(execute=True):
+            with patch("collectivo.emails.models.EMAIL_BATCH_SIZE", 1):
+                campaign.send()
+        run_mocked_celery_chord(chord)
+        self.assertEqual(
+            set(self.tag.users.values_list("pk", flat=True)),
+            set(self.recipients),
+        )
+        self.assertEqual(self.tag.history.count(), n_history + 1)
+
+    @patch("collectivo.emails.models.chord")
+    def test_email_batch_failure(self, chord):
+        """Test that a failed batch does not stop the other batches."""
+        template = EmailTemplate.objects.create(
+            name="failure", subject="Test", body="Test"
+        )
+        campaign = EmailCampaign.objects.create(template=template)
+        campaign.recipients.set(self.recipient_objects)
+        with self.captureOnCommitCallbacks(execute=True):
+            with patch("collectivo.emails.models.EMAIL_BATCH_SIZE", 1):
+                campaign.send()
+        first, second = chord.call_args[0][0]
+        with patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=Exception("Connection refused"),
+        ):
+            first.apply()
+        second.apply()
+        chord.return_value.call_args[0][0].apply(([0, 1],))
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.status, "failure")
+        self.assertEqual(
+            campaign.status_message, "Not all emails were sent(1/2)"
+        )
+        self.assertEqual(
+            [b.status for b in campaign.batches.all()], ["failure", "success"]
+        )
+
+    @patch("collectivo.emails.models.chord")
+    def test_email_batch_error(self, chord):
+        """Test that a campaign fails if a batch task raises."""
+        template = EmailTemplate.objects.create(
+            name="error", subject="Test", body="Test"
+        )
+        campaign = EmailCampaign.objects.create(template=template)
+        campaign.recipients.set(self.recipient_objects)
+        with self.captureOnCommitCallbacks(execute=True):
+            campaign.send()
+        (task,) = chord.call_args[0][0]
+        callback = chord.return_value.call_args[0][0]
+        with patch(
+            "collectivo.emails.models.EmailCampaignBatch.save",
+            side_effect=Exception("Database error"),
+        ):
+            result = task.apply()
+        self.assertTrue(result.failed())
+
+        # The error callback of the chord is called instead of the callback
+        (errback,) = callback.options["link_error"]
+        signature(errback)(None, result.result, None)
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.status, "failure")
+        self.assertEqual(campaign.status_message, "Database error")
+
+    @patch("collectivo.emails.models.chord")
+    def test_email_send_after_commit(self, chord):
+        """Test that batches are only queued after the commit."""
+        template = EmailTemplate.objects.create(
+            name="commit", subject="Test", body="Test"
+        )
+        campaign = EmailCampaign.objects.create(template=template)
+        campaign.recipients.set(self.recipient_objects)
+        with self.captureOnCommitCallbacks() as callbacks:
+            campaign.send()
+        self.assertFalse(chord.called)
+        for callback in callbacks:
+            callback()
+        self.assertTrue(chord.called)
+
+        # A batch that cannot be loaded marks the campaign as failed
+        batch_id = campaign.batches.get().pk
+        campaign.batches.all().delete()
+        self.assertEqual(send_mails_async(campaign.pk, batch_id), 0)
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.status, "failure")
+
+    def test_email_missing_address(self):
+        """Test that a campaign fails if a recipient has no email."""
+        recipient = User.objects.create_user(username="no_email")
+        template = EmailTemplate.objects.create(
+            name="missing", subject="Test", body="Test"
+        )
+        campaign = EmailCampaign.objects.create(template=template)
+        campaign.recipients.set([recipient])
+        with self.assertRaises(ValueError):
+            campaign.send()
+        self.assertEqual(campaign.status, "failure")
+
+
+class EmailRateLimitTests(TestCase):
+    """Test the rate limit of emails."""
+
+    def test_token_bucket(self):
+        """Test that tokens are refilled with the rate of the bucket."""
+        bucket = TokenBucket("test", rate=10)
+        bucket.get_script = lambda: None
+        with patch.object(ratelimit.time, "monotonic", return_value=100):
+            self.assertEqual(bucket.reserve(10), 0)
+            self.assertAlmostEqual(bucket.reserve(5), 0.5)
+        with patch.object(ratelimit.time, "monotonic", return_value=101):
+            self.assertEqual(bucket.reserve(5), 0)
+
+    def test_rate_limit_settings(self):
+        """Test that rate limits are configured per email backend."""
+        extensions = {"collectivo.emails": {"rate_limits": {"smtp": 5}}}
+        with self.settings(COLLECTIVO={"extensions": extensions}):
+            self.assertEqual(ratelimit.get_rate_limit("smtp"), 5)
+            self.assertEqual(
+                ratelimit.get_rate_limit("other"),
+                ratelimit.DEFAULT_RATE_LIMIT,
+            )
+
+
+class EmailConnectionPoolTests(TestCase):
+    """Test the pooled connections to the email backend."""
+
+    def setUp(self):
+        """Prepare emails."""
+        self.pool = ConnectionPool()
+        self.emails = [
+            EmailMultiAlternatives("Test", "Test", "a@example.com", [to])
+            for to in ["b@example.com", "c@example.com"]
+        ]
+
+    def test_connection_is_reused(self):
+        """Test that batches are sent without a new handshake."""
+        self.assertEqual(self.pool.send_messages(self.emails), 2)
+        self.assertEqual(self.pool.send_messages(self.emails), 2)
+        metrics = self.pool.get_metrics()
+        self.assertEqual(metrics["handshakes"], 1)
+        self.assertEqual(metrics["batches"], 2)
+        self.assertEqual(metrics["messages"], 4)
+        self.assertEqual(len(mail.outbox), 4)
+
+    def test_reconnect_on_error(self):
+        """Test that a lost connection is opened again."""
+        self.pool.send_messages(self.emails)
+        with patch(
+            "django.core.mail.backends.locmem.EmailBackend.send_messages",
+            side_effect=[SMTPServerDisconnected(), 1, 1],
+        ):
+            self.assertEqual(self.pool.send_messages(self.emails), 2)
+        metrics = self.pool.get_metrics()
+        self.assertEqual(metrics["handshakes"], 2)
+        self.assertEqual(metrics["reconnects"], 1)
+
+    def test_unhealthy_connection_is_replaced(self):
+        """Test that idle connections are not reused after a timeout."""
+        self.pool.max_idle_time = 0
+        self.pool.send_messages(self.emails)
+        self.pool.send_messages(self.emails)
+        self.assertEqual(self.pool.get_metrics()["handshakes"], 2)
+
+
+class EmailRendererTests(TestCase):
+    """Test the rendering of emails."""
+
+    def setUp(self):
+        """Prepare recipients."""
+        self.recipients = [
+            User(pk=i, first_name=f"Name {i}", email=f"{i}@example.com")
+            for i in range(5)
+        ]
+
+    def test_render_batches(self):
+        """Test that emails are rendered lazily in batches."""
+        renderer = EmailRenderer(None, "Subject", "Hi {{ user.first_name }}")
+        batches = renderer.render_batches(self.recipients, batch_size=2)
+        self.assertEqual(len(next(batches)), 2)
+        batches = list(batches)
+        self.assertEqual([len(batch) for batch in batches], [2, 1])
+        email = batches[-1][0]
+        self.assertEqual(email.to, ["4@example.com"])
+        self.assertEqual(email.alternatives[0][0], "Hi Name 4")
+
+    def test_context_references(self):
+        """Test that model instances in contexts are stored as references."""
+        user = User.objects.create_user(username="reference")
+        context = serialize_context({"member": user, "number": 1})
+        self.assertEqual(
+            context["member"], {"model": "auth.user", "pk": user.pk}
+        )
+        self.assertEqual(
+            deserialize_contexts([context]), [{"member": user, "number": 1}]
+        )
+
+    def test_text_is_reused(self):
+        """Test that the text is converted once if the body is static."""
+        renderer = EmailRenderer(None, "Subject", "<p>Hi everyone</p>")
+        with patch.object(
+            rendering, "html2text", wraps=rendering.html2text
+        ) as html2text:
+            list(renderer.render_batches(self.recipients))
+        self.assertEqual(html2text.call_count, 1)
@@ -0,0 +1,443 @@
+"""Bulk import and update of memberships."""
+import csv
+import json
+from collections import defaultdict
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F, Sum, prefetch_related_objects
+from simple_history.utils import bulk_create_with_history
+
+from collectivo.core.models import PermissionGroup
+from collectivo.extensions.models import Extension
+from collectivo.utils.exceptions import ExtensionNotInstalled
+from collectivo.utils.history import bulk_update_with_history
+from collectivo.utils.permissions import clear_permissions_cache
+from collectivo.utils.schema import update_schema_version
+
+from .models import (
+    Membership,
+    MembershipNumberSequence,
+    MembershipStatus,
+    MembershipType,
+    payments_installed,
+)
+from .serializers import MembershipImportSerializer
+from .statistics import clear_statistics_cache
+
+if payments_installed:
+    from collectivo.payments.balances import update_account_balances
+    from collectivo.payments.models import (
+        Account,
+        Invoice,
+        ItemEntry,
+        ItemType,
+        ItemTypeCategory,
+        Subscription,
+    )
+
+User = get_user_model()
+
+CHUNK_SIZE = 500
+
+
+class InvalidFileError(ValueError):
+    """Exception for import files that cannot be read."""
+
+
+def read_rows(stream, file_format: str = "json"):
+    """Read rows from a text stream with a CSV table or a JSON list.
+
+    CSV tables are read row by row, while JSON lists are loaded into memory
+    as a whole, so that large imports should use CSV. Invalid files raise
+    an InvalidFileError.
+    """
+    if file_format == "csv":
+        try:
+            for row in csv.DictReader(stream):
+                # Empty cells are treated as missing values
+                yield {key: value for key, value in row.items() if value != ""}
+        except (csv.Error, UnicodeDecodeError) as e:
+            raise InvalidFileError(f"Invalid CSV file: {e}")
+    elif file_format == "json":
+        try:
+            rows = json.load(stream)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise InvalidFileError(f"Invalid JSON file: {e}")
+        if not isinstance(rows, list):
+            raise InvalidFileError("Invalid data (expected a list)")
+        yield from rows
+    else:
+        raise InvalidFileError(f"Unknown format '{file_format}'")
+
+
+def import_memberships(rows, chunk_size: int = CHUNK_SIZE, send_emails=True):
+    """Import memberships from an iterable of rows.
+
+    Rows are validated and saved in chunks. Each chunk is saved in a single
+    transaction with bulk queries. Invalid rows are skipped and reported.
+    Returns a report with the number of created memberships and the errors
+    per row, counting from zero.
+
+    If the rows cannot be read before the first chunk has been saved, the
+    InvalidFileError is raised. Otherwise, the import stops and the error is
+    reported for the first row of the unsaved chunk, from which on no rows
+    have been imported.
+    """
+    report = {"created": 0, "errors": []}
+    rows = iter(rows)
+    start = 0
+    while True:
+        chunk = []
+        try:
+            for row in islice(rows, chunk_size):
+                chunk.append(row)
+        except InvalidFileError as e:
+            if not report["created"]:
+                raise
+            report["errors"].append(
+                {"row": start, "errors": {"file": [str(e)]}}
+            )
+            break
+        if not chunk:
+            break
+        data = validate_chunk(chunk, start, report["errors"])
+        start += len(chunk)
+        if not data:
+            continue
+        with transaction.atomic():
+            memberships = create_memberships(data)
+        report["created"] += len(memberships)
+        if send_emails:
+            queue_emails(memberships)
+    return report
+
+
+def validate_chunk(rows: list, start: int, errors: list) -> list:
+    """Validate a chunk of rows and resolve their related objects.
+
+    Errors are added to the list of errors. Returns the valid rows.
+    """
+    data = []
+    for i, row in enumerate(rows, start):
+        serializer = MembershipImportSerializer(data=row)
+        if serializer.is_valid():
+            data.append((i, serializer.validated_data))
+        else:
+            errors.append({"row": i, "errors": serializer.errors})
+
+    users = User.objects.in_bulk({row["user"] for _, row in data})
+    types = MembershipType.objects.in_bulk({row["type"] for _, row in data})
+    statuses = MembershipStatus.objects.in_bulk(
+        {row["status"] for _, row in data if row.get("status")}
+    )
+    existing = set(
+        Membership.objects.filter(
+            user__in=users.keys(), type__in=types.keys()
+        ).values_list("user", "type")
+    )
+    numbers = set(
+        Membership.objects.filter(
+            type__in=types.keys(),
+            number__in={row["number"] for _, row in data if row.get("number")},
+        ).values_list("type", "number")
+    )
+
+    valid = []
+    for i, row in data:
+        row_errors = {}
+        if row["user"] not in users:
+            row_errors["user"] = ["User does not exist."]
+        if row["type"] not in types:
+            row_errors["type"] = ["Membership type does not exist."]
+        if row.get("status") and row["status"] not in statuses:
+            row_errors["status"] = ["Membership status does not exist."]
+        if (row["user"], row["type"]) in existing:
+            row_errors["user"] = ["User already has this membership type."]
+        if row.get("number") and (row["type"], row["number"]) in numbers:
+            row_errors["number"] = ["Membership number already exists."]
+        if row_errors:
+            errors.append({"row": i, "errors": row_errors})
+            continue
+
+        # Check for duplicates within the import
+        existing.add((row["user"], row["type"]))
+        if row.get("number"):
+            numbers.add((row["type"], row["number"]))
+
+        row["user"] = users[row["user"]]
+        row["type"] = types[row["type"]]
+        if row.get("status"):
+            row["status"] = statuses[row["status"]]
+        valid.append(row)
+    return valid
+
+
+def allocate_numbers(memberships: list[Membership]):
+    """Assign membership numbers with one reserved block per type."""
+    members_by_type = defaultdict(list)
+    for membership in memberships:
+        members_by_type[membership.type].append(membership)
+    for membership_type, members in members_by_type.items():
+        numbers = [m.number for m in members if m.number is not None]
+        if numbers:
+            MembershipNumberSequence.claim(membership_type, max(numbers))
+        members = [m for m in members if m.number is None]
+        if not members:
+            continue
+        block = MembershipNumberSequence.reserve(membership_type, len(members))
+        for membership, number in zip(members, block):
+            membership.number = number
+
+
+def create_memberships(data: list[dict]) -> list[Membership]:
+    """Create memberships and their groups and payments with bulk queries."""
+    memberships = [Membership(**row) for row in data]
+    allocate_numbers(memberships)
+    bulk_create_with_history(memberships, Membership)
+    assign_groups(memberships)
+    create_invoices(memberships)
+    update_schema_version(Membership)
+    clear_statistics_cache({m.type_id for m in memberships})
+    return memberships
+
+
+def update_memberships(
+    memberships: list[Membership], fields: list[str], user=None
+) -> list[Membership]:
+    """Update memberships and their groups and payments with bulk queries.
+
+    Works like Membership.save for existing memberships. Only changed
+    memberships are written and processed. Returns the changed memberships.
+    """
+    stored = Membership.objects.in_bulk([m.pk for m in memberships])
+    changed = bulk_update_with_history(
+        memberships, Membership, fields, default_user=user
+    )
+    if not changed:
+        return changed
+    prefetch_related_objects(changed, "type", "user")
+    assign_groups(changed)
+    create_invoices(changed)
+    update_schema_version(Membership)
+    clear_statistics_cache(
+        {m.type_id for m in changed} | {stored[m.pk].type_id for m in changed}
+    )
+    old_data = {
+        m.pk: {
+            field.name: getattr(stored[m.pk], field.attname)
+            for field in Membership._meta.fields
+        }
+        for m in changed
+    }
+    queue_emails(changed, old_data)
+    return changed
+
+
+def assign_groups(memberships: list[Membership]):
+    """Add users to the groups of their membership types in one query."""
+    extension = Extension.objects.get(name="memberships")
+    groups = {
+        group.name: group
+        for group in PermissionGroup.objects.filter(
+            extension=extension,
+            name__in={m.type.short_name for m in memberships},
+        )
+    }
+    through = PermissionGroup.users.through
+    group_field = PermissionGroup.users.field.m2m_field_name()
+    user_field = PermissionGroup.users.field.m2m_reverse_field_name()
+    through.objects.bulk_create(
+        [
+            through(
+                **{
+                    group_field: groups[membership.type.short_name],
+                    user_field: membership.user,
+                }
+            )
+            for membership in memberships
+        ],
+        ignore_conflicts=True,
+    )
+    clear_permissions_cache(m.user_id for m in memberships)
+
+
+def get_item_types(extension, category: str, types) -> dict:
+    """Get the item types of a category for membership types."""
+    item_category = ItemTypeCategory.objects.get_or_create(
+        name=category, extension=extension
+    )[0]
+    return {
+        membership_type.pk: ItemType.objects.get_or_create(
+            name=membership_type.short_name,
+            category=item_category,
+            extension=extension,
+        )[0]
+        for membership_type in types
+    }
+
+
+def get_accounts(user_ids) -> dict:
+    """Get the accounts of users and create missing accounts."""
+    accounts = {
+        account.user_id: account
+        for account in Account.objects.filter(user__in=user_ids)
+    }
+    missing = [
+        Account(user_id=user_id)
+        for user_id in user_ids
+        if user_id not in accounts
+    ]
+    for account in Account.objects.bulk_create(missing):
+        accounts[account.user_id] = account
+    return accounts
+
+
+def create_invoices(memberships: list[Membership]):
+    """Create invoices and subscriptions for memberships.
+
+    Works like Membership.create_invoices, but with bulk queries.
+    """
+    if not payments_installed:
+        raise ExtensionNotInstalled("collectivo.payments")
+
+    extension = Extension.objects.get(name="memberships")
+    accounts = get_accounts({m.user_id for m in memberships})
+    shares = [
+        m
+        for m in memberships
+        if m.type.has_shares and m.type.shares_amount_per_share
+    ]
+    fees = [m for m in memberships if m.type.has_fees]
+    entries = []
+
+    # Create invoices for shares
+    if shares:
+        item_types = get_item_types(
+            extension, "Shares", {m.type for m in shares}
+        )
+        invoiced = {
+            (row["type"], row["invoice__payment_from"]): row["total"]
+            for row in ItemEntry.objects.filter(
+                type__in=item_types.values(),
+                invoice__payment_from__in=[
+                    accounts[m.user_id] for m in shares
+                ],
+            )
+            .values("type", "invoice__payment_from")
+            .annotate(total=Sum(F("amount") * F("price")))
+        }
+        invoices = []
+        for membership in shares:
+            item_type = item_types[membership.type_id]
+            account = accounts[membership.user_id]
+            price = membership.type.shares_amount_per_share
+            to_pay = price * membership.shares_signed
+            paid = invoiced.get((item_type.pk, account.pk)) or 0
+            if paid < to_pay:
+                invoice = Invoice(payment_from=account, status="open")
+                invoices.append(invoice)
+                entries.append(
+                    ItemEntry(
+                        invoice=invoice,
+                        type=item_type,
+                        amount=(to_pay - paid) / price,
+                        price=price,
+                    )
+                )
+        bulk_create_with_history(invoices, Invoice)
+
+    # Create or update subscriptions for fees
+    if fees:
+        item_types = get_item_types(extension, "Fees", {m.type for m in fees})
+        active = {
+            (entry.type_id, entry.subscription.payment_from_id): entry
+            for entry in ItemEntry.objects.filter(
+                type__in=item_types.values(),
+                subscription__status="active",
+                subscription__payment_from__in=[
+                    accounts[m.user_id] for m in fees
+                ],
+            ).select_related("subscription")
+        }
+        subscriptions, updated = [], []
+        for membership in fees:
+            item_type = item_types[membership.type_id]
+            account = accounts[membership.user_id]
+            entry = active.get((item_type.pk, account.pk))
+            if entry is not None:
+                entry.subscription.repeat_each = (
+                    membership.type.fees_repeat_each
+                )
+                entry.subscription.repeat_unit = (
+                    membership.type.fees_repeat_unit
+                )
+                entry.amount = 1
+                entry.price = membership.fees_amount
+                updated.append(entry)
+                continue
+            subscription = Subscription(
+                payment_from=account,
+                status="active",
+                extension=extension,
+                date_started=membership.date_applied,
+                repeat_each=membership.type.fees_repeat_each,
+                repeat_unit=membership.type.fees_repeat_unit,
+            )
+            subscriptions.append(subscription)
+            entries.append(
+                ItemEntry(
+                    subscription=subscription,
+                    type=item_type,
+                    amount=1,
+                    price=membership.fees_amount,
+                )
+            )
+        bulk_create_with_history(subscriptions, Subscription)
+        bulk_update_with_history(
+            [entry.subscription for entry in updated],
+            Subscription,
+            ["repeat_each", "repeat_unit"],
+        )
+        ItemEntry.objects.bulk_update(updated, ["amount", "price"])
+
+    # Entries are created last, since their invoices need ids
+    ItemEntry.objects.bulk_create(entries)
+    update_account_balances({account.pk for account in accounts.values()})
+
+
+def queue_emails(memberships: list[Membership], old_data: dict = None):
+    """Queue the automatic emails of new or changed memberships.
+
+    Triggers are found by comparing memberships with their previous data
+    per id. Memberships without previous data are treated as new. Like
+    Membership.send_emails, the emails are queued and sent together later.
+    """
+    from collectivo.emails.models import EmailAutomation
+
+    new = {field.name: None for field in Membership._meta.fields}
+    old_data = old_data or {}
+    triggers = []
+    for membership in memberships:
+        data = old_data.get(membership.pk, new)
+        for name in membership.get_email_triggers(data):
+            triggers.append((name, membership))
+    if not triggers:
+        return
+
+    automations = {
+        automation.name: automation
+        for automation in EmailAutomation.objects.filter(
+            extension__name="memberships",
+            name__in={name for name, _ in triggers},
+        )
+    }
+    for name, membership in triggers:
+        if name not in automations:
+            continue
+        automations[name].queue(
+            [membership.user_id],
+            context={"membership": membership},
+            key=f"membership_{membership.pk}",
+        )
@@ -0,0 +1,57 @@
+"""Command to import memberships from a file."""
+from django.core.management.base import BaseCommand, CommandError
+
+from collectivo.memberships.imports import (
+    CHUNK_SIZE,
+    InvalidFileError,
+    import_memberships,
+    read_rows,
+)
+
+
+class Command(BaseCommand):
+    """Import memberships from a CSV or JSON file."""
+
+    help = "Import memberships from a CSV or JSON file."
+
+    def add_arguments(self, parser):
+        """Add arguments of the command."""
+        parser.add_argument("path", help="Path to a CSV or JSON file.")
+        parser.add_argument(
+            "--format",
+            choices=["csv", "json"],
+            help="Format of the file. Defaults to the file extension.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=CHUNK_SIZE,
+            help="Number of rows that are saved together.",
+        )
+        parser.add_argument(
+            "--no-emails",
+            action="store_true",
+            help="Do not send automatic emails.",
+        )
+
+    def handle(self, *args, **options):
+        """Run the import and print a report."""
+        path = options["path"]
+        file_format = options["format"] or (
+            "csv" if path.endswith(".csv") else "json"
+        )
+        with open(path, encoding="utf-8-sig", newline="") as stream:
+            try:
+                report = import_memberships(
+                    read_rows(stream, file_format),
+                    chunk_size=options["chunk_size"],
+                    send_emails=not options["no_emails"],
+                )
+            except InvalidFileError as e:
+                raise CommandError(e)
+        for error in report["errors"]:
+            self.stderr.write(f"Row {error['row']}: {error['errors']}")
+        self.stdout.write(
+            f"Imported {report['created']} memberships "
+            f"with {len(report['errors'])} errors."
+        )
@@ -0,0 +1,21 @@
+# Generated by Django 4.1.13 on 2026-10-18 10:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('memberships', '0003_rename_date_started_historicalmembership_date_applied_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MembershipNumberSequence',
+            fields=[
+                ('type', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='number_sequence', serialize=False, to='memberships.membershiptype')),
+                ('last_number', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
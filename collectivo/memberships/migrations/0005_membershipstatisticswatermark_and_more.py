@@ -0,0 +1,36 @@
+# Generated by Django 4.1.13 on 2026-10-18 10:16
+
+import collectivo.utils.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('memberships', '0004_membershipnumbersequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MembershipStatisticsWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('history_id', models.IntegerField(default=0)),
+            ],
+            bases=(collectivo.utils.models.SingleInstance, models.Model),
+        ),
+        migrations.CreateModel(
+            name='MembershipStatisticsRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True)),
+                ('stage', models.CharField(max_length=20)),
+                ('memberships', models.IntegerField(default=0)),
+                ('shares_signed', models.IntegerField(default=0)),
+                ('shares_paid', models.IntegerField(default=0)),
+                ('status', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='memberships.membershipstatus')),
+                ('type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='memberships.membershiptype')),
+            ],
+        ),
+    ]
@@ -3,13 +3,16 @@ from datetime import date
 
 from django.contrib.auth import get_user_model
 from django.db import models, transaction
-from simple_history.models import HistoricalRecords
+from django.db.models import F, Sum, Value
+from django.db.models.functions import Concat
 
 from collectivo.core.models import Permission, PermissionGroup
 from collectivo.dashboard.models import DashboardTile, DashboardTileButton
 from collectivo.extensions.models import Extension
 from collectivo.utils.exceptions import ExtensionNotInstalled
+from collectivo.utils.history import HistoricalRecords
 from collectivo.utils.managers import NameManager
+from collectivo.utils.models import SingleInstance
 
 try:
     from collectivo.payments.models import (
@@ -250,6 +253,59 @@ class MembershipStatus(models.Model):
         return self.name
 
 
+class MembershipNumberSequence(models.Model):
+    """The last membership number that has been given out for a type."""
+
+    type = models.OneToOneField(
+        "MembershipType",
+        primary_key=True,
+        on_delete=models.CASCADE,
+        related_name="number_sequence",
+    )
+    last_number = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        """Return string representation."""
+        return f"{self.type} ({self.last_number})"
+
+    @classmethod
+    def get_locked(cls, membership_type):
+        """Get the sequence of a type and lock it until the transaction ends.
+
+        Sequences are created on first use, starting from the highest
+        existing membership number of the type.
+        """
+        try:
+            return cls.objects.select_for_update().get(type=membership_type)
+        except cls.DoesNotExist:
+            highest = Membership.objects.filter(
+                type=membership_type
+            ).aggregate(models.Max("number"))["number__max"]
+            cls.objects.get_or_create(
+                type=membership_type, defaults={"last_number": highest or 0}
+            )
+            return cls.objects.select_for_update().get(type=membership_type)
+
+    @classmethod
+    def reserve(cls, membership_type, count=1) -> range:
+        """Reserve a block of consecutive membership numbers for a type."""
+        with transaction.atomic():
+            sequence = cls.get_locked(membership_type)
+            start = sequence.last_number + 1
+            sequence.last_number += count
+            sequence.save(update_fields=["last_number"])
+        return range(start, start + count)
+
+    @classmethod
+    def claim(cls, membership_type, number):
+        """Make sure that a manually set number is not given out again."""
+        with transaction.atomic():
+            sequence = cls.get_locked(membership_type)
+            if sequence.last_number < number:
+                sequence.last_number = number
+                sequence.save(update_fields=["last_number"])
+
+
 # --------------------------------------------------------------------------- #
 # Memberships --------------------------------------------------------------- #
 # --------------------------------------------------------------------------- #
@@ -302,17 +358,26 @@ class Membership(models.Model):
 
     history = HistoricalRecords()
 
+    # Label of memberships in schema choices, see collectivo.utils.schema
+    choices_label = Concat(
+        "user__first_name",
+        Value(" "),
+        "user__last_name",
+        Value(" ("),
+        "type__name",
+        Value(")"),
+    )
+
     def generate_membership_number(self):
         """Generate a unique membership number."""
-        highest_number = (
-            Membership.objects.filter(type=self.type).order_by("number").last()
-        )
-        return 1 if highest_number is None else highest_number.number + 1
+        return MembershipNumberSequence.reserve(self.type)[0]
 
     def save_basic(self, *args, **kwargs):
         """Save membership and generate membership number."""
         if self.number is None:
             self.number = self.generate_membership_number()
+        elif self._state.adding:
+            MembershipNumberSequence.claim(self.type, self.number)
 
         super().save()
 
@@ -322,12 +387,12 @@ class Membership(models.Model):
         self.assign_group()
 
         # Store data before saving
-        old = Membership.objects.filter(pk=self.pk)
+        old = Membership.objects.filter(pk=self.pk).first()
         old_data = {field.name: None for field in self._meta.fields}
-        is_new = False if old.exists() else True
+        is_new = old is None
         if not is_new:
             for field in self._meta.fields:
-                old_data[field] = getattr(old.first(), field.name)
+                old_data[field.name] = getattr(old, field.name)
 
         # Create or update object
         self.save_basic()
@@ -335,21 +400,40 @@ class Membership(models.Model):
         self.send_emails(is_new, old_data)
 
     def send_emails(self, new, data):
-        """Send automatic emails."""
+        """Queue automatic emails, which are sent together later."""
+        triggers = self.get_email_triggers(data)
+        if not triggers:
+            return
+        from collectivo.emails.models import EmailAutomation
+
+        for automation in EmailAutomation.objects.filter(
+            name__in=triggers, extension__name="memberships"
+        ):
+            automation.queue(
+                [self.user_id],
+                context={"membership": self},
+                key=f"membership_{self.pk}",
+            )
+
+    def get_email_triggers(self, data):
+        """Return the names of the automations triggered by a change."""
+        triggers = []
 
         # Trigger automation if membership stage has changed
         if data["stage"] != self.stage:
-            self.send_email(f"membership_{self.stage}")
+            triggers.append(f"membership_{self.stage}")
 
         # Trigger automation for changes in shares
         if (self.shares_paid or 0) > (data["shares_paid"] or 0):
-            self.send_email("paid_shares_increased")
+            triggers.append("paid_shares_increased")
         elif (self.shares_paid or 0) < (data["shares_paid"] or 0):
-            self.send_email("paid_shares_decreased")
+            triggers.append("paid_shares_decreased")
         if (self.shares_paid or 0) > (data["shares_signed"] or 0):
-            self.send_email("signed_shares_increased")
+            triggers.append("signed_shares_increased")
         elif (self.shares_signed or 0) < (data["shares_signed"] or 0):
-            self.send_email("signed_shares_decreased")
+            triggers.append("signed_shares_decreased")
+
+        return triggers
 
     def delete(self, *args, **kwargs):
         """Delete the model and remove registration."""
@@ -376,49 +460,26 @@ class Membership(models.Model):
         group.save()
 
     def send_email(self, trigger):
-        """Send automatic email."""
-        self.type.refresh_from_db()
+        """Queue an automatic email."""
         from collectivo.emails.models import EmailAutomation
-        from collectivo.extensions.models import Extension
-
-        extension = Extension.objects.get(name="memberships")
 
         automation = EmailAutomation.objects.get(
-            name=trigger, extension=extension
+            name=trigger, extension__name="memberships"
+        )
+        automation.queue(
+            [self.user_id],
+            context={"membership": self},
+            key=f"membership_{self.pk}",
         )
-        automation.send([self.user], context={"membership": self})
 
     def update_shares_paid(self):
         """Update the number of shares paid for this membership.
 
         This method depends to the collectivo.payments extension.
         """
+        from .shares import update_shares_paid
 
-        if not payments_installed:
-            raise ExtensionNotInstalled("collectivo.payments")
-
-        extension = Extension.objects.get(name="memberships")
-        item_category = ItemTypeCategory.objects.get_or_create(
-            name="Shares", extension=extension
-        )[0]
-        item_type = ItemType.objects.get_or_create(
-            name=self.type.short_name,
-            category=item_category,
-            extension=extension,
-        )[0]
-        entries = ItemEntry.objects.filter(
-            type=item_type,
-            invoice__payment_from=self.user.account,
-            invoice__status="paid",
-        )
-        if entries.exists():
-            shares_paid = (
-                sum([entry.amount * entry.price for entry in entries])
-                / self.type.shares_amount_per_share
-            )
-
-            self.shares_paid = shares_paid
-            self.save_basic()
+        update_shares_paid([self])
 
     def create_invoices(self):
         """Create invoices for this membership.
@@ -446,7 +507,9 @@ class Membership(models.Model):
             )
 
             # Get current status
-            invoiced = sum([entry.amount * entry.price for entry in entries])
+            invoiced = entries.aggregate(
+                total=Sum(F("amount") * F("price"))
+            )["total"] or 0
             to_pay = self.type.shares_amount_per_share * self.shares_signed
 
             # Create invoice if needed
@@ -510,3 +573,43 @@ class Membership(models.Model):
                     amount=1,
                     price=self.fees_amount,
                 )
+
+
+# --------------------------------------------------------------------------- #
+# Statistics ---------------------------------------------------------------- #
+# --------------------------------------------------------------------------- #
+
+
+class MembershipStatisticsRollup(models.Model):
+    """The net change of memberships with a type, status, and stage per day.
+
+    The statistics at a date are the sum of all changes up to that date.
+    Rollups are calculated from the history of memberships.
+    """
+
+    date = models.DateField(db_index=True)
+    type = models.ForeignKey(
+        "MembershipType", on_delete=models.CASCADE, related_name="+"
+    )
+    status = models.ForeignKey(
+        "MembershipStatus",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="+",
+    )
+    stage = models.CharField(max_length=20)
+
+    memberships = models.IntegerField(default=0)
+    shares_signed = models.IntegerField(default=0)
+    shares_paid = models.IntegerField(default=0)
+
+    def __str__(self):
+        """Return string representation."""
+        return f"{self.date} {self.type_id} {self.status_id} {self.stage}"
+
+
+class MembershipStatisticsWatermark(SingleInstance, models.Model):
+    """The last entry of the membership history that is part of rollups."""
+
+    history_id = models.IntegerField(default=0)
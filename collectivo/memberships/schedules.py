@@ -0,0 +1,10 @@
+"""Celery schedules of the memberships extension."""
+from celery.schedules import crontab
+
+schedules = {
+    # Update statistics of memberships every hour
+    "collectivo_memberships_update_statistics_rollups_1h": {
+        "task": "collectivo_memberships_update_statistics_rollups",
+        "schedule": crontab(minute=0),
+    },
+}
@@ -14,7 +14,7 @@ from collectivo.utils.schema import Schema, SchemaCondition
 from collectivo.utils.serializers import UserFields, create_history_serializer
 
 from . import models
-from .statistics import calculate_statistics
+from .statistics import get_statistics
 
 User = get_user_model()
 
@@ -88,8 +88,10 @@ class MembershipSerializer(UserFields):
         """Save user tags seperately."""
         tr = _TagsSerializer(data=self.initial_data)
         tr.is_valid()
-        if "user_tags" in tr.validated_data:
+        if "user__tags" in tr.validated_data:
             instance.user.tags.set(tr.validated_data["user__tags"])
+        if isinstance(validated_data.get("user"), dict):
+            del validated_data["user"]
 
         return super().update(instance, validated_data)
 
@@ -205,7 +207,7 @@ class MembershipTypeSerializer(serializers.ModelSerializer):
 
     def get_statistics(self, obj):
         """Get statistics for this membership type."""
-        return calculate_statistics(obj)
+        return get_statistics([obj.pk])[obj.pk]
 
 
 class MembershipStatusSerializer(serializers.ModelSerializer):
@@ -352,6 +354,40 @@ class MembershipRegisterCombinedSerializer(serializers.Serializer):
         return {}
 
 
+class MembershipImportSerializer(serializers.Serializer):
+    """Serializer to validate a row of a membership import.
+
+    Related objects are given as ids and resolved for each chunk of rows.
+    """
+
+    user = serializers.IntegerField()
+    type = serializers.IntegerField()
+    status = serializers.IntegerField(required=False, allow_null=True)
+    number = serializers.IntegerField(
+        required=False, allow_null=True, min_value=1
+    )
+    stage = serializers.ChoiceField(
+        choices=models.MEMBERSHIP_STAGES, required=False
+    )
+    date_applied = serializers.DateField(required=False, allow_null=True)
+    date_accepted = serializers.DateField(required=False, allow_null=True)
+    date_resigned = serializers.DateField(required=False, allow_null=True)
+    date_excluded = serializers.DateField(required=False, allow_null=True)
+    date_ended = serializers.DateField(required=False, allow_null=True)
+    shares_signed = serializers.IntegerField(required=False, min_value=0)
+    shares_paid = serializers.IntegerField(required=False, min_value=0)
+    fees_amount = serializers.DecimalField(
+        max_digits=100, decimal_places=2, required=False
+    )
+
+    def validate(self, data):
+        """Validate the data."""
+        stage = data.get("stage", "applied")
+        if stage != "applied" and data.get(f"date_{stage}", None) is None:
+            raise ValidationError(f"Stage '{stage}' requires 'date_{stage}'")
+        return data
+
+
 MembershipHistorySerializer = create_history_serializer(models.Membership)
 MembershipTypeHistorySerializer = create_history_serializer(
     models.MembershipType
@@ -0,0 +1,79 @@
+"""Paid shares of memberships."""
+from django.db.models import F, Sum
+
+from collectivo.utils.exceptions import ExtensionNotInstalled
+from collectivo.utils.history import bulk_update_with_history
+
+from .models import Membership, payments_installed
+from .statistics import clear_statistics_cache
+
+if payments_installed:
+    from collectivo.payments.models import ItemEntry
+
+
+def get_share_entries():
+    """Get the item entries of membership shares."""
+    if not payments_installed:
+        raise ExtensionNotInstalled("collectivo.payments")
+    return ItemEntry.objects.filter(
+        type__category__name="Shares",
+        type__category__extension__name="memberships",
+    )
+
+
+def update_shares_paid(memberships) -> list[Membership]:
+    """Update the paid shares of memberships from their paid invoices.
+
+    The paid amounts of all memberships are summed up in one query. Only
+    memberships whose paid shares changed are saved, with one bulk query.
+    Returns the changed memberships.
+    """
+    memberships = [m for m in memberships if m.type.shares_amount_per_share]
+    if not memberships:
+        return []
+    totals = {
+        (row["invoice__payment_from__user"], row["type__name"]): row["total"]
+        for row in get_share_entries()
+        .filter(
+            invoice__status="paid",
+            invoice__payment_from__user__in={m.user_id for m in memberships},
+            type__name__in={m.type.short_name for m in memberships},
+        )
+        .values("invoice__payment_from__user", "type__name")
+        .annotate(total=Sum(F("amount") * F("price")))
+        .order_by()
+    }
+    changed = []
+    for membership in memberships:
+        total = totals.get((membership.user_id, membership.type.short_name))
+        shares_paid = int(
+            (total or 0) / membership.type.shares_amount_per_share
+        )
+        if shares_paid != membership.shares_paid:
+            membership.shares_paid = shares_paid
+            changed.append(membership)
+    changed = bulk_update_with_history(changed, Membership, ["shares_paid"])
+    if changed:
+        clear_statistics_cache({m.type_id for m in changed})
+    return changed
+
+
+def update_shares_paid_for_invoices(invoice_ids) -> list[Membership]:
+    """Update the paid shares of memberships with share items in invoices.
+
+    This can be used after the status of many invoices has been changed,
+    e.g. with a bulk update. Returns the changed memberships.
+    """
+    pairs = set(
+        get_share_entries()
+        .filter(invoice__in=invoice_ids)
+        .values_list("invoice__payment_from__user", "type__name")
+    )
+    if not pairs:
+        return []
+    memberships = Membership.objects.filter(
+        user__in={user_id for user_id, _ in pairs}
+    ).select_related("type")
+    return update_shares_paid(
+        m for m in memberships if (m.user_id, m.type.short_name) in pairs
+    )
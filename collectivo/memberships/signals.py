@@ -1,22 +1,155 @@
 """Signals of the memberships extension."""
 from django.db.models import signals
 
+from .models import Membership, MembershipStatus, MembershipType
+from .statistics import clear_statistics_cache
+
+
+def store_membership_type(sender, instance, raw=False, **kwargs):
+    """Store the type of a membership before it is saved."""
+    instance._old_type_id = None
+    if instance.pk is not None and not raw:
+        instance._old_type_id = (
+            Membership.objects.filter(pk=instance.pk)
+            .values_list("type", flat=True)
+            .first()
+        )
+
+
+def clear_membership_statistics(sender, instance, **kwargs):
+    """Clear cached statistics of the old and new type of a membership."""
+    old_type_id = getattr(instance, "_old_type_id", None)
+    clear_statistics_cache({instance.type_id, old_type_id} - {None})
+
+
+def clear_type_statistics(sender, instance, **kwargs):
+    """Clear cached statistics of a new type or after its statuses changed."""
+    clear_statistics_cache([instance.pk])
+
+
+def clear_all_statistics(sender, **kwargs):
+    """Clear cached statistics of all types."""
+    clear_statistics_cache()
+
+
+signals.pre_save.connect(
+    store_membership_type,
+    sender=Membership,
+    dispatch_uid="store_membership_type",
+    weak=False,
+)
+for name, signal in [
+    ("save", signals.post_save),
+    ("delete", signals.post_delete),
+]:
+    signal.connect(
+        clear_membership_statistics,
+        sender=Membership,
+        dispatch_uid=f"clear_membership_statistics_{name}",
+        weak=False,
+    )
+    signal.connect(
+        clear_all_statistics,
+        sender=MembershipStatus,
+        dispatch_uid=f"clear_status_statistics_{name}",
+        weak=False,
+    )
+signals.post_save.connect(
+    clear_type_statistics,
+    sender=MembershipType,
+    dispatch_uid="clear_new_type_statistics",
+    weak=False,
+)
+signals.m2m_changed.connect(
+    clear_type_statistics,
+    sender=MembershipType.statuses.through,
+    dispatch_uid="clear_type_statistics",
+    weak=False,
+)
+
+try:
+    from collectivo.profiles.models import UserProfile
+
+    def clear_profile_statistics(sender, instance, **kwargs):
+        """Clear cached statistics of the types of a profile's user."""
+        clear_statistics_cache(
+            instance.user.memberships.values_list("type", flat=True)
+        )
+
+    signals.post_save.connect(
+        clear_profile_statistics,
+        sender=UserProfile,
+        dispatch_uid="clear_profile_statistics",
+        weak=False,
+    )
+
+except ImportError:
+    pass
+
 try:
-    from collectivo.payments.models import Invoice
+    from collectivo.payments.models import Invoice, ItemEntry
+    from collectivo.payments.signals import invoices_paid
+
+    from .shares import update_shares_paid_for_invoices
 
-    def update_shares_paid(sender, instance: Invoice, created, **kwargs):
-        """Update shares_paid of a membership after an invoice is saved."""
+    def store_invoice_status(sender, instance: Invoice, raw=False, **kwargs):
+        """Store the status of an invoice before it is saved."""
+        instance._old_status = None
+        if instance.pk is not None and not raw:
+            instance._old_status = (
+                Invoice.objects.filter(pk=instance.pk)
+                .values_list("status", flat=True)
+                .first()
+            )
 
-        memberships = instance.payment_from.user.memberships.all()
-        for membership in memberships:
-            membership.update_shares_paid()
+    def update_shares_paid(sender, instance: Invoice, raw=False, **kwargs):
+        """Update shares_paid of memberships if an invoice is (un)paid."""
+        old_status = getattr(instance, "_old_status", None)
+        if raw or (old_status == "paid") == (instance.status == "paid"):
+            return
+        update_shares_paid_for_invoices([instance.pk])
 
+    def update_paid_invoices_shares_paid(sender, invoice_ids, **kwargs):
+        """Update shares_paid of memberships after a bulk payment."""
+        update_shares_paid_for_invoices(invoice_ids)
+
+    def update_entry_shares_paid(sender, instance: ItemEntry, **kwargs):
+        """Update shares_paid of memberships if a paid item is changed."""
+        if kwargs.get("raw") or instance.invoice_id is None:
+            return
+        if Invoice.objects.filter(
+            pk=instance.invoice_id, status="paid"
+        ).exists():
+            update_shares_paid_for_invoices([instance.invoice_id])
+
+    signals.pre_save.connect(
+        store_invoice_status,
+        sender=Invoice,
+        dispatch_uid="store_invoice_status",
+        weak=False,
+    )
     signals.post_save.connect(
         update_shares_paid,
         sender=Invoice,
         dispatch_uid="update_shares_paid",
         weak=False,
     )
+    invoices_paid.connect(
+        update_paid_invoices_shares_paid,
+        sender=Invoice,
+        dispatch_uid="update_paid_invoices_shares_paid",
+        weak=False,
+    )
+    for name, signal in [
+        ("save", signals.post_save),
+        ("delete", signals.post_delete),
+    ]:
+        signal.connect(
+            update_entry_shares_paid,
+            sender=ItemEntry,
+            dispatch_uid=f"update_entry_shares_paid_{name}",
+            weak=False,
+        )
 
 except ImportError:
     pass
@@ -1,63 +1,368 @@
 """Statistics for memberships."""
-from django.db.models import Avg, Max, Sum
+from collections import defaultdict
+from datetime import date, timedelta
+from itertools import takewhile
 
-from .models import MembershipType
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Avg, Count, Max, OuterRef, Q, Subquery, Sum
+from django.utils import timezone
 
+from collectivo.utils.cache import get_cache_timeout
 
-def calculate_statistics(membership_type: MembershipType):
-    """Get statistics for this membership type."""
-    try:
-        memberships = membership_type.memberships.filter(
-            date_ended__isnull=True,
-        )
-        statistics = {
-            "memberships (without date_ended)": memberships.count(),
-            "memberships with date_accepted": memberships.filter(
-                date_accepted__isnull=False
-            ).count(),
-            **{
-                f"memberships with status: {status.name}": memberships.filter(
-                    status=status
-                ).count()
-                for status in membership_type.statuses.all()
-            },
-        }
-        try:
-            import collectivo.profiles  # noqa
-
-            x = "memberships with person type"
-            statistics.update(
-                {
-                    f"{x}: {status}": membership_type.memberships.filter(
-                        user__profile__person_type=status
-                    ).count()
-                    for status in ["natural", "legal"]
-                }
-            )
-        except ImportError:
-            pass
+from .models import (
+    Membership,
+    MembershipStatisticsRollup,
+    MembershipStatisticsWatermark,
+    MembershipStatus,
+    MembershipType,
+)
 
-        # Ended memberships
-        statistics.update(
+STATISTICS_CACHE_KEY = "collectivo.memberships.statistics.{}"
+STATISTICS_CACHE_TIMEOUT = None
+STATISTICS_LOCAL_CACHE_TIMEOUT = 60
+
+PERSON_TYPES = ["natural", "legal"]
+
+try:
+    import collectivo.profiles  # noqa
+
+    profiles_installed = True
+except ImportError:
+    profiles_installed = False
+
+
+def get_aggregates(status_ids) -> dict:
+    """Get the aggregates of all statistics for a grouped query."""
+    active = Q(date_ended__isnull=True)
+    aggregates = {
+        "active": Count("id", filter=active),
+        "accepted": Count(
+            "id", filter=active & Q(date_accepted__isnull=False)
+        ),
+        "ended": Count("id", filter=Q(date_ended__isnull=False)),
+        **{
+            f"status_{status_id}": Count(
+                "id", filter=active & Q(status=status_id)
+            )
+            for status_id in status_ids
+        },
+        "shares_signed__sum": Sum("shares_signed"),
+        "shares_signed__avg": Avg("shares_signed"),
+        "shares_signed__max": Max("shares_signed"),
+        "shares_paid__sum": Sum("shares_paid"),
+        "shares_paid__avg": Avg("shares_paid"),
+        "shares_paid__max": Max("shares_paid"),
+    }
+    if profiles_installed:
+        aggregates.update(
             {
-                "ended memberships (with date_ended)": memberships.filter(
-                    date_accepted__isnull=False
-                ).count(),
+                f"person_type_{person_type}": Count(
+                    "id", filter=Q(user__profile__person_type=person_type)
+                )
+                for person_type in PERSON_TYPES
             }
         )
+    return aggregates
+
 
-        # Shares statistics
+def format_statistics(data: dict, statuses: list) -> dict:
+    """Format the aggregates of a membership type as statistics."""
+    statistics = {
+        "memberships (without date_ended)": data.get("active", 0),
+        "memberships with date_accepted": data.get("accepted", 0),
+        **{
+            f"memberships with status: {name}": data.get(f"status_{pk}", 0)
+            for pk, name in statuses
+        },
+    }
+    if profiles_installed:
+        x = "memberships with person type"
         statistics.update(
             {
-                **membership_type.memberships.aggregate(Sum("shares_signed")),
-                **membership_type.memberships.aggregate(Avg("shares_signed")),
-                **membership_type.memberships.aggregate(Max("shares_signed")),
-                **membership_type.memberships.aggregate(Sum("shares_paid")),
-                **membership_type.memberships.aggregate(Avg("shares_paid")),
-                **membership_type.memberships.aggregate(Max("shares_paid")),
+                f"{x}: {person_type}": data.get(
+                    f"person_type_{person_type}", 0
+                )
+                for person_type in PERSON_TYPES
             }
         )
 
+    # Ended memberships
+    statistics["ended memberships (with date_ended)"] = data.get("ended", 0)
+
+    # Shares statistics
+    for field in ["shares_signed", "shares_paid"]:
+        for func in ["sum", "avg", "max"]:
+            statistics[f"{field}__{func}"] = data.get(f"{field}__{func}")
+    return statistics
+
+
+def calculate_all_statistics(type_ids) -> dict:
+    """Get statistics for multiple membership types.
+
+    All statistics are calculated in one grouped query with conditional
+    aggregation. Returns a dictionary of statistics per type id.
+    """
+    type_ids = list(type_ids)
+    statuses = defaultdict(list)
+    for type_id, pk, name in MembershipStatus.objects.filter(
+        membershiptype__in=type_ids
+    ).values_list("membershiptype", "pk", "name"):
+        statuses[type_id].append((pk, name))
+    status_ids = {pk for items in statuses.values() for pk, _ in items}
+
+    rows = (
+        Membership.objects.filter(type__in=type_ids)
+        .values("type")
+        .annotate(**get_aggregates(status_ids))
+        .order_by()
+    )
+    data = {row["type"]: row for row in rows}
+    return {
+        type_id: format_statistics(data.get(type_id, {}), statuses[type_id])
+        for type_id in type_ids
+    }
+
+
+def calculate_statistics(membership_type: MembershipType):
+    """Get statistics for this membership type."""
+    try:
+        return calculate_all_statistics([membership_type.pk])[
+            membership_type.pk
+        ]
     except Exception as e:
-        statistics = {"error trying to calculate statistics": str(e)}
+        return {"error trying to calculate statistics": str(e)}
+
+
+def get_statistics(type_ids) -> dict:
+    """Get statistics for membership types from the cache.
+
+    Statistics of types that are not cached are calculated together.
+    """
+    type_ids = list(type_ids)
+    keys = {STATISTICS_CACHE_KEY.format(pk): pk for pk in type_ids}
+    cached = cache.get_many(keys.keys())
+    statistics = {keys[key]: value for key, value in cached.items()}
+    missing = [pk for pk in type_ids if pk not in statistics]
+    if missing:
+        try:
+            calculated = calculate_all_statistics(missing)
+        except Exception as e:
+            error = {"error trying to calculate statistics": str(e)}
+            return {**statistics, **{pk: error for pk in missing}}
+        cache.set_many(
+            {
+                STATISTICS_CACHE_KEY.format(pk): value
+                for pk, value in calculated.items()
+            },
+            get_cache_timeout(
+                STATISTICS_CACHE_TIMEOUT, STATISTICS_LOCAL_CACHE_TIMEOUT
+            ),
+        )
+        statistics.update(calculated)
     return statistics
+
+
+def clear_statistics_cache(type_ids=None):
+    """Remove cached statistics of the given or all membership types."""
+    if type_ids is None:
+        type_ids = MembershipType.objects.values_list("pk", flat=True)
+    keys = [STATISTICS_CACHE_KEY.format(pk) for pk in type_ids]
+    cache.delete_many(keys)
+
+    # Clear again after commit in case another request cached old data
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+# Time series ------------------------------------------------------------- #
+
+ROLLUP_FIELDS = ["type", "status", "stage"]
+ROLLUP_VALUES = ["memberships", "shares_signed", "shares_paid"]
+ROLLUP_BATCH_SIZE = 5000
+ROLLUP_DELAY = timedelta(minutes=10)
+GRANULARITIES = ["day", "week", "month"]
+TIMESERIES_MAX_DAYS = 5 * 366
+
+
+def get_rollup_key(row: dict, date) -> tuple:
+    """Get the rollup key of a historical membership at a date."""
+    return (date, row["type_id"], row["status_id"], row["stage"])
+
+
+def update_statistics_rollups(
+    batch_size: int = ROLLUP_BATCH_SIZE, delay: timedelta = ROLLUP_DELAY
+) -> int:
+    """Add new entries of the membership history to the daily rollups.
+
+    Only entries after the watermark are processed. Each entry removes the
+    previous state of its membership and adds the new state at the date of
+    the change. Returns the number of processed entries.
+
+    Entries are processed in the order of their ids, which is not the order
+    in which they are committed. Processing stops at the first entry that
+    is younger than the delay, so that entries of transactions that are
+    still running are not skipped by the watermark.
+    """
+    History = Membership.history.model
+    fields = ["id", "type_id", "status_id", "stage"] + ROLLUP_VALUES[1:]
+    processed = 0
+    MembershipStatisticsWatermark.object()
+    while True:
+        with transaction.atomic():
+            watermark = (
+                MembershipStatisticsWatermark.objects.select_for_update().get()
+            )
+            cutoff = timezone.now() - delay
+            rows = list(
+                takewhile(
+                    lambda row: row["history_date"] <= cutoff,
+                    History.objects.filter(history_id__gt=watermark.history_id)
+                    .order_by("history_id")
+                    .values(
+                        "history_id", "history_date", "history_type", *fields
+                    )[:batch_size],
+                )
+            )
+            if not rows:
+                return processed
+
+            # Get the last processed state of each membership in the batch
+            last_entries = (
+                History.objects.filter(
+                    id=OuterRef("id"), history_id__lte=watermark.history_id
+                )
+                .order_by("-history_id")
+                .values("history_id")[:1]
+            )
+            states = {
+                row["id"]: row
+                for row in History.objects.filter(
+                    id__in={row["id"] for row in rows},
+                    history_id=Subquery(last_entries),
+                ).values("history_type", *fields)
+                if row["history_type"] != "-"
+            }
+
+            # Calculate the changes per day, type, status, and stage
+            changes = defaultdict(lambda: [0, 0, 0])
+            for row in rows:
+                date = timezone.localdate(row["history_date"])
+                previous = states.pop(row["id"], None)
+                if previous is not None:
+                    change = changes[get_rollup_key(previous, date)]
+                    change[0] -= 1
+                    change[1] -= previous["shares_signed"]
+                    change[2] -= previous["shares_paid"]
+                if row["history_type"] != "-":
+                    change = changes[get_rollup_key(row, date)]
+                    change[0] += 1
+                    change[1] += row["shares_signed"]
+                    change[2] += row["shares_paid"]
+                    states[row["id"]] = row
+
+            save_rollup_changes(changes)
+            watermark.history_id = rows[-1]["history_id"]
+            watermark.save()
+            processed += len(rows)
+
+
+def save_rollup_changes(changes: dict):
+    """Add changes to existing rollups or create new rollups."""
+    changes = {key: value for key, value in changes.items() if any(value)}
+    if not changes:
+        return
+    rollups = {
+        (r.date, r.type_id, r.status_id, r.stage): r
+        for r in MembershipStatisticsRollup.objects.filter(
+            date__in={key[0] for key in changes}
+        )
+    }
+    created, updated = [], []
+    for key, values in changes.items():
+        rollup = rollups.get(key)
+        if rollup is None:
+            date, type_id, status_id, stage = key
+            rollup = MembershipStatisticsRollup(
+                date=date, type_id=type_id, status_id=status_id, stage=stage
+            )
+            created.append(rollup)
+        else:
+            updated.append(rollup)
+        for field, value in zip(ROLLUP_VALUES, values):
+            setattr(rollup, field, getattr(rollup, field) + value)
+    MembershipStatisticsRollup.objects.bulk_create(created)
+    MembershipStatisticsRollup.objects.bulk_update(updated, ROLLUP_VALUES)
+
+
+def get_bucket(day: date, granularity: str) -> date:
+    """Get the first day of the period that a day belongs to."""
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+
+def get_timeseries(
+    start: date,
+    end: date,
+    granularity: str = "day",
+    group_by: list = ROLLUP_FIELDS,
+    filters: dict = None,
+) -> list:
+    """Get membership statistics over time from the daily rollups.
+
+    Returns the statistics at the end of each period between start and end,
+    grouped by the given rollup fields. Periods are labeled with their first
+    day.
+    """
+    rollups = MembershipStatisticsRollup.objects.filter(**(filters or {}))
+    sums = {field: Sum(field) for field in ROLLUP_VALUES}
+
+    # Sum of all changes before the start
+    totals = {}
+    for row in (
+        rollups.filter(date__lt=start)
+        .values(*group_by)
+        .annotate(**sums)
+        .order_by()
+    ):
+        totals[tuple(row[f] for f in group_by)] = [
+            row[f] for f in ROLLUP_VALUES
+        ]
+
+    # Changes per day between start and end
+    changes = defaultdict(list)
+    for row in (
+        rollups.filter(date__gte=start, date__lte=end)
+        .values("date", *group_by)
+        .annotate(**sums)
+        .order_by("date")
+    ):
+        changes[row["date"]].append(row)
+
+    series = []
+    day = start
+    while day <= end:
+        for row in changes.get(day, []):
+            key = tuple(row[f] for f in group_by)
+            values = totals.setdefault(key, [0, 0, 0])
+            for i, field in enumerate(ROLLUP_VALUES):
+                values[i] += row[field]
+
+        # Add a data point at the end of each period
+        next_day = day + timedelta(days=1)
+        if next_day > end or get_bucket(next_day, granularity) != get_bucket(
+            day, granularity
+        ):
+            bucket = get_bucket(day, granularity)
+            for key, values in totals.items():
+                series.append(
+                    {
+                        "date": bucket,
+                        **dict(zip(group_by, key)),
+                        **dict(zip(ROLLUP_VALUES, values)),
+                    }
+                )
+        day = next_day
+    return series
@@ -0,0 +1,15 @@
+"""Celery tasks of the memberships extension."""
+from celery import shared_task
+
+from collectivo.utils.tasks import LogErrorTask
+
+from .statistics import update_statistics_rollups
+
+
+@shared_task(
+    name="collectivo_memberships_update_statistics_rollups",
+    base=LogErrorTask,
+)
+def update_statistics_rollups_async():
+    """Add new entries of the membership history to the daily rollups."""
+    return update_statistics_rollups()
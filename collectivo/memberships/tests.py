@@ -1,24 +1,64 @@
 """Tests of the memberships extension."""
+import io
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from threading import Barrier
+from unittest import skipUnless
 from unittest.mock import patch
 
 from django.contrib.auth import get_user_model
 from django.core import mail
-from django.test import TestCase
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework.test import APIClient
 
-from collectivo.emails.models import EmailAutomation
-from collectivo.emails.tests import run_mocked_celery_chain
+from collectivo.core.models import Job
+from collectivo.core.tasks import run_job_async
+from collectivo.emails.models import (
+    EmailAutomation,
+    EmailCampaign,
+    EmailTrigger,
+)
+from collectivo.emails.tests import run_mocked_celery_chord
 from collectivo.extensions.models import Extension
 from collectivo.menus.models import MenuItem
 from collectivo.payments.models import Invoice, ItemEntry, Subscription
+from collectivo.payments.reconciliation import BankTransaction, reconcile
+from collectivo.tags.models import Tag
 from collectivo.utils.test import create_testadmin, create_testuser
 
-from .models import Membership, MembershipType
+from .imports import import_memberships, read_rows
+from .models import (
+    Membership,
+    MembershipNumberSequence,
+    MembershipStatus,
+    MembershipType,
+)
+from .shares import update_shares_paid_for_invoices
+from .statistics import (
+    calculate_all_statistics,
+    get_statistics,
+    update_statistics_rollups,
+)
 
 User = get_user_model()
 
 MEMBERSHIP_URL_NAME = "collectivo.memberships:membership-detail"
+MEMBERSHIPS_URL = reverse("collectivo.memberships:membership-list")
+IMPORT_URL = reverse("collectivo.memberships:membership-import")
+BULK_UPDATE_URL = reverse("collectivo.memberships:membership-bulk_update")
+STATISTICS_URL = reverse("collectivo.memberships:membershiptype-statistics")
+TIMESERIES_URL = reverse("collectivo.memberships:statistics-timeseries")
+HISTORY_URL = reverse("collectivo.memberships:membership-history-list")
+MEMBERSHIPS_SCHEMA_URL = reverse("collectivo.memberships:membership-schema")
+TAG_CHOICES_URL = reverse(
+    "collectivo.memberships:membership-schema-choices",
+    kwargs={"field": "user__tags"},
+)
 
 
 class MembershipsSetupTests(TestCase):
@@ -60,15 +100,17 @@ class MembershipsEmailsTests(TestCase):
             auto_appl.is_active = True
             auto_appl.save()
 
-    @patch("collectivo.emails.models.chain")
-    def test_automatic_emails(self, chain):
+    @patch("collectivo.emails.models.chord")
+    def test_automatic_emails(self, chord):
         """Test that automatic emails are sent."""
 
         self.membership = Membership.objects.create(
             user=self.user, type=self.membership_type, shares_signed=10
         )
 
-        run_mocked_celery_chain(chain)
+        with self.captureOnCommitCallbacks(execute=True):
+            EmailTrigger.send_all(delay=0)
+        run_mocked_celery_chord(chord)
         self.assertEqual(len(mail.outbox), 1)
         self.assertEqual(mail.outbox[0].subject, "Test Subject applied")
         self.assertEqual(
@@ -78,10 +120,52 @@ class MembershipsEmailsTests(TestCase):
         self.membership.stage = "accepted"
         self.membership.save()
 
-        run_mocked_celery_chain(chain)
+        with self.captureOnCommitCallbacks(execute=True):
+            EmailTrigger.send_all(delay=0)
+        run_mocked_celery_chord(chord)
         self.assertEqual(len(mail.outbox), 2)
         self.assertEqual(mail.outbox[1].subject, "Test Subject accepted")
 
+    @patch("collectivo.emails.models.chord")
+    def test_email_triggers_are_merged(self, chord):
+        """Test that triggers are sent as one campaign per automation."""
+        other = User.objects.create_user("other", email="other@example.com")
+        users = [self.user, other]
+        memberships = [
+            Membership.objects.create(user=user, type=self.membership_type)
+            for user in users
+        ]
+        memberships[0].shares_signed = 1
+        memberships[0].save()
+        self.assertEqual(EmailTrigger.objects.count(), 2)
+
+        # Triggers are only sent after the delay
+        self.assertEqual(EmailTrigger.send_all(), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(EmailTrigger.send_all(delay=0), 2)
+        self.assertEqual(chord.call_count, 1)
+        campaign = EmailCampaign.objects.get()
+        self.assertEqual(
+            set(campaign.recipients.values_list("pk", flat=True)),
+            {user.pk for user in users},
+        )
+        self.assertFalse(EmailTrigger.objects.exists())
+
+    @patch("collectivo.emails.models.chord")
+    def test_email_trigger_errors(self, chord):
+        """Test that triggers of recipients without an email are dropped."""
+        no_email = User.objects.create_user("no_email")
+        applied = EmailAutomation.objects.get(name="membership_applied")
+        applied.queue([no_email, self.user])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertLogs("collectivo.emails.models", "WARNING"):
+                self.assertEqual(EmailTrigger.send_all(delay=0), 1)
+        self.assertEqual(chord.call_count, 1)
+        campaign = EmailCampaign.objects.get()
+        self.assertEqual(list(campaign.recipients.all()), [self.user])
+        self.assertFalse(EmailTrigger.objects.exists())
+
 
 class MembershipsPaymentsTests(TestCase):
     """Test the connection between the memberships and payments extension."""
@@ -181,6 +265,48 @@ class MembershipsPaymentsTests(TestCase):
         self.membership.refresh_from_db()
         self.assertEqual(self.membership.shares_paid, 15)
 
+    def test_shares_paid_status_changes(self):
+        """Test that shares are only updated if an invoice is (un)paid."""
+        inv = Invoice.objects.get(payment_from__user=self.user)
+        inv.notes = "Not a status change"
+        with CaptureQueriesContext(connection) as queries:
+            inv.save()
+        self.assertFalse(
+            any("SUM" in query["sql"] for query in queries.captured_queries)
+        )
+        inv.status = "paid"
+        inv.save()
+        self.membership.refresh_from_db()
+        self.assertEqual(self.membership.shares_paid, 10)
+        inv.status = "open"
+        inv.save()
+        self.membership.refresh_from_db()
+        self.assertEqual(self.membership.shares_paid, 0)
+
+    def test_shares_paid_bulk(self):
+        """Test that shares of many invoices are updated together."""
+        invoices = Invoice.objects.filter(payment_from__user=self.user)
+        invoices.update(status="paid")
+        # Entries, memberships, sum, stored values, update, and history
+        with self.assertNumQueries(6):
+            changed = update_shares_paid_for_invoices(invoices)
+        self.assertEqual(changed, [self.membership])
+        self.membership.refresh_from_db()
+        self.assertEqual(self.membership.shares_paid, 10)
+        self.assertEqual(self.membership.history.first().shares_paid, 10)
+
+    def test_shares_paid_reconciliation(self):
+        """Test that shares are updated after a bank statement is applied."""
+        invoice = Invoice.objects.get(
+            items__type__name=self.membership_type.short_name
+        )
+        result = reconcile(
+            [BankTransaction(amount=150, reference=f"INV-{invoice.pk}")]
+        )
+        self.assertEqual(result["paid"], 1)
+        self.membership.refresh_from_db()
+        self.assertEqual(self.membership.shares_paid, 10)
+
 
 class MembershipsTests(TestCase):
     """Test the memberships extension."""
@@ -242,3 +368,625 @@ class MembershipsTests(TestCase):
         payload = {"number": 20}
         self.client.patch(url, payload)
         self.assertNotEqual(self.membership.number, 20)
+
+
+class MembershipsSchemaTests(TestCase):
+    """Test the schema and choices of the memberships extension."""
+
+    def setUp(self):
+        """Prepare client and create tags."""
+        self.admin = create_testadmin()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        Tag.objects.all().delete()
+        self.tags = [
+            Tag.objects.create(name=name)
+            for name in ["Apple", "Banana", "Apricot"]
+        ]
+
+    def test_schema_choices_url(self):
+        """Test that choices can be replaced by their url and count."""
+        res = self.client.get(MEMBERSHIPS_SCHEMA_URL, {"choices": "url"})
+        self.assertEqual(res.status_code, 200)
+        field = res.data["fields"]["user__tags"]
+        self.assertNotIn("choices", field)
+        self.assertEqual(field["choices_count"], 3)
+        self.assertEqual(field["choices_url"], TAG_CHOICES_URL)
+
+        res = self.client.get(MEMBERSHIPS_SCHEMA_URL)
+        self.assertEqual(len(res.data["fields"]["user__tags"]["choices"]), 3)
+
+    def test_choices(self):
+        """Test that choices can be searched and paginated."""
+        res = self.client.get(TAG_CHOICES_URL, {"search": "ap", "limit": 1})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data["results"], [(self.tags[0].pk, "Apple")])
+        res = self.client.get(res.data["next"])
+        self.assertEqual(res.data["results"], [(self.tags[2].pk, "Apricot")])
+        self.assertIsNone(res.data["next"])
+
+        for limit in [0, -1]:
+            res = self.client.get(TAG_CHOICES_URL, {"limit": limit})
+            self.assertEqual(res.status_code, 400)
+
+    def test_choices_invalid_field(self):
+        """Test that only related fields have choices."""
+        url = reverse(
+            "collectivo.memberships:membership-schema-choices",
+            kwargs={"field": "shares_signed"},
+        )
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, 404)
+
+
+class MembershipsQueryTests(TestCase):
+    """Test the number of queries of the memberships API."""
+
+    def setUp(self):
+        """Prepare client and membership type."""
+        self.admin = create_testadmin()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.membership_type = MembershipType.objects.create(name="Test")
+        self.tag = Tag.objects.create(name="Test tag")
+
+    def create_memberships(self, start, end):
+        """Create memberships for new users with a tag."""
+        for i in range(start, end):
+            user = User.objects.create(username=f"user_{i}")
+            user.tags.add(self.tag)
+            Membership.objects.create(user=user, type=self.membership_type)
+
+    def count_queries(self):
+        """Count the queries of a request to the membership list."""
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(MEMBERSHIPS_URL)
+        self.assertEqual(res.status_code, 200)
+        return len(queries)
+
+    def test_list_queries_are_constant(self):
+        """Test that the number of queries does not grow with the rows."""
+        self.create_memberships(0, 1)
+        self.client.get(MEMBERSHIPS_URL)
+        queries = self.count_queries()
+        self.create_memberships(1, 10)
+        self.assertEqual(self.count_queries(), queries)
+        res = self.client.get(MEMBERSHIPS_URL)
+        self.assertEqual(res.data[0]["user__tags"], [self.tag.pk])
+
+
+class MembershipsImportTests(TestCase):
+    """Test the bulk import of memberships."""
+
+    def setUp(self):
+        """Prepare client, users, and membership types."""
+        self.admin = create_testadmin()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.users = [
+            User.objects.create(username=f"user_{i}", email=f"{i}@example.com")
+            for i in range(3)
+        ]
+        self.membership_type = MembershipType.objects.create(
+            name="Test Type",
+            has_shares=True,
+            shares_amount_per_share=15,
+        )
+        self.subscription_type = MembershipType.objects.create(
+            name="Test Type Sub", has_fees=True
+        )
+
+    def test_import(self):
+        """Test that memberships, invoices, and groups are created."""
+        payload = [
+            {"user": self.users[0].pk, "type": self.membership_type.pk},
+            {
+                "user": self.users[1].pk,
+                "type": self.membership_type.pk,
+                "number": 5,
+                "shares_signed": 2,
+            },
+            {"user": 9999, "type": self.membership_type.pk},
+            {
+                "user": self.users[1].pk,
+                "type": self.subscription_type.pk,
+                "fees_amount": 11,
+            },
+        ]
+        res = self.client.post(
+            f"{IMPORT_URL}?emails=false", payload, format="json"
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data["created"], 3)
+        self.assertEqual([e["row"] for e in res.data["errors"]], [2])
+
+        m0 = Membership.objects.get(user=self.users[0])
+        m1 = Membership.objects.get(user=self.users[1], type__has_shares=True)
+        self.assertEqual(m1.number, 5)
+        self.assertEqual(m0.number, 6)
+        self.assertEqual(m0.history.count(), 1)
+        self.assertTrue(
+            self.users[0]
+            .permission_groups.filter(name=self.membership_type.short_name)
+            .exists()
+        )
+
+        entry = ItemEntry.objects.get(
+            invoice__payment_from__user=self.users[1]
+        )
+        self.assertEqual(entry.amount, 2)
+        self.assertEqual(entry.price, 15)
+        sub = Subscription.objects.get(payment_from__user=self.users[1])
+        self.assertEqual(sub.items.first().price, 11)
+
+        # Memberships that exist already are reported
+        res = self.client.post(IMPORT_URL, payload[:1], format="json")
+        self.assertEqual(res.data["created"], 0)
+        self.assertIn("user", res.data["errors"][0]["errors"])
+
+    def test_import_csv(self):
+        """Test that memberships can be imported from a CSV file."""
+        content = "user,type,status,shares_signed\n" + "".join(
+            f"{user.pk},{self.membership_type.pk},,1\n" for user in self.users
+        )
+        file = SimpleUploadedFile("members.csv", content.encode())
+        res = self.client.post(
+            f"{IMPORT_URL}?emails=false", {"file": file}, format="multipart"
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data, {"created": 3, "errors": []})
+        self.assertEqual(
+            ItemEntry.objects.filter(invoice__isnull=False).count(), 3
+        )
+
+    def test_import_invalid_file(self):
+        """Test that invalid files are rejected."""
+        for name, content in [
+            ("members.csv", b"user\n" + b"1" * 200000 + b"\n"),
+            ("members.csv", b"user\n\xff\n"),
+            ("members.json", b"[{"),
+        ]:
+            file = SimpleUploadedFile(name, content)
+            res = self.client.post(IMPORT_URL, {"file": file})
+            self.assertEqual(res.status_code, 400)
+
+    def test_import_invalid_file_after_chunk(self):
+        """Test that saved rows are reported if the file breaks later."""
+        content = "user,type\n" + "".join(
+            f"{user.pk},{self.membership_type.pk}\n" for user in self.users
+        )
+        stream = io.StringIO(content + "1" * 200000 + "\n")
+        report = import_memberships(
+            read_rows(stream, "csv"), chunk_size=2, send_emails=False
+        )
+        self.assertEqual(report["created"], 2)
+        self.assertEqual(len(report["errors"]), 1)
+        self.assertEqual(report["errors"][0]["row"], 2)
+        self.assertIn("file", report["errors"][0]["errors"])
+
+    @patch("collectivo.emails.models.chord")
+    def test_import_emails(self, chord):
+        """Test that emails of imports are queued as triggers."""
+        automation = EmailAutomation.objects.get(name="membership_applied")
+        automation.subject = "Welcome"
+        automation.body = "Your number is {{ membership.number }}"
+        automation.is_active = True
+        automation.save()
+
+        payload = [
+            {"user": user.pk, "type": self.membership_type.pk}
+            for user in self.users
+        ]
+        res = self.client.post(IMPORT_URL, payload, format="json")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(EmailTrigger.objects.count(), 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            EmailTrigger.send_all(delay=0)
+        self.assertEqual(chord.call_count, 1)
+        run_mocked_celery_chord(chord)
+        self.assertEqual(len(mail.outbox), 3)
+        bodies = {email.to[0]: email.body for email in mail.outbox}
+        self.assertIn("Your number is 3", bodies["2@example.com"])
+
+
+class MembershipsBulkUpdateTests(TestCase):
+    """Test the bulk update of memberships."""
+
+    def setUp(self):
+        """Prepare client and memberships."""
+        self.admin = create_testadmin()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.membership_type = MembershipType.objects.create(
+            name="Test Type",
+            has_shares=True,
+            shares_amount_per_share=15,
+        )
+        self.memberships = [
+            Membership.objects.create(
+                user=User.objects.create(
+                    username=f"user_{i}", email=f"{i}@example.com"
+                ),
+                type=self.membership_type,
+                shares_signed=1,
+            )
+            for i in range(6)
+        ]
+
+    def test_bulk_update(self):
+        """Test that valid rows are saved and invalid rows are reported."""
+        automation = EmailAutomation.objects.get(name="membership_accepted")
+        automation.subject = "Accepted"
+        automation.body = "Accepted"
+        automation.is_active = True
+        automation.save()
+        m0, m1 = self.memberships[:2]
+        payload = [
+            {
+                "id": m0.pk,
+                "shares_signed": 3,
+                "stage": "accepted",
+                "date_accepted": "2023-01-01",
+            },
+            {"id": m1.pk, "type": 9999},
+            {"id": 9999},
+            {"id": m1.pk, "user": m0.user_id},
+            {"id": self.memberships[2].pk, "shares_signed": 1},
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.patch(BULK_UPDATE_URL, payload, format="json")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data["updated"], 1)
+        self.assertEqual([e["row"] for e in res.data["errors"]], [1, 2, 3])
+        self.assertIn("type", res.data["errors"][0]["errors"])
+        self.assertIn("non_field_errors", res.data["errors"][2]["errors"])
+
+        m0.refresh_from_db()
+        self.assertEqual(m0.shares_signed, 3)
+        self.assertEqual(m0.stage, "accepted")
+        self.assertEqual(m0.history.count(), 2)
+        self.assertEqual(self.memberships[2].history.count(), 1)
+        self.assertEqual(
+            sum(
+                entry.amount * entry.price
+                for entry in ItemEntry.objects.filter(
+                    invoice__payment_from__user=m0.user
+                )
+            ),
+            45,
+        )
+        self.assertEqual(
+            list(EmailTrigger.objects.values_list("recipient", flat=True)),
+            [m0.user_id],
+        )
+
+    def test_bulk_update_nested_conflict(self):
+        """Test that unique conflicts of nested rows are reported."""
+        m0, m1 = self.memberships[:2]
+        other_type = MembershipType.objects.create(name="Other Type")
+        Membership.objects.create(user=m1.user, type=other_type)
+        tag = Tag.objects.create(name="Bulk tag")
+        payload = [
+            {"id": m0.pk, "shares_signed": 2, "user__tags": [tag.pk]},
+            {"id": m1.pk, "type": other_type.pk, "user__tags": []},
+        ]
+        res = self.client.patch(BULK_UPDATE_URL, payload, format="json")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data["updated"], 1)
+        self.assertEqual([e["row"] for e in res.data["errors"]], [1])
+        self.assertIn("non_field_errors", res.data["errors"][0]["errors"])
+        m0.refresh_from_db()
+        m1.refresh_from_db()
+        self.assertEqual(m0.shares_signed, 2)
+        self.assertEqual(list(m0.user.tags.all()), [tag])
+        self.assertEqual(m1.type, self.membership_type)
+
+    def test_bulk_update_queries(self):
+        """Test that the number of queries does not depend on the rows."""
+        # Cache the permissions of the admin
+        self.client.get(MEMBERSHIPS_URL)
+        counts = []
+        for memberships in [self.memberships[:2], self.memberships[2:]]:
+            payload = [{"id": m.pk, "shares_signed": 2} for m in memberships]
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.patch(
+                    BULK_UPDATE_URL, payload, format="json"
+                )
+            self.assertEqual(res.data["updated"], len(memberships))
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    @patch("collectivo.core.tasks.run_job_async.delay")
+    def test_bulk_update_async(self, delay):
+        """Test that bulk updates can be run as a job."""
+        payload = [
+            {"id": self.memberships[0].pk, "shares_signed": 2},
+            {"id": 9999},
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.patch(
+                f"{BULK_UPDATE_URL}?async=true", payload, format="json"
+            )
+        self.assertEqual(res.status_code, 202)
+        delay.assert_called_once_with(res.data["job"])
+        run_job_async(res.data["job"])
+
+        job = Job.objects.get(pk=res.data["job"])
+        self.assertEqual(job.status, "success")
+        self.assertEqual((job.done, job.total), (2, 2))
+        self.assertEqual(job.result, {"updated": 1})
+        self.assertEqual([e["row"] for e in job.errors], [1])
+        self.memberships[0].refresh_from_db()
+        self.assertEqual(self.memberships[0].shares_signed, 2)
+
+
+class MembershipNumberTests(TestCase):
+    """Test the allocation of membership numbers."""
+
+    def setUp(self):
+        """Prepare membership type and users."""
+        self.membership_type = MembershipType.objects.create(name="Test")
+        self.users = [
+            User.objects.create(username=f"user_{i}") for i in range(3)
+        ]
+
+    def create_membership(self, user, **kwargs):
+        """Create a membership of the test type."""
+        return Membership.objects.create(
+            user=user, type=self.membership_type, **kwargs
+        )
+
+    def test_numbers(self):
+        """Test that numbers follow reserved blocks and manual numbers."""
+        self.assertEqual(self.create_membership(self.users[0]).number, 1)
+        block = MembershipNumberSequence.reserve(self.membership_type, 5)
+        self.assertEqual(list(block), [2, 3, 4, 5, 6])
+        self.assertEqual(self.create_membership(self.users[1]).number, 7)
+        self.create_membership(self.users[2], number=20)
+        self.assertEqual(
+            MembershipNumberSequence.reserve(self.membership_type)[0], 21
+        )
+
+    def test_sequence_starts_after_existing_numbers(self):
+        """Test that a new sequence continues existing numbers."""
+        self.create_membership(self.users[0], number=10)
+        MembershipNumberSequence.objects.all().delete()
+        self.assertEqual(self.create_membership(self.users[1]).number, 11)
+
+
+@skipUnless(
+    connection.features.has_select_for_update,
+    "Database does not support row locks.",
+)
+class MembershipNumberConcurrencyTests(TransactionTestCase):
+    """Test that parallel registrations get different numbers."""
+
+    def test_parallel_registrations(self):
+        """Test that parallel registrations get unique numbers."""
+        membership_type = MembershipType.objects.create(name="Test")
+        n = 8
+        users = [User.objects.create(username=f"user_{i}") for i in range(n)]
+        barrier = Barrier(n)
+
+        def register(user):
+            try:
+                barrier.wait()
+                return Membership.objects.create(
+                    user=user, type=membership_type
+                ).number
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=n) as executor:
+            numbers = list(executor.map(register, users))
+        self.assertEqual(sorted(numbers), list(range(1, n + 1)))
+
+
+class MembershipsStatisticsTests(TestCase):
+    """Test the statistics of membership types."""
+
+    def setUp(self):
+        """Prepare membership types and memberships."""
+        self.admin = create_testadmin()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.status = MembershipStatus.objects.create(name="Active")
+        self.types = [
+            MembershipType.objects.create(name=f"Type {i}") for i in range(2)
+        ]
+        self.types[0].statuses.add(self.status)
+        self.users = [
+            User.objects.create(username=f"user_{i}") for i in range(3)
+        ]
+        for user, shares in zip(self.users, [1, 2, 6]):
+            Membership.objects.create(
+                user=user,
+                type=self.types[0],
+                shares_signed=shares,
+                status=self.status if shares > 1 else None,
+            )
+        Membership.objects.filter(user=self.users[2]).update(
+            date_ended="2023-01-01"
+        )
+
+    def test_statistics(self):
+        """Test that statistics of all types are calculated together."""
+        with self.assertNumQueries(2):
+            statistics = calculate_all_statistics(
+                [self.types[0].pk, self.types[1].pk]
+            )
+        stats = statistics[self.types[0].pk]
+        self.assertEqual(stats["memberships (without date_ended)"], 2)
+        self.assertEqual(stats["ended memberships (with date_ended)"], 1)
+        self.assertEqual(stats["memberships with status: Active"], 1)
+        self.assertEqual(stats["shares_signed__sum"], 9)
+        self.assertEqual(stats["shares_signed__max"], 6)
+        stats = statistics[self.types[1].pk]
+        self.assertEqual(stats["memberships (without date_ended)"], 0)
+        self.assertIsNone(stats["shares_signed__sum"])
+
+    def test_statistics_cache(self):
+        """Test that cached statistics are refreshed after changes."""
+        res = self.client.get(STATISTICS_URL)
+        self.assertEqual(res.status_code, 200)
+        type_id = self.types[1].pk
+        self.assertEqual(
+            res.data[type_id]["memberships (without date_ended)"], 0
+        )
+        with self.assertNumQueries(0):
+            get_statistics([type_id])
+        Membership.objects.create(user=self.users[0], type=self.types[1])
+        res = self.client.get(STATISTICS_URL)
+        self.assertEqual(
+            res.data[type_id]["memberships (without date_ended)"], 1
+        )
+
+        # Both types are refreshed if the type of a membership changes
+        membership = Membership.objects.create(
+            user=self.admin, type=self.types[1]
+        )
+        self.client.get(STATISTICS_URL)
+        membership.type = self.types[0]
+        membership.number = 100
+        membership.save()
+        res = self.client.get(STATISTICS_URL)
+        self.assertEqual(
+            res.data[type_id]["memberships (without date_ended)"], 1
+        )
+        self.assertEqual(
+            res.data[self.types[0].pk]["memberships (without date_ended)"], 3
+        )
+
+
+class MembershipsTimeseriesTests(TestCase):
+    """Test the statistics of memberships over time."""
+
+    def setUp(self):
+        """Prepare client and memberships with history."""
+        self.admin = create_testadmin()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.membership_type = MembershipType.objects.create(name="Test")
+        self.memberships = [
+            Membership.objects.create(
+                user=User.objects.create(username=f"user_{i}"),
+                type=self.membership_type,
+                shares_signed=shares,
+            )
+            for i, shares in enumerate([2, 3])
+        ]
+        self.today = timezone.localdate()
+        Membership.history.update(
+            history_date=timezone.now() - timedelta(days=10)
+        )
+
+    def test_timeseries(self):
+        """Test that rollups are updated incrementally."""
+        self.assertEqual(update_statistics_rollups(), 2)
+        membership = self.memberships[0]
+        membership.stage = "accepted"
+        membership.date_accepted = self.today
+        membership.save()
+        self.memberships[1].delete()
+        self.assertEqual(update_statistics_rollups(delay=timedelta(0)), 2)
+        self.assertEqual(update_statistics_rollups(delay=timedelta(0)), 0)
+
+        start = self.today - timedelta(days=12)
+        res = self.client.get(
+            TIMESERIES_URL, {"start": start, "group_by": "stage"}
+        )
+        self.assertEqual(res.status_code, 200)
+        points = {(p["date"], p["stage"]): p for p in res.data}
+        self.assertNotIn((start, "applied"), points)
+        past = points[(self.today - timedelta(days=10), "applied")]
+        self.assertEqual(past["memberships"], 2)
+        self.assertEqual(past["shares_signed"], 5)
+        self.assertEqual(points[(self.today, "applied")]["memberships"], 0)
+        now = points[(self.today, "accepted")]
+        self.assertEqual(now["memberships"], 1)
+        self.assertEqual(now["shares_signed"], 2)
+
+        res = self.client.get(
+            TIMESERIES_URL,
+            {"start": start, "granularity": "month", "group_by": "type"},
+        )
+        self.assertEqual(res.data[-1]["date"], self.today.replace(day=1))
+        self.assertEqual(res.data[-1]["memberships"], 1)
+
+    def test_timeseries_delay(self):
+        """Test that recent entries are left for a later update."""
+        self.memberships[0].shares_signed = 5
+        self.memberships[0].save()
+        # The entry after the recent entry is also left for later
+        self.memberships[1].shares_signed = 5
+        self.memberships[1].save()
+        self.memberships[1].history.filter(history_type="~").update(
+            history_date=timezone.now() - timedelta(days=1)
+        )
+        self.assertEqual(update_statistics_rollups(), 2)
+        self.assertEqual(update_statistics_rollups(), 0)
+        self.assertEqual(update_statistics_rollups(delay=timedelta(0)), 2)
+
+    def test_timeseries_invalid_parameters(self):
+        """Test that invalid parameters are rejected."""
+        for params in [
+            {"granularity": "year"},
+            {"group_by": "user"},
+            {"start": "yesterday"},
+            {"start": "2000-01-01", "end": "2010-01-01"},
+        ]:
+            res = self.client.get(TIMESERIES_URL, params)
+            self.assertEqual(res.status_code, 400)
+
+
+class MembershipsHistoryTests(TestCase):
+    """Test the history endpoint of memberships."""
+
+    def setUp(self):
+        """Prepare client and memberships with changes."""
+        self.client = APIClient()
+        self.client.force_authenticate(create_testadmin())
+        self.membership_type = MembershipType.objects.create(name="Test")
+
+    def create_memberships(self, n):
+        """Create memberships that have been changed once."""
+        for i in range(n):
+            membership = Membership.objects.create(
+                user=User.objects.create(username=f"history_{n}_{i}"),
+                type=self.membership_type,
+                shares_signed=1,
+            )
+            membership.shares_signed = 2
+            membership.save()
+
+    def test_history_changes(self):
+        """Test that changes are listed with a constant number of queries."""
+        self.create_memberships(2)
+        self.client.get(HISTORY_URL)
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(HISTORY_URL)
+        self.assertEqual(res.status_code, 200)
+        membership = Membership.objects.order_by("pk").first()
+        records = {
+            r["history_type"]: r for r in res.data if r["id"] == membership.pk
+        }
+        self.assertIsNone(records["+"]["history_changed_fields"])
+        self.assertFalse(records["+"]["history_is_latest"])
+        self.assertEqual(
+            records["~"]["history_changed_fields"], ["shares_signed"]
+        )
+        self.assertTrue(records["~"]["history_is_latest"])
+
+        self.create_memberships(5)
+        with self.assertNumQueries(len(queries)):
+            self.client.get(HISTORY_URL)
+
+    def test_history_changes_paginated(self):
+        """Test that changes are found for records outside of the page."""
+        self.create_memberships(2)
+        res = self.client.get(HISTORY_URL, {"limit": 1})
+        self.assertEqual(res.status_code, 200)
+        record = res.data["results"][0]
+        self.assertEqual(record["history_type"], "~")
+        self.assertEqual(record["history_changed_fields"], ["shares_signed"])
+        self.assertTrue(record["history_is_latest"])
@@ -23,6 +23,9 @@ router.register(
     basename="type-history",
 )
 router.register("statuses", views.MembershipStatusViewSet, basename="status")
+router.register(
+    "statistics", views.MembershipStatisticsViewSet, basename="statistics"
+)
 router.register("profiles", views.MembershipProfileViewSet, basename="profile")
 
 self_router = DefaultRouter()
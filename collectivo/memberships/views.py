@@ -1,8 +1,14 @@
 """Views of the memberships extension."""
+import io
+from datetime import timedelta
+
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from drf_spectacular.utils import OpenApiResponse, extend_schema
 from rest_framework import mixins, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ParseError
 from rest_framework.mixins import (
     CreateModelMixin,
     ListModelMixin,
@@ -14,17 +20,43 @@ from rest_framework.serializers import Serializer
 from rest_framework.viewsets import GenericViewSet, ModelViewSet
 
 from collectivo.utils.filters import get_filterset, get_ordering_fields
-from collectivo.utils.mixins import BulkEditMixin, HistoryMixin, SchemaMixin
+from collectivo.utils.mixins import (
+    BulkEditMixin,
+    HistoryMixin,
+    OptimizeQuerysetMixin,
+    SchemaMixin,
+    get_int_param,
+)
 from collectivo.utils.permissions import HasPerm, IsAuthenticated
 from collectivo.utils.schema import get_choices, get_model_schema
 
 from . import serializers
-from .models import Membership, MembershipStatus, MembershipType
+from .imports import (
+    InvalidFileError,
+    import_memberships,
+    read_rows,
+    update_memberships,
+)
+from .models import (
+    Membership,
+    MembershipStatisticsRollup,
+    MembershipStatus,
+    MembershipType,
+)
+from .statistics import (
+    GRANULARITIES,
+    ROLLUP_FIELDS,
+    TIMESERIES_MAX_DAYS,
+    get_statistics,
+    get_timeseries,
+)
 
 User = get_user_model()
 
 
-class MembershipAdminViewSet(SchemaMixin, BulkEditMixin, ModelViewSet):
+class MembershipAdminViewSet(
+    SchemaMixin, BulkEditMixin, OptimizeQuerysetMixin, ModelViewSet
+):
     """ViewSet to manage memberships with a type and status."""
 
     queryset = Membership.objects.all()
@@ -37,6 +69,38 @@ class MembershipAdminViewSet(SchemaMixin, BulkEditMixin, ModelViewSet):
     filterset_class = get_filterset(serializer_class)
     ordering_fields = get_ordering_fields(serializer_class)
 
+    @extend_schema(responses={200: OpenApiResponse()})
+    @action(
+        detail=False,
+        methods=["POST"],
+        url_path="import",
+        url_name="import",
+    )
+    def import_memberships(self, request):
+        """Import memberships from a list or an uploaded CSV/JSON file.
+
+        Set the parameter 'emails' to 'false' to skip automatic emails.
+        """
+        file = request.FILES.get("file")
+        if file is not None:
+            file_format = "csv" if file.name.endswith(".csv") else "json"
+            stream = io.TextIOWrapper(file, encoding="utf-8-sig")
+            rows = read_rows(stream, file_format)
+        elif isinstance(request.data, list):
+            rows = request.data
+        else:
+            raise ParseError("Invalid data (expected a list or a file)")
+        send_emails = request.query_params.get("emails") != "false"
+        try:
+            report = import_memberships(rows, send_emails=send_emails)
+        except InvalidFileError as e:
+            raise ParseError(str(e))
+        return Response(report)
+
+    def perform_bulk_update(self, objects, fields, user=None):
+        """Update memberships and run their side effects in batches."""
+        return update_memberships(objects, fields, user=user)
+
 
 class MembershipProfileViewSet(SchemaMixin, ModelViewSet):
     """Manage memberships assigned to users."""
@@ -148,6 +212,88 @@ class MembershipTypeViewSet(SchemaMixin, ModelViewSet):
     filterset_class = get_filterset(serializer_class)
     ordering_fields = get_ordering_fields(serializer_class)
 
+    @extend_schema(responses={200: OpenApiResponse()})
+    @action(
+        detail=False,
+        methods=["GET"],
+        url_path="statistics",
+        url_name="statistics",
+    )
+    def statistics(self, request):
+        """Return the statistics of all membership types by their id."""
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(get_statistics(queryset.values_list("pk", flat=True)))
+
+
+class MembershipStatisticsViewSet(GenericViewSet):
+    """ViewSet for statistics of memberships over time."""
+
+    queryset = MembershipStatisticsRollup.objects.all()
+    permission_classes = [HasPerm]
+    required_perms = {
+        "GET": [("view_memberships", "memberships")],
+    }
+
+    def get_date_param(self, name, default):
+        """Get a date query parameter or raise a ParseError."""
+        value = self.request.query_params.get(name)
+        if not value:
+            return default
+        try:
+            day = parse_date(value)
+        except ValueError:
+            day = None
+        if day is None:
+            raise ParseError(f"Parameter '{name}' must be a date.")
+        return day
+
+    @extend_schema(responses={200: OpenApiResponse()})
+    @action(
+        detail=False,
+        methods=["GET"],
+        url_path="timeseries",
+        url_name="timeseries",
+    )
+    def timeseries(self, request):
+        """Return statistics of memberships over time.
+
+        Use the parameters 'start' and 'end' to set a date range (default:
+        the last 30 days, at most five years), 'granularity' to get data
+        points per 'day', 'week', or 'month', 'group_by' to split the data by
+        a comma-separated list of 'type', 'status', and 'stage', and 'type',
+        'status', or 'stage' to filter the data.
+        """
+        end = self.get_date_param("end", timezone.localdate())
+        start = self.get_date_param("start", end - timedelta(days=30))
+        if start > end:
+            raise ParseError("Parameter 'start' must be before 'end'.")
+        if (end - start).days > TIMESERIES_MAX_DAYS:
+            raise ParseError(
+                f"The date range must be at most {TIMESERIES_MAX_DAYS} days."
+            )
+        granularity = request.query_params.get("granularity", "day")
+        if granularity not in GRANULARITIES:
+            raise ParseError(
+                f"Parameter 'granularity' must be one of {GRANULARITIES}."
+            )
+        group_by = request.query_params.get("group_by")
+        group_by = group_by.split(",") if group_by else ROLLUP_FIELDS
+        if not set(group_by) <= set(ROLLUP_FIELDS):
+            raise ParseError(
+                f"Parameter 'group_by' must be a subset of {ROLLUP_FIELDS}."
+            )
+        filters = {
+            field: request.query_params[field]
+            for field in ROLLUP_FIELDS
+            if request.query_params.get(field)
+        }
+        for field in ["type", "status"]:
+            if field in filters:
+                filters[field] = get_int_param(request, field)
+        return Response(
+            get_timeseries(start, end, granularity, group_by, filters)
+        )
+
 
 class MembershipStatusViewSet(SchemaMixin, ModelViewSet):
     """ViewSet to manage membership statuses (e.g. active or investing)."""
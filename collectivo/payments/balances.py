@@ -0,0 +1,53 @@
+"""Balances of payment accounts."""
+from django.db import transaction
+from django.db.models import F, Sum
+
+from .models import Account, AccountBalance, Invoice, ItemEntry
+
+
+def get_balance_totals(account_ids):
+    """Get the totals of accounts per item category and invoice status."""
+    return (
+        ItemEntry.objects.filter(invoice__payment_from__in=account_ids)
+        .values("invoice__payment_from", "type__category", "invoice__status")
+        .annotate(total=Sum(F("amount") * F("price")))
+        .order_by()
+    )
+
+
+@transaction.atomic
+def update_account_balances(account_ids):
+    """Calculate the balances of accounts again.
+
+    The accounts are locked, so that parallel updates wait for each other.
+    The totals of all accounts are calculated with one grouped query.
+    """
+    account_ids = {pk for pk in account_ids if pk is not None}
+    if not account_ids:
+        return
+    list(
+        Account.objects.select_for_update()
+        .filter(pk__in=account_ids)
+        .values_list("pk", flat=True)
+    )
+    AccountBalance.objects.filter(account__in=account_ids).delete()
+    AccountBalance.objects.bulk_create(
+        [
+            AccountBalance(
+                account_id=row["invoice__payment_from"],
+                category_id=row["type__category"],
+                status=row["invoice__status"],
+                total=row["total"] or 0,
+            )
+            for row in get_balance_totals(account_ids)
+        ]
+    )
+
+
+def update_invoice_balances(invoice_ids):
+    """Calculate the balances of the accounts of invoices again."""
+    update_account_balances(
+        Invoice.objects.filter(pk__in=invoice_ids)
+        .values_list("payment_from", flat=True)
+        .distinct()
+    )
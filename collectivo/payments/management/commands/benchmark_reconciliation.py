@@ -0,0 +1,174 @@
+"""Command to benchmark the reconciliation of bank statements."""
+import io
+import random
+import time
+from decimal import Decimal
+from difflib import SequenceMatcher
+
+from django.core.management.base import BaseCommand
+
+from collectivo.payments.reconciliation import (
+    NAME_SIMILARITY,
+    REFERENCE_PATTERN,
+    BankTransaction,
+    InvoiceIndex,
+    normalize_name,
+    parse_camt053,
+)
+
+PROFILE = "payment_from__user__payment_profile"
+AMOUNTS = [Decimal(n) for n in range(5, 205, 5)]
+CAMT_ENTRY = (
+    "<Ntry><Amt Ccy='EUR'>{amount}</Amt><CdtDbtInd>CRDT</CdtDbtInd>"
+    "<BookgDt><Dt>2023-05-02</Dt></BookgDt><NtryDtls><TxDtls>"
+    "<RltdPties><Dbtr><Nm>{name}</Nm></Dbtr><DbtrAcct><Id>"
+    "<IBAN>{iban}</IBAN></Id></DbtrAcct></RltdPties>"
+    "<RmtInf><Ustrd>{reference}</Ustrd></RmtInf></TxDtls></NtryDtls></Ntry>"
+)
+
+
+def create_invoices(n_invoices, n_payers, rng: random.Random):
+    """Create rows of synthetic open invoices."""
+    return [
+        {
+            "pk": pk,
+            "total": rng.choice(AMOUNTS),
+            "payment_from__name": "",
+            "payment_from__user__first_name": f"First{pk % n_payers}",
+            "payment_from__user__last_name": f"Last{pk % n_payers}",
+            f"{PROFILE}__bank_account_iban": f"AT{pk % n_payers:018d}",
+            f"{PROFILE}__bank_account_owner": "",
+        }
+        for pk in range(1, n_invoices + 1)
+    ]
+
+
+def create_transactions(invoices, n_transactions, rng: random.Random):
+    """Create synthetic transactions that match a part of the invoices."""
+    transactions = []
+    for i, row in enumerate(rng.sample(invoices, n_transactions)):
+        kind = i % 4
+        transactions.append(
+            BankTransaction(
+                amount=row["total"],
+                reference=f"Invoice {row['pk']}" if kind == 0 else "Fee",
+                iban=row[f"{PROFILE}__bank_account_iban"] if kind == 1 else "",
+                name=(
+                    f"{row['payment_from__user__first_name']} "
+                    f"{row['payment_from__user__last_name']}x"
+                    if kind == 2
+                    else "Unknown Payer"
+                ),
+            )
+        )
+    return transactions
+
+
+def match_linear(invoices, transaction, matched):
+    """Match a transaction by comparing it with every invoice."""
+    references = {
+        int(pk) for pk in REFERENCE_PATTERN.findall(transaction.reference)
+    }
+    name = normalize_name(transaction.name)
+    for method in ["reference", "account", "name"]:
+        for row in invoices:
+            pk = row["pk"]
+            if pk in matched or row["total"] != transaction.amount:
+                continue
+            if method == "reference" and pk in references:
+                return pk
+            if (
+                method == "account"
+                and transaction.iban
+                and row[f"{PROFILE}__bank_account_iban"] == transaction.iban
+            ):
+                return pk
+            if method == "name":
+                other = normalize_name(
+                    f"{row['payment_from__user__first_name']} "
+                    f"{row['payment_from__user__last_name']}"
+                )
+                if (
+                    SequenceMatcher(None, name, other).ratio()
+                    >= NAME_SIMILARITY
+                ):
+                    return pk
+
+
+class Command(BaseCommand):
+    """Compare matching with an index and with a linear scan."""
+
+    help = "Benchmark the reconciliation of synthetic bank statements."
+
+    def add_arguments(self, parser):
+        """Add arguments of the command."""
+        parser.add_argument(
+            "--invoices",
+            type=int,
+            default=100000,
+            help="Number of synthetic open invoices.",
+        )
+        parser.add_argument(
+            "--transactions",
+            type=int,
+            default=50000,
+            help="Number of synthetic transactions.",
+        )
+        parser.add_argument(
+            "--linear-sample",
+            type=int,
+            default=100,
+            help="Number of transactions to match with a linear scan.",
+        )
+
+    def handle(self, *args, **options):
+        """Run the benchmark and print the results."""
+        # Synthetic data only, reproducible with a fixed seed
+        rng = random.Random(0)  # noqa: S311
+        invoices = create_invoices(
+            options["invoices"], max(1, options["invoices"] // 5), rng
+        )
+        transactions = create_transactions(
+            invoices, options["transactions"], rng
+        )
+
+        statement = io.BytesIO(
+            (
+                "<Document><BkToCstmrStmt><Stmt>"
+                + "".join(
+                    CAMT_ENTRY.format(**t._asdict()) for t in transactions
+                )
+                + "</Stmt></BkToCstmrStmt></Document>"
+            ).encode()
+        )
+        start = time.perf_counter()
+        parsed = sum(1 for _ in parse_camt053(statement))
+        seconds = time.perf_counter() - start
+        self.stdout.write(f"parse {parsed} transactions: {seconds:.2f}s")
+
+        start = time.perf_counter()
+        index = InvoiceIndex(invoices)
+        seconds = time.perf_counter() - start
+        self.stdout.write(f"index {len(invoices)} invoices: {seconds:.2f}s")
+
+        start = time.perf_counter()
+        matched = sum(1 for t in transactions if index.match(t))
+        seconds = time.perf_counter() - start
+        self.stdout.write(
+            f"indexed matching: {matched}/{len(transactions)} matched "
+            f"in {seconds:.2f}s"
+        )
+
+        sample = transactions[: options["linear_sample"]]
+        start = time.perf_counter()
+        matched = set()
+        for transaction in sample:
+            pk = match_linear(invoices, transaction, matched)
+            if pk is not None:
+                matched.add(pk)
+        seconds = time.perf_counter() - start
+        estimate = seconds / max(1, len(sample)) * len(transactions)
+        self.stdout.write(
+            f"linear matching: {len(matched)}/{len(sample)} matched "
+            f"in {seconds:.2f}s, estimated {estimate:.0f}s for all"
+        )
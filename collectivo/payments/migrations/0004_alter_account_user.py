@@ -0,0 +1,21 @@
+# Generated by Django 4.1.13 on 2026-10-18 10:38
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('payments', '0003_rename_date_historicalinvoice_date_created_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='account',
+            name='user',
+            field=models.OneToOneField(blank=True, help_text='The user that owns this account.', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='account', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.1.13 on 2026-10-18 10:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0004_alter_account_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalinvoice',
+            name='period_start',
+            field=models.DateField(blank=True, help_text='The start of the subscription period of this invoice.', null=True),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='period_start',
+            field=models.DateField(blank=True, help_text='The start of the subscription period of this invoice.', null=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='invoice',
+            unique_together={('subscription', 'period_start')},
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.1.13 on 2026-10-18 10:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0005_invoice_period_start'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='historicalinvoice',
+            name='status',
+            field=models.CharField(choices=[('draft', 'draft'), ('open', 'open'), ('pending', 'pending'), ('paid', 'paid'), ('canceled', 'canceled'), ('failure', 'failure')], max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='invoice',
+            name='status',
+            field=models.CharField(choices=[('draft', 'draft'), ('open', 'open'), ('pending', 'pending'), ('paid', 'paid'), ('canceled', 'canceled'), ('failure', 'failure')], max_length=10),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.1.13 on 2026-10-18 10:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_balances(apps, schema_editor):
+    """Calculate the balances of existing invoices."""
+    AccountBalance = apps.get_model("payments", "AccountBalance")
+    ItemEntry = apps.get_model("payments", "ItemEntry")
+    rows = (
+        ItemEntry.objects.filter(invoice__payment_from__isnull=False)
+        .values("invoice__payment_from", "type__category", "invoice__status")
+        .annotate(total=models.Sum(models.F("amount") * models.F("price")))
+        .order_by()
+    )
+    AccountBalance.objects.bulk_create(
+        [
+            AccountBalance(
+                account_id=row["invoice__payment_from"],
+                category_id=row["type__category"],
+                status=row["invoice__status"],
+                total=row["total"] or 0,
+            )
+            for row in rows.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0006_invoice_status_pending'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('draft', 'draft'), ('open', 'open'), ('pending', 'pending'), ('paid', 'paid'), ('canceled', 'canceled'), ('failure', 'failure')], max_length=10)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balances', to='payments.account')),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='balances', to='payments.itemtypecategory')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='accountbalance',
+            index=models.Index(fields=['status', 'total'], name='payments_ac_status_0c1add_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='accountbalance',
+            unique_together={('account', 'category', 'status')},
+        ),
+        migrations.RunPython(create_balances, migrations.RunPython.noop),
+    ]
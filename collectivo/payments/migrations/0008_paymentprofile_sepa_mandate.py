@@ -0,0 +1,33 @@
+# Generated by Django 4.1.13 on 2026-10-18 11:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0007_accountbalance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalpaymentprofile',
+            name='sepa_mandate_date',
+            field=models.DateField(blank=True, help_text='The date when the SEPA direct debit mandate was signed.', null=True),
+        ),
+        migrations.AddField(
+            model_name='historicalpaymentprofile',
+            name='sepa_mandate_reference',
+            field=models.CharField(blank=True, help_text='The reference of the signed SEPA direct debit mandate.', max_length=35, null=True),
+        ),
+        migrations.AddField(
+            model_name='paymentprofile',
+            name='sepa_mandate_date',
+            field=models.DateField(blank=True, help_text='The date when the SEPA direct debit mandate was signed.', null=True),
+        ),
+        migrations.AddField(
+            model_name='paymentprofile',
+            name='sepa_mandate_reference',
+            field=models.CharField(blank=True, help_text='The reference of the signed SEPA direct debit mandate.', max_length=35, null=True),
+        ),
+    ]
@@ -3,7 +3,8 @@ import datetime
 
 from django.contrib.auth import get_user_model
 from django.db import models
-from simple_history.models import HistoricalRecords
+
+from collectivo.utils.history import HistoricalRecords
 
 User = get_user_model()
 
@@ -31,6 +32,17 @@ class PaymentProfile(models.Model):
     bank_account_owner = models.CharField(
         max_length=255, null=True, blank=True
     )
+    sepa_mandate_reference = models.CharField(
+        max_length=35,
+        null=True,
+        blank=True,
+        help_text="The reference of the signed SEPA direct debit mandate.",
+    )
+    sepa_mandate_date = models.DateField(
+        null=True,
+        blank=True,
+        help_text="The date when the SEPA direct debit mandate was signed.",
+    )
 
     history = HistoricalRecords()
 
@@ -45,6 +57,8 @@ class Account(models.Model):
     name = models.CharField(max_length=255)
     user = models.OneToOneField(
         User,
+        null=True,
+        blank=True,
         on_delete=models.CASCADE,
         related_name="account",
         help_text="The user that owns this account.",
@@ -174,6 +188,7 @@ class Invoice(models.Model):
         choices=[
             ("draft", "draft"),
             ("open", "open"),
+            ("pending", "pending"),
             ("paid", "paid"),
             ("canceled", "canceled"),
             ("failure", "failure"),
@@ -191,16 +206,60 @@ class Invoice(models.Model):
         blank=True,
         related_name="invoices",
     )
+    period_start = models.DateField(
+        null=True,
+        blank=True,
+        help_text="The start of the subscription period of this invoice.",
+    )
 
     notes = models.TextField(blank=True)
 
     history = HistoricalRecords()
 
+    class Meta:
+        """Meta settings."""
+
+        unique_together = [("subscription", "period_start")]
+
     def __str__(self):
         """Return a string representation of the object."""
         return str(self.id)
 
 
+class AccountBalance(models.Model):
+    """The total of the invoices of an account per category and status.
+
+    Balances are updated automatically when invoices or their items change.
+    """
+
+    account = models.ForeignKey(
+        Account,
+        on_delete=models.CASCADE,
+        related_name="balances",
+    )
+    category = models.ForeignKey(
+        "ItemTypeCategory",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="balances",
+    )
+    status = models.CharField(
+        max_length=10, choices=Invoice._meta.get_field("status").choices
+    )
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        """Meta settings."""
+
+        unique_together = [("account", "category", "status")]
+        indexes = [models.Index(fields=["status", "total"])]
+
+    def __str__(self):
+        """Return a string representation of the object."""
+        return f"{self.account} - {self.category} - {self.status}"
+
+
 class Subscription(models.Model):
     """A subscription that creates automatic invoices."""
 
@@ -0,0 +1,364 @@
+"""Reconciliation of bank statements with open invoices."""
+import codecs
+import csv
+import datetime
+import re
+from collections import Counter, defaultdict
+from decimal import Decimal, InvalidOperation
+from difflib import SequenceMatcher
+from typing import NamedTuple
+
+from defusedxml import DefusedXmlException
+from defusedxml import ElementTree as ET
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Sum, Value, When
+
+from .models import Invoice
+from .signals import invoices_paid
+
+CHUNK_SIZE = 2000
+MATCHABLE_STATUSES = ["open", "pending"]
+NAME_SIMILARITY = 0.85
+REFERENCE_PATTERN = re.compile(r"\b(?:INV|invoice)[\s\-_:#]*(\d+)\b", re.I)
+CSV_COLUMNS = {
+    "amount": ["amount", "betrag"],
+    "date": ["date", "booking date", "buchungsdatum", "datum"],
+    "reference": ["reference", "purpose", "verwendungszweck"],
+    "iban": ["iban", "account", "auftraggeberkonto"],
+    "name": ["name", "payer", "auftraggeber"],
+}
+
+
+class BankTransaction(NamedTuple):
+    """An incoming payment of a bank statement."""
+
+    amount: Decimal
+    date: datetime.date | None = None
+    reference: str = ""
+    iban: str = ""
+    name: str = ""
+
+
+class ReconciliationError(ValueError):
+    """Exception for statements that cannot be parsed."""
+
+
+def normalize_iban(iban: str | None) -> str:
+    """Remove spaces from an IBAN and convert it to upper case."""
+    return (iban or "").replace(" ", "").upper()
+
+
+def normalize_name(name: str | None) -> str:
+    """Convert a name to lower case words without punctuation."""
+    return " ".join(re.findall(r"\w+", (name or "").lower()))
+
+
+def parse_amount(value: str) -> Decimal:
+    """Parse an amount with a decimal point or a decimal comma."""
+    value = value.strip().replace(" ", "")
+    if "," in value:
+        value = value.replace(".", "").replace(",", ".")
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise ReconciliationError(f"Invalid amount: {value}")
+
+
+def parse_date(value: str | None) -> datetime.date | None:
+    """Parse an ISO date or a date in the format DD.MM.YYYY."""
+    value = (value or "").strip()[:10]
+    if not value:
+        return None
+    for date_format in ["%Y-%m-%d", "%d.%m.%Y"]:
+        try:
+            return datetime.datetime.strptime(value, date_format).date()
+        except ValueError:
+            pass
+    raise ReconciliationError(f"Invalid date: {value}")
+
+
+def parse_camt053(file):
+    """Parse the incoming payments of a CAMT.053 statement as a stream.
+
+    Entries are removed from memory after they have been parsed. Entries
+    with multiple transaction details are split into their transactions.
+    Entities and DTDs are rejected, since statements are uploaded files.
+    """
+    try:
+        for _, element in ET.iterparse(file, events=["end"]):
+            # Remove the namespace, which differs between versions
+            element.tag = element.tag.rsplit("}", 1)[-1]
+            if element.tag != "Ntry":
+                continue
+            if element.findtext("CdtDbtInd") == "CRDT":
+                yield from parse_camt053_entry(element)
+            element.clear()
+    except (ET.ParseError, DefusedXmlException) as e:
+        raise ReconciliationError(f"Invalid CAMT.053 statement: {e}")
+
+
+def parse_camt053_entry(entry):
+    """Parse the transactions of an entry of a CAMT.053 statement."""
+    date = parse_date(
+        entry.findtext("BookgDt/Dt") or entry.findtext("BookgDt/DtTm")
+    )
+    details = entry.findall("NtryDtls/TxDtls")
+    for detail in details or [entry]:
+        amount = entry.findtext("Amt")
+        if len(details) > 1:
+            amount = detail.findtext("AmtDtls/TxAmt/Amt") or amount
+        references = [
+            detail.findtext("Refs/EndToEndId") or "",
+            detail.findtext("RmtInf/Strd/CdtrRefInf/Ref") or "",
+        ] + [e.text or "" for e in detail.iterfind("RmtInf/Ustrd")]
+        yield BankTransaction(
+            amount=parse_amount(amount or "0"),
+            date=date,
+            reference=" ".join(r for r in references if r),
+            iban=normalize_iban(detail.findtext("RltdPties/DbtrAcct/Id/IBAN")),
+            name=detail.findtext("RltdPties/Dbtr/Nm")
+            or detail.findtext("RltdPties/Dbtr/Pty/Nm")
+            or "",
+        )
+
+
+def parse_csv(file, encoding: str = "utf-8-sig"):
+    """Parse the incoming payments of a CSV statement as a stream.
+
+    Columns are found by their header, see CSV_COLUMNS. Rows with negative
+    amounts are outgoing payments and are skipped, as are rows that end
+    before the amount column. Missing cells of other columns are empty.
+    """
+    try:
+        yield from _parse_csv(codecs.iterdecode(file, encoding))
+    except UnicodeDecodeError:
+        raise ReconciliationError(f"CSV statement is not {encoding}.")
+    except csv.Error as e:
+        raise ReconciliationError(f"Invalid CSV statement: {e}")
+
+
+def _parse_csv(lines):
+    """Parse the decoded lines of a CSV statement."""
+    first = next(lines, "")
+    delimiter = max([",", ";", "\t"], key=first.count)
+    header = next(csv.reader([first], delimiter=delimiter), [])
+    header = [column.strip().lower() for column in header]
+    columns = {}
+    for key, names in CSV_COLUMNS.items():
+        for name in names:
+            if name in header:
+                columns[key] = header.index(name)
+                break
+    if "amount" not in columns:
+        raise ReconciliationError("CSV statement has no amount column.")
+
+    def get(row, key):
+        index = columns.get(key)
+        if index is None or index >= len(row):
+            return ""
+        return row[index].strip()
+
+    for row in csv.reader(lines, delimiter=delimiter):
+        if len(row) <= columns["amount"]:
+            continue
+        amount = parse_amount(get(row, "amount"))
+        if amount <= 0:
+            continue
+        yield BankTransaction(
+            amount=amount,
+            date=parse_date(get(row, "date")),
+            reference=get(row, "reference"),
+            iban=normalize_iban(get(row, "iban")),
+            name=get(row, "name"),
+        )
+
+
+def parse_statement(file, name: str = ""):
+    """Parse a CAMT.053 or CSV statement, depending on its content."""
+    start = file.read(64)
+    file.seek(0)
+    if name.lower().endswith(".xml") or start.lstrip().startswith(b"<"):
+        return parse_camt053(file)
+    return parse_csv(file)
+
+
+def get_open_invoices():
+    """Get the totals and payers of invoices that can be reconciled."""
+    profile = "payment_from__user__payment_profile"
+    return (
+        Invoice.objects.filter(status__in=MATCHABLE_STATUSES)
+        .annotate(
+            total=Sum(
+                F("items__amount") * F("items__price"),
+                output_field=DecimalField(max_digits=20, decimal_places=2),
+            )
+        )
+        .values(
+            "pk",
+            "total",
+            "payment_from__name",
+            "payment_from__user__first_name",
+            "payment_from__user__last_name",
+            f"{profile}__bank_account_iban",
+            f"{profile}__bank_account_owner",
+        )
+        .order_by("pk")
+    )
+
+
+class InvoiceIndex:
+    """An in-memory index of open invoices for matching transactions.
+
+    Transactions are matched in this order:
+
+    - An invoice id in the reference and the same amount.
+    - The same amount and the IBAN of the payment profile of the payer.
+    - The same amount and a similar name of the payer.
+
+    Older invoices are matched first. Each invoice is matched only once.
+    """
+
+    def __init__(self, rows):
+        """Build the index from rows of invoices, see get_open_invoices."""
+        profile = "payment_from__user__payment_profile"
+        self.totals = {}
+        self.names = {}
+        self.by_account = defaultdict(list)
+        self.by_name = defaultdict(list)
+        self.matched = set()
+        for row in rows:
+            pk, total = row["pk"], row["total"] or Decimal(0)
+            self.totals[pk] = total
+            iban = normalize_iban(row.get(f"{profile}__bank_account_iban"))
+            if iban:
+                self.by_account[(iban, total)].append(pk)
+            names = {
+                normalize_name(row.get(f"{profile}__bank_account_owner")),
+                normalize_name(row.get("payment_from__name")),
+                normalize_name(
+                    f"{row.get('payment_from__user__first_name') or ''} "
+                    f"{row.get('payment_from__user__last_name') or ''}"
+                ),
+            } - {""}
+            self.names[pk] = names
+            for word in {w for name in names for w in name.split()}:
+                self.by_name[(word, total)].append(pk)
+
+    @classmethod
+    def from_db(cls):
+        """Build the index from the open invoices in the database."""
+        return cls(get_open_invoices().iterator(chunk_size=CHUNK_SIZE))
+
+    def _first(self, pks):
+        """Return the first invoice of a list that is not matched yet."""
+        for pk in pks:
+            if pk not in self.matched:
+                return pk
+
+    def match_reference(self, payment):
+        """Match an invoice id in the reference of a payment."""
+        for pk in REFERENCE_PATTERN.findall(payment.reference):
+            pk = int(pk)
+            if (
+                pk not in self.matched
+                and self.totals.get(pk) == payment.amount
+            ):
+                return pk
+
+    def match_account(self, payment):
+        """Match the IBAN and the amount of a payment."""
+        if payment.iban:
+            return self._first(
+                self.by_account.get((payment.iban, payment.amount), [])
+            )
+
+    def match_name(self, payment):
+        """Match a similar name and the amount of a payment."""
+        name = normalize_name(payment.name)
+        candidates = set()
+        for word in name.split():
+            candidates.update(self.by_name.get((word, payment.amount), []))
+        best, best_ratio = None, 0
+        for pk in sorted(candidates - self.matched):
+            for other in self.names[pk]:
+                ratio = SequenceMatcher(None, name, other).ratio()
+                if ratio >= NAME_SIMILARITY and ratio > best_ratio:
+                    best, best_ratio = pk, ratio
+        return best
+
+    def match(self, payment) -> tuple[int, str] | None:
+        """Find the invoice of a payment and the method of the match."""
+        for method, match in [
+            ("reference", self.match_reference),
+            ("account", self.match_account),
+            ("name", self.match_name),
+        ]:
+            pk = match(payment)
+            if pk is not None:
+                self.matched.add(pk)
+                return pk, method
+        return None
+
+
+@transaction.atomic
+def apply_matches(matches: dict[int, BankTransaction]) -> list[int]:
+    """Mark matched invoices as paid.
+
+    The status of all invoices is changed with one update statement. The
+    changes are recorded in the history with bulk queries, and the paid
+    invoices are announced with one invoices_paid signal. Returns the ids
+    of the changed invoices.
+    """
+    changed = list(
+        Invoice.objects.select_for_update()
+        .filter(pk__in=list(matches), status__in=MATCHABLE_STATUSES)
+        .values_list("pk", flat=True)
+    )
+    if not changed:
+        return []
+    dates = defaultdict(list)
+    for pk in changed:
+        dates[matches[pk].date or datetime.date.today()].append(pk)
+    Invoice.objects.filter(pk__in=changed).update(
+        status="paid",
+        date_paid=Case(
+            *[
+                When(pk__in=pks, then=Value(date))
+                for date, pks in dates.items()
+            ]
+        ),
+    )
+    for i in range(0, len(changed), CHUNK_SIZE):
+        Invoice.history.bulk_history_create(
+            Invoice.objects.filter(pk__in=changed[i : i + CHUNK_SIZE]),
+            update=True,
+            default_change_reason="Reconciled with bank statement",
+        )
+    invoices_paid.send(sender=Invoice, invoice_ids=changed)
+    return changed
+
+
+def reconcile(transactions, apply: bool = True, index=None) -> dict:
+    """Match transactions with open invoices and mark them as paid.
+
+    Returns the number of matches per method and the unmatched transactions.
+    """
+    index = index or InvoiceIndex.from_db()
+    matches = {}
+    methods = Counter()
+    unmatched = []
+    for bank_transaction in transactions:
+        match = index.match(bank_transaction)
+        if match is None:
+            unmatched.append(bank_transaction)
+            continue
+        pk, method = match
+        matches[pk] = bank_transaction
+        methods[method] += 1
+    paid = apply_matches(matches) if apply and matches else []
+    return {
+        "matched": len(matches),
+        "paid": len(paid),
+        "methods": dict(methods),
+        "unmatched": [t._asdict() for t in unmatched],
+    }
@@ -0,0 +1,10 @@
+"""Celery schedules of the payments extension."""
+from celery.schedules import crontab
+
+schedules = {
+    # Create invoices of subscriptions every day
+    "collectivo_payments_create_subscription_invoices_1d": {
+        "task": "collectivo_payments_create_subscription_invoices",
+        "schedule": crontab(minute=0, hour=1),
+    },
+}
@@ -0,0 +1,306 @@
+"""SEPA direct debit exports of open invoices."""
+import datetime
+import logging
+import uuid
+from decimal import Decimal
+from xml.etree import ElementTree as ET  # noqa: S405, only builds XML
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (
+    Count,
+    DecimalField,
+    F,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+)
+from django.utils import timezone
+
+from collectivo.utils.exceptions import ImproperlyConfigured
+
+from .balances import update_invoice_balances
+from .models import Invoice, ItemEntry
+
+logger = logging.getLogger(__name__)
+
+NAMESPACE = "urn:iso:std:iso:20022:tech:xsd:pain.008.001.02"
+CHUNK_SIZE = 2000
+EXPORTED_STATUS = "pending"
+
+
+def get_sepa_config() -> dict:
+    """Get the creditor settings of direct debits.
+
+    The settings are defined with the option `sepa` of the extension, e.g.
+    {"creditor_name": "...", "creditor_iban": "...", "creditor_id": "..."}.
+    """
+    config = settings.COLLECTIVO["extensions"].get("collectivo.payments") or {}
+    sepa = config.get("sepa") or {}
+    for key in ["creditor_name", "creditor_iban", "creditor_id"]:
+        if not sepa.get(key):
+            raise ImproperlyConfigured(f"SEPA setting '{key}' is missing.")
+    return {
+        "creditor_bic": None,
+        "sequence_type": "RCUR",
+        "currency": "EUR",
+        **sepa,
+    }
+
+
+def get_open_sepa_invoices(with_mandate: bool = True):
+    """Get the open invoices of accounts that pay with direct debits.
+
+    Only invoices of debtors with an IBAN and a signed mandate are included,
+    or only those without a mandate if with_mandate is false.
+    """
+    profile = "payment_from__user__payment_profile"
+    invoices = Invoice.objects.filter(
+        status="open",
+        **{
+            f"{profile}__payment_method": "sepa",
+            f"{profile}__bank_account_iban__isnull": False,
+        },
+    ).exclude(**{f"{profile}__bank_account_iban": ""})
+    mandate = Q(
+        **{
+            f"{profile}__sepa_mandate_reference__isnull": False,
+            f"{profile}__sepa_mandate_date__isnull": False,
+        }
+    ) & ~Q(**{f"{profile}__sepa_mandate_reference": ""})
+    return invoices.filter(mandate if with_mandate else ~mandate)
+
+
+def get_debited_invoices(invoice_ids: list):
+    """Get invoices with the total amount of their items, if it is positive.
+
+    The total is a subquery, so that the invoices can be aggregated.
+    """
+    totals = (
+        ItemEntry.objects.filter(invoice=OuterRef("pk"))
+        .values("invoice")
+        .annotate(total=Sum(F("amount") * F("price")))
+        .values("total")
+    )
+    return (
+        Invoice.objects.filter(pk__in=invoice_ids)
+        .annotate(
+            total=Subquery(
+                totals,
+                output_field=DecimalField(max_digits=20, decimal_places=2),
+            )
+        )
+        .filter(total__gt=0)
+    )
+
+
+def get_sepa_invoices(invoice_ids: list):
+    """Get the debits of invoices with a positive total.
+
+    Each row contains the total amount of the items of the invoice and the
+    bank account of the debtor.
+    """
+    return (
+        get_debited_invoices(invoice_ids)
+        .values(
+            "pk",
+            "total",
+            "payment_from__user__payment_profile__sepa_mandate_reference",
+            "payment_from__user__payment_profile__sepa_mandate_date",
+            "payment_from__user__payment_profile__bank_account_iban",
+            "payment_from__user__payment_profile__bank_account_owner",
+        )
+        .order_by("pk")
+    )
+
+
+def lock_sepa_invoices(chunk_size: int = CHUNK_SIZE) -> list[int]:
+    """Lock the open SEPA invoices and their items and return their ids.
+
+    Invoices that are locked by a parallel export are skipped. The items
+    are locked as well, so that the totals of the export match its debits.
+    Must be called in a transaction.
+    """
+    invoice_ids = list(
+        get_open_sepa_invoices()
+        .select_for_update(skip_locked=True, of=("self",))
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+    for i in range(0, len(invoice_ids), chunk_size):
+        # The items are only locked when the query is evaluated
+        list(
+            ItemEntry.objects.select_for_update()
+            .filter(invoice__in=invoice_ids[i : i + chunk_size])
+            .values_list("pk", flat=True)
+        )
+    return invoice_ids
+
+
+def sub_element(parent, tag: str, text=None, **attrs):
+    """Add a child element with an optional text to an element."""
+    element = ET.SubElement(parent, tag, attrs)
+    if text is not None:
+        element.text = str(text)
+    return element
+
+
+def amount(value) -> str:
+    """Format an amount of money."""
+    return f"{Decimal(value):.2f}"
+
+
+def render_header(config, count, total, collection_date) -> str:
+    """Render the opening tags, group header, and payment information."""
+    now = timezone.now().replace(microsecond=0)
+    msg_id = f"collectivo-{uuid.uuid4().hex[:24]}"
+
+    header = ET.Element("GrpHdr")
+    sub_element(header, "MsgId", msg_id)
+    sub_element(header, "CreDtTm", now.isoformat())
+    sub_element(header, "NbOfTxs", count)
+    sub_element(header, "CtrlSum", amount(total))
+    sub_element(sub_element(header, "InitgPty"), "Nm", config["creditor_name"])
+
+    info = ET.Element("PmtInf")
+    sub_element(info, "PmtInfId", msg_id)
+    sub_element(info, "PmtMtd", "DD")
+    sub_element(info, "NbOfTxs", count)
+    sub_element(info, "CtrlSum", amount(total))
+    payment_type = sub_element(info, "PmtTpInf")
+    sub_element(sub_element(payment_type, "SvcLvl"), "Cd", "SEPA")
+    sub_element(sub_element(payment_type, "LclInstrm"), "Cd", "CORE")
+    sub_element(payment_type, "SeqTp", config["sequence_type"])
+    sub_element(info, "ReqdColltnDt", collection_date.isoformat())
+    sub_element(sub_element(info, "Cdtr"), "Nm", config["creditor_name"])
+    account = sub_element(sub_element(info, "CdtrAcct"), "Id")
+    sub_element(account, "IBAN", config["creditor_iban"])
+    agent = sub_element(sub_element(info, "CdtrAgt"), "FinInstnId")
+    if config["creditor_bic"]:
+        sub_element(agent, "BIC", config["creditor_bic"])
+    else:
+        sub_element(sub_element(agent, "Othr"), "Id", "NOTPROVIDED")
+    sub_element(info, "ChrgBr", "SLEV")
+    scheme = sub_element(
+        sub_element(sub_element(info, "CdtrSchmeId"), "Id"), "PrvtId"
+    )
+    other = sub_element(scheme, "Othr")
+    sub_element(other, "Id", config["creditor_id"])
+    sub_element(sub_element(other, "SchmeNm"), "Prtry", "SEPA")
+
+    # Transactions are streamed into the payment information
+    info_xml = ET.tostring(info, encoding="unicode")
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<Document xmlns="{NAMESPACE}"><CstmrDrctDbtInitn>'
+        + ET.tostring(header, encoding="unicode")
+        + info_xml[: -len("</PmtInf>")]
+    )
+
+
+def render_transaction(config, row) -> str:
+    """Render the direct debit of an invoice."""
+    prefix = "payment_from__user__payment_profile"
+    transaction = ET.Element("DrctDbtTxInf")
+    sub_element(
+        sub_element(transaction, "PmtId"), "EndToEndId", f"INV-{row['pk']}"
+    )
+    sub_element(
+        transaction, "InstdAmt", amount(row["total"]), Ccy=config["currency"]
+    )
+    mandate = sub_element(sub_element(transaction, "DrctDbtTx"), "MndtRltdInf")
+    sub_element(mandate, "MndtId", row[f"{prefix}__sepa_mandate_reference"])
+    sub_element(
+        mandate,
+        "DtOfSgntr",
+        row[f"{prefix}__sepa_mandate_date"].isoformat(),
+    )
+    agent = sub_element(sub_element(transaction, "DbtrAgt"), "FinInstnId")
+    sub_element(sub_element(agent, "Othr"), "Id", "NOTPROVIDED")
+    sub_element(
+        sub_element(transaction, "Dbtr"),
+        "Nm",
+        row[f"{prefix}__bank_account_owner"] or "",
+    )
+    sub_element(
+        sub_element(sub_element(transaction, "DbtrAcct"), "Id"),
+        "IBAN",
+        row[f"{prefix}__bank_account_iban"].replace(" ", ""),
+    )
+    sub_element(
+        sub_element(transaction, "RmtInf"), "Ustrd", f"Invoice {row['pk']}"
+    )
+    return ET.tostring(transaction, encoding="unicode")
+
+
+@transaction.atomic
+def mark_exported(invoice_ids: list) -> int:
+    """Mark exported invoices as pending with one bulk update.
+
+    Only invoices that are still open are changed. The change is recorded
+    in the history of the invoices and the balances of their accounts with
+    bulk queries.
+    """
+    changed = list(
+        Invoice.objects.select_for_update()
+        .filter(pk__in=invoice_ids, status="open")
+        .values_list("pk", flat=True)
+    )
+    Invoice.objects.filter(pk__in=changed).update(status=EXPORTED_STATUS)
+    for i in range(0, len(changed), CHUNK_SIZE):
+        Invoice.history.bulk_history_create(
+            Invoice.objects.filter(pk__in=changed[i : i + CHUNK_SIZE]),
+            update=True,
+            default_change_reason="Exported as SEPA direct debit",
+        )
+    update_invoice_balances(changed)
+    return len(changed)
+
+
+def stream_sepa_export(
+    collection_date: datetime.date = None, chunk_size: int = CHUNK_SIZE
+):
+    """Stream a pain.008 direct debit file of all open SEPA invoices.
+
+    Invoices of debtors without a mandate reference and signature date are
+    not exported and stay open.
+
+    The invoices are locked in one transaction before the file is written,
+    so that parallel exports skip them. The totals of the header are
+    aggregated over the locked invoices, and the debits are streamed with
+    a server-side cursor in chunks of ids. After the whole file has been
+    written, the exported invoices are marked as pending in the same
+    transaction. If the export is not finished, the invoices stay open.
+    """
+    config = get_sepa_config()
+    collection_date = collection_date or (
+        datetime.date.today() + datetime.timedelta(days=1)
+    )
+    missing = get_open_sepa_invoices(with_mandate=False).count()
+    if missing:
+        logger.warning(
+            "%s open invoices are not exported, their debtors have no mandate",
+            missing,
+        )
+    with transaction.atomic():
+        invoice_ids = lock_sepa_invoices(chunk_size)
+        chunks = [
+            invoice_ids[i : i + chunk_size]
+            for i in range(0, len(invoice_ids), chunk_size)
+        ]
+        count, total = 0, Decimal(0)
+        for chunk in chunks:
+            totals = get_debited_invoices(chunk).aggregate(
+                count=Count("pk"), amount=Sum("total")
+            )
+            count += totals["count"]
+            total += totals["amount"] or 0
+        yield render_header(config, count, total, collection_date)
+        exported = []
+        for chunk in chunks:
+            for row in get_sepa_invoices(chunk).iterator(chunk_size):
+                exported.append(row["pk"])
+                yield render_transaction(config, row)
+        yield "</PmtInf></CstmrDrctDbtInitn></Document>\n"
+        mark_exported(exported)
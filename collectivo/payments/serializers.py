@@ -27,10 +27,34 @@ class PaymentProfileSerializer(UserIsPk):
                     "required": True,
                 },
                 "bank_account_owner": {"required": True},
+                "sepa_mandate_reference": {"label": "Mandate reference"},
+                "sepa_mandate_date": {"label": "Mandate signature date"},
             },
         }
 
 
+class AccountBalanceSerializer(serializers.ModelSerializer):
+    """Serializer for account balances."""
+
+    class Meta:
+        """Serializer settings."""
+
+        model = models.AccountBalance
+        fields = "__all__"
+
+
+class AccountSerializer(serializers.ModelSerializer):
+    """Serializer for accounts with their balances."""
+
+    balances = AccountBalanceSerializer(many=True, read_only=True)
+
+    class Meta:
+        """Serializer settings."""
+
+        model = models.Account
+        fields = "__all__"
+
+
 class ItemEntrySerializer(serializers.ModelSerializer):
     """Serializer for items."""
 
@@ -1,20 +1,111 @@
 """Signals of the payments extension."""
 from django.contrib.auth import get_user_model
 from django.db.models import signals
+from django.dispatch import Signal
 
-from .models import PaymentProfile, Account
+from .balances import update_account_balances, update_invoice_balances
+from .models import Account, Invoice, ItemEntry, PaymentProfile
+
+# Sent with the argument invoice_ids after many invoices have been marked as
+# paid with a bulk update, which does not send post_save signals.
+invoices_paid = Signal()
 
 
 def create_payment_profile(sender, instance, created, **kwargs):
     """Create user profile when a user does not have one."""
+    if kwargs.get("raw"):
+        return
 
     PaymentProfile.objects.get_or_create(user=instance)
     Account.objects.get_or_create(user=instance)
 
 
+# Fields that change the balances of accounts
+BALANCE_FIELDS = {
+    Invoice: ["payment_from_id", "status"],
+    ItemEntry: ["invoice_id", "type_id", "amount", "price"],
+}
+
+
+def get_balance_values(sender, instance) -> tuple:
+    """Get the values of the fields of an object that change balances."""
+    return tuple(getattr(instance, field) for field in BALANCE_FIELDS[sender])
+
+
+def store_balance_values(sender, instance, raw=False, **kwargs):
+    """Store the values that change balances before an object is saved."""
+    instance._old_balance_values = None
+    if instance.pk is not None and not raw:
+        instance._old_balance_values = (
+            sender.objects.filter(pk=instance.pk)
+            .values_list(*BALANCE_FIELDS[sender])
+            .first()
+        )
+
+
+def get_changed_relations(sender, instance, **kwargs) -> set:
+    """Get the current and old relation of an object if balances changed.
+
+    The relation is the account of an invoice or the invoice of an item.
+    """
+    if kwargs.get("raw"):
+        return set()
+    values = get_balance_values(sender, instance)
+    old = getattr(instance, "_old_balance_values", None)
+    if kwargs.get("signal") is signals.post_save and old == values:
+        return set()
+    return {values[0], old[0] if old else None} - {None}
+
+
+def update_invoice_account_balance(sender, instance, **kwargs):
+    """Update the balances of the accounts of a changed invoice."""
+    update_account_balances(get_changed_relations(sender, instance, **kwargs))
+
+
+def update_item_account_balance(sender, instance, **kwargs):
+    """Update the balances of the accounts of the invoices of an item."""
+    invoice_ids = get_changed_relations(sender, instance, **kwargs)
+    if invoice_ids:
+        update_invoice_balances(invoice_ids)
+
+
+def update_paid_invoices_balances(sender, invoice_ids, **kwargs):
+    """Update the balances of accounts after a bulk payment."""
+    update_invoice_balances(invoice_ids)
+
+
 signals.post_save.connect(
     create_payment_profile,
     sender=get_user_model(),
     dispatch_uid="create_payment_profile",
     weak=False,
 )
+for model, handler in [
+    (Invoice, update_invoice_account_balance),
+    (ItemEntry, update_item_account_balance),
+]:
+    name = model._meta.model_name
+    signals.pre_save.connect(
+        store_balance_values,
+        sender=model,
+        dispatch_uid=f"store_{name}_balance_values",
+        weak=False,
+    )
+    signals.post_save.connect(
+        handler,
+        sender=model,
+        dispatch_uid=f"update_{name}_balance_save",
+        weak=False,
+    )
+    signals.post_delete.connect(
+        handler,
+        sender=model,
+        dispatch_uid=f"update_{name}_balance_delete",
+        weak=False,
+    )
+invoices_paid.connect(
+    update_paid_invoices_balances,
+    sender=Invoice,
+    dispatch_uid="update_paid_invoices_balances",
+    weak=False,
+)
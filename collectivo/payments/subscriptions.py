@@ -0,0 +1,183 @@
+"""Recurring invoices of subscriptions."""
+import datetime
+import logging
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from simple_history.utils import bulk_create_with_history
+
+from .balances import update_account_balances
+from .models import Invoice, ItemEntry, Subscription
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1000
+DAYS_AHEAD = 0
+DAYS_BACK = 7
+
+
+def get_days_ahead() -> int:
+    """Get the number of days before a period that its invoice is created."""
+    config = settings.COLLECTIVO["extensions"].get("collectivo.payments") or {}
+    return int(config.get("invoice_days_ahead", DAYS_AHEAD))
+
+
+def get_days_back() -> int:
+    """Get the number of days after which a period is no longer invoiced."""
+    config = settings.COLLECTIVO["extensions"].get("collectivo.payments") or {}
+    return int(config.get("invoice_days_back", DAYS_BACK))
+
+
+def get_period_start(subscription: Subscription, n: int) -> datetime.date:
+    """Get the start of the nth period of a subscription.
+
+    Periods are counted from the start of the subscription, so that months
+    with fewer days do not shift the following periods.
+    """
+    step = n * subscription.repeat_each
+    return subscription.date_started + relativedelta(
+        **{f"{subscription.repeat_unit}s": step}
+    )
+
+
+def get_next_period_start(
+    subscription: Subscription, after: datetime.date = None
+) -> datetime.date:
+    """Get the first period start of a subscription after a date."""
+    start = subscription.date_started
+    if after is None or after < start:
+        return start
+    if subscription.repeat_unit in ("day", "week"):
+        days = 7 if subscription.repeat_unit == "week" else 1
+        n = (after - start).days // (days * subscription.repeat_each)
+    else:
+        months = (after.year - start.year) * 12 + after.month - start.month
+        if subscription.repeat_unit == "year":
+            months //= 12
+        n = max(0, months // subscription.repeat_each - 1)
+    while get_period_start(subscription, n) <= after:
+        n += 1
+    return get_period_start(subscription, n)
+
+
+def get_due_period_starts(
+    subscription: Subscription, until: datetime.date, after=None
+) -> list[datetime.date]:
+    """Get the period starts of a subscription after a date until a date."""
+    if subscription.repeat_each < 1 or not subscription.repeat_unit:
+        return []
+    periods = []
+    period = get_next_period_start(subscription, after)
+    while period <= until:
+        periods.append(period)
+        period = get_next_period_start(subscription, period)
+    return periods
+
+
+def build_invoices(subscription, periods, today) -> list[Invoice]:
+    """Build the invoices of a subscription for periods."""
+    return [
+        Invoice(
+            payment_from_id=subscription.payment_from_id,
+            payment_to_id=subscription.payment_to_id,
+            extension_id=subscription.extension_id,
+            subscription=subscription,
+            status="open",
+            date_created=today,
+            date_due=max(period, today),
+            period_start=period,
+        )
+        for period in periods
+    ]
+
+
+@transaction.atomic
+def create_invoices_for_subscriptions(
+    after: int = 0,
+    chunk_size: int = CHUNK_SIZE,
+    today: datetime.date = None,
+) -> tuple[int, int | None]:
+    """Create the due invoices of a chunk of subscriptions.
+
+    Subscriptions with an id greater than after are locked, so that parallel
+    runs skip them. Periods are continued from the latest invoice of each
+    subscription, but only periods that start within the run window are
+    invoiced. Periods of existing or imported subscriptions that started
+    before the window are therefore not billed again. Invoices and their
+    items are created with one bulk query each, and the balances of their
+    accounts are updated together. Returns the number of created invoices
+    and the last id of the chunk, or None if there are no further
+    subscriptions.
+    """
+    today = today or datetime.date.today()
+    until = today + datetime.timedelta(days=get_days_ahead())
+    before_window = today - datetime.timedelta(days=get_days_back() + 1)
+    subscriptions = list(
+        Subscription.objects.select_for_update(skip_locked=True, of=("self",))
+        .filter(status="active", pk__gt=after, date_started__lte=until)
+        .order_by("pk")[:chunk_size]
+    )
+    if not subscriptions:
+        return 0, None
+    last = subscriptions[-1].pk if len(subscriptions) == chunk_size else None
+    latest = dict(
+        Invoice.objects.filter(subscription__in=subscriptions)
+        .values("subscription")
+        .annotate(latest=Max("period_start"))
+        .values_list("subscription", "latest")
+        .order_by()
+    )
+
+    invoices = []
+    for subscription in subscriptions:
+        invoiced = latest.get(subscription.pk)
+        if invoiced is None or invoiced < before_window:
+            invoiced = before_window
+        periods = get_due_period_starts(subscription, until, invoiced)
+        invoices += build_invoices(subscription, periods, today)
+    if not invoices:
+        return 0, last
+
+    items = {}
+    for entry in ItemEntry.objects.filter(
+        subscription__in={invoice.subscription_id for invoice in invoices}
+    ).order_by("pk"):
+        items.setdefault(entry.subscription_id, []).append(entry)
+    invoices = bulk_create_with_history(
+        invoices,
+        Invoice,
+        default_change_reason="Created from subscription",
+    )
+    ItemEntry.objects.bulk_create(
+        [
+            ItemEntry(
+                type_id=entry.type_id,
+                price=entry.price,
+                amount=entry.amount,
+                invoice=invoice,
+            )
+            for invoice in invoices
+            for entry in items.get(invoice.subscription_id, [])
+        ]
+    )
+    update_account_balances({invoice.payment_from_id for invoice in invoices})
+    return len(invoices), last
+
+
+def create_subscription_invoices(
+    chunk_size: int = CHUNK_SIZE, today: datetime.date = None
+) -> int:
+    """Create the due invoices of all active subscriptions.
+
+    Each chunk of subscriptions is processed in a separate transaction.
+    Invoices are unique per subscription and period, so that repeated runs
+    do not create an invoice twice. Returns the number of created invoices.
+    """
+    created, last = 0, 0
+    while last is not None:
+        n, last = create_invoices_for_subscriptions(last, chunk_size, today)
+        created += n
+    logger.info("Created %s invoices from subscriptions", created)
+    return created
@@ -1,3 +1,15 @@
 """Celery tasks of the payments module."""
+from celery import shared_task
 
-# TODO: Chronjob to create repetetive payments
+from collectivo.utils.tasks import LogErrorTask
+
+from .subscriptions import create_subscription_invoices
+
+
+@shared_task(
+    name="collectivo_payments_create_subscription_invoices",
+    base=LogErrorTask,
+)
+def create_subscription_invoices_async():
+    """Create the due invoices of all active subscriptions."""
+    return create_subscription_invoices()
@@ -1,9 +1,38 @@
 """Tests of the payments extension."""
+import io
+from datetime import date
+from decimal import Decimal
+
+from defusedxml import ElementTree as ET
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from collectivo.utils.test import create_testadmin, create_testuser
 
-from collectivo.utils.test import create_testuser
+from .models import (
+    Account,
+    Invoice,
+    ItemEntry,
+    ItemType,
+    ItemTypeCategory,
+    PaymentProfile,
+    Subscription,
+)
+from .reconciliation import BankTransaction, parse_statement
+from .sepa import NAMESPACE, stream_sepa_export
+from .subscriptions import (
+    create_subscription_invoices,
+    get_due_period_starts,
+)
 
-from .models import PaymentProfile
+SEPA_URL = reverse("collectivo.payments:invoice-sepa")
+RECONCILE_URL = reverse("collectivo.payments:invoice-reconcile")
+ACCOUNTS_URL = reverse("collectivo.payments:account-list")
+BALANCES_URL = reverse("collectivo.payments:accountbalance-list")
+INVOICES_SCHEMA_URL = reverse("collectivo.payments:invoice-schema")
 
 
 class ProfileTests(TestCase):
@@ -16,3 +45,503 @@ class ProfileTests(TestCase):
     def test_profile_automatically_created(self):
         """Test that a profile is automatically created."""
         self.assertTrue(PaymentProfile.objects.filter(user=self.user).exists())
+
+    def test_schema_choice_labels(self):
+        """Test that choices of accounts are updated with their user."""
+        client = APIClient()
+        client.force_authenticate(create_testadmin())
+        res = client.get(INVOICES_SCHEMA_URL)
+        self.assertEqual(res.status_code, 200)
+        account = Account.objects.get(user=self.user)
+        self.user.first_name = "Renamed"
+        self.user.save()
+        res = client.get(INVOICES_SCHEMA_URL)
+        choices = res.data["fields"]["payment_from"]["choices"]
+        self.assertTrue(choices[str(account.pk)].startswith("Renamed"))
+
+
+class SubscriptionInvoiceTests(TestCase):
+    """Tests of the invoices that are created from subscriptions."""
+
+    def setUp(self):
+        """Create subscriptions with items."""
+        self.user = create_testuser()
+        self.account = Account.objects.get(user=self.user)
+        self.item_type = ItemType.objects.create(name="Fee")
+        self.monthly = Subscription.objects.create(
+            payment_from=self.account,
+            status="active",
+            date_started=date(2023, 1, 31),
+            repeat_unit="month",
+        )
+        self.weekly = Subscription.objects.create(
+            payment_from=self.account,
+            status="active",
+            date_started=date(2023, 3, 1),
+            repeat_each=2,
+            repeat_unit="week",
+        )
+        self.paused = Subscription.objects.create(
+            payment_from=self.account,
+            status="paused",
+            date_started=date(2023, 1, 1),
+            repeat_unit="day",
+        )
+        for subscription in [self.monthly, self.weekly, self.paused]:
+            ItemEntry.objects.create(
+                type=self.item_type,
+                price=10,
+                amount=2,
+                subscription=subscription,
+            )
+
+    def set_days_back(self, days: int):
+        """Set the number of days after which periods are not invoiced."""
+        extensions = {
+            **settings.COLLECTIVO["extensions"],
+            "collectivo.payments": {"invoice_days_back": days},
+        }
+        config = self.settings(
+            COLLECTIVO={**settings.COLLECTIVO, "extensions": extensions}
+        )
+        config.enable()
+        self.addCleanup(config.disable)
+
+    def test_period_starts(self):
+        """Test that months with fewer days do not shift the periods."""
+        periods = get_due_period_starts(self.monthly, date(2023, 4, 30))
+        self.assertEqual(
+            periods,
+            [
+                date(2023, 1, 31),
+                date(2023, 2, 28),
+                date(2023, 3, 31),
+                date(2023, 4, 30),
+            ],
+        )
+        self.assertEqual(
+            get_due_period_starts(
+                self.monthly, date(2023, 4, 30), after=date(2023, 3, 31)
+            ),
+            [date(2023, 4, 30)],
+        )
+
+    def test_create_invoices(self):
+        """Test that invoices are created once per period in chunks."""
+        self.set_days_back(365)
+        today = date(2023, 3, 31)
+        created = create_subscription_invoices(chunk_size=1, today=today)
+        self.assertEqual(created, 6)
+        monthly = Invoice.objects.filter(subscription=self.monthly)
+        self.assertEqual(monthly.count(), 3)
+        self.assertEqual(
+            Invoice.objects.filter(subscription=self.weekly).count(), 3
+        )
+        self.assertFalse(Invoice.objects.filter(subscription=self.paused))
+        invoice = monthly.get(period_start=date(2023, 2, 28))
+        self.assertEqual(invoice.payment_from, self.account)
+        self.assertEqual(invoice.status, "open")
+        self.assertEqual(invoice.history.count(), 1)
+        item = invoice.items.get()
+        self.assertEqual(
+            (item.type, item.price, item.amount), (self.item_type, 10, 2)
+        )
+
+        # Repeated runs only create new periods
+        self.assertEqual(create_subscription_invoices(today=today), 0)
+        created = create_subscription_invoices(today=date(2023, 4, 30))
+        self.assertEqual(created, 3)
+        self.assertEqual(
+            ItemEntry.objects.filter(invoice__isnull=False).count(), 9
+        )
+
+    def test_run_window(self):
+        """Test that periods before the run window are not invoiced."""
+        created = create_subscription_invoices(today=date(2023, 3, 31))
+        self.assertEqual(created, 2)
+        self.assertEqual(
+            list(
+                Invoice.objects.order_by("period_start").values_list(
+                    "period_start", flat=True
+                )
+            ),
+            [date(2023, 3, 29), date(2023, 3, 31)],
+        )
+
+        # Missed runs within the window are caught up
+        created = create_subscription_invoices(today=date(2023, 4, 14))
+        self.assertEqual(created, 1)
+        self.assertTrue(
+            Invoice.objects.filter(
+                subscription=self.weekly, period_start=date(2023, 4, 12)
+            ).exists()
+        )
+
+
+class SepaExportTests(TestCase):
+    """Tests of the SEPA direct debit export."""
+
+    def setUp(self):
+        """Create open invoices of accounts with different payment methods."""
+        self.client = APIClient()
+        self.client.force_authenticate(create_testadmin())
+        self.item_type = ItemType.objects.create(name="Fee")
+        self.invoices = {}
+        for name, method in [("sepa1", "sepa"), ("sepa2", "sepa")] + [
+            ("transfer", "transfer")
+        ]:
+            user = create_testuser(name)
+            PaymentProfile.objects.filter(user=user).update(
+                payment_method=method,
+                bank_account_iban="AT61 1904 3002 3457 3201",
+                bank_account_owner=name,
+                sepa_mandate_reference=f"MANDATE-{name}",
+                sepa_mandate_date=date(2023, 1, 1),
+            )
+            invoice = Invoice.objects.create(
+                payment_from=Account.objects.get(user=user), status="open"
+            )
+            ItemEntry.objects.create(
+                type=self.item_type, price=10, amount=2, invoice=invoice
+            )
+            ItemEntry.objects.create(
+                type=self.item_type, price=5, amount=1, invoice=invoice
+            )
+            self.invoices[name] = invoice
+        extensions = {
+            **settings.COLLECTIVO["extensions"],
+            "collectivo.payments": {
+                "sepa": {
+                    "creditor_name": "Collectivo",
+                    "creditor_iban": "AT483200000012345864",
+                    "creditor_id": "AT12ZZZ00000000001",
+                }
+            },
+        }
+        self.sepa_settings = self.settings(
+            COLLECTIVO={**settings.COLLECTIVO, "extensions": extensions}
+        )
+        self.sepa_settings.enable()
+        self.addCleanup(self.sepa_settings.disable)
+
+    def test_export(self):
+        """Test that open SEPA invoices are exported and marked as pending."""
+        res = self.client.post(SEPA_URL)
+        self.assertEqual(res.status_code, 200)
+        root = ET.fromstring(b"".join(res.streaming_content))
+        ns = {"p": NAMESPACE}
+        self.assertEqual(root.findtext(".//p:GrpHdr/p:NbOfTxs", None, ns), "2")
+        self.assertEqual(
+            root.findtext(".//p:GrpHdr/p:CtrlSum", None, ns), "50.00"
+        )
+        debits = root.findall(".//p:DrctDbtTxInf", ns)
+        self.assertEqual(len(debits), 2)
+        self.assertEqual(debits[0].findtext("p:InstdAmt", None, ns), "25.00")
+        self.assertEqual(
+            debits[0].findtext(".//p:DbtrAcct/p:Id/p:IBAN", None, ns),
+            "AT611904300234573201",
+        )
+        self.assertEqual(
+            debits[0].findtext(".//p:MndtId", None, ns), "MANDATE-sepa1"
+        )
+        self.assertEqual(
+            debits[0].findtext(".//p:DtOfSgntr", None, ns), "2023-01-01"
+        )
+
+        for name, status in [
+            ("sepa1", "pending"),
+            ("sepa2", "pending"),
+            ("transfer", "open"),
+        ]:
+            invoice = self.invoices[name]
+            invoice.refresh_from_db()
+            self.assertEqual(invoice.status, status)
+        self.assertEqual(
+            self.invoices["sepa1"].history.first().status, "pending"
+        )
+
+        # Exported invoices are not exported again
+        res = self.client.post(SEPA_URL)
+        root = ET.fromstring(b"".join(res.streaming_content))
+        self.assertEqual(root.findtext(".//p:GrpHdr/p:NbOfTxs", None, ns), "0")
+
+    def test_export_totals(self):
+        """Test that invoices opened during the export are not included."""
+        stream = stream_sepa_export()
+        header = next(stream)
+        invoice = Invoice.objects.create(
+            payment_from=self.invoices["sepa1"].payment_from, status="open"
+        )
+        ItemEntry.objects.create(
+            type=self.item_type, price=10, amount=1, invoice=invoice
+        )
+        content = header + "".join(stream)
+        root = ET.fromstring(content.encode())
+        ns = {"p": NAMESPACE}
+        amounts = [
+            Decimal(debit.findtext("p:InstdAmt", None, ns))
+            for debit in root.findall(".//p:DrctDbtTxInf", ns)
+        ]
+        self.assertEqual(len(amounts), 2)
+        self.assertEqual(root.findtext(".//p:GrpHdr/p:NbOfTxs", None, ns), "2")
+        self.assertEqual(
+            Decimal(root.findtext(".//p:GrpHdr/p:CtrlSum", None, ns)),
+            sum(amounts),
+        )
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.status, "open")
+
+    def test_export_without_mandate(self):
+        """Test that invoices of debtors without a mandate are not exported."""
+        PaymentProfile.objects.filter(
+            user=self.invoices["sepa2"].payment_from.user
+        ).update(sepa_mandate_reference="")
+        with self.assertLogs("collectivo.payments.sepa", "WARNING"):
+            content = "".join(stream_sepa_export())
+        root = ET.fromstring(content.encode())
+        ns = {"p": NAMESPACE}
+        self.assertEqual(root.findtext(".//p:GrpHdr/p:NbOfTxs", None, ns), "1")
+        self.invoices["sepa2"].refresh_from_db()
+        self.assertEqual(self.invoices["sepa2"].status, "open")
+
+    def test_incomplete_export(self):
+        """Test that invoices stay open if the export is not finished."""
+        stream = stream_sepa_export()
+        next(stream)
+        next(stream)
+        stream.close()
+        self.assertEqual(Invoice.objects.filter(status="open").count(), 3)
+
+
+CAMT_STATEMENT = """<?xml version="1.0" encoding="UTF-8"?>
+<Document xmlns="urn:iso:std:iso:20022:tech:xsd:camt.053.001.02">
+<BkToCstmrStmt><Stmt>
+<Ntry>
+  <Amt Ccy="EUR">25.00</Amt><CdtDbtInd>CRDT</CdtDbtInd>
+  <BookgDt><Dt>2023-05-02</Dt></BookgDt>
+  <NtryDtls><TxDtls>
+    <RmtInf><Ustrd>Invoice {invoice}</Ustrd></RmtInf>
+  </TxDtls></NtryDtls>
+</Ntry>
+<Ntry>
+  <Amt Ccy="EUR">10.00</Amt><CdtDbtInd>DBIT</CdtDbtInd>
+  <BookgDt><Dt>2023-05-02</Dt></BookgDt>
+</Ntry>
+<Ntry>
+  <Amt Ccy="EUR">50.00</Amt><CdtDbtInd>CRDT</CdtDbtInd>
+  <BookgDt><Dt>2023-05-03</Dt></BookgDt>
+  <NtryDtls>
+    <TxDtls>
+      <AmtDtls><TxAmt><Amt Ccy="EUR">25.00</Amt></TxAmt></AmtDtls>
+      <RltdPties><DbtrAcct><Id><IBAN>AT61 1904 3002 3457 3201</IBAN></Id>
+      </DbtrAcct></RltdPties>
+    </TxDtls>
+    <TxDtls>
+      <AmtDtls><TxAmt><Amt Ccy="EUR">25.00</Amt></TxAmt></AmtDtls>
+      <RltdPties><Dbtr><Nm>Jane Doe</Nm></Dbtr></RltdPties>
+    </TxDtls>
+  </NtryDtls>
+</Ntry>
+</Stmt></BkToCstmrStmt>
+</Document>
+"""
+
+
+class ReconciliationTests(TestCase):
+    """Tests of the reconciliation of bank statements."""
+
+    def setUp(self):
+        """Create open invoices of different payers."""
+        self.client = APIClient()
+        self.client.force_authenticate(create_testadmin())
+        self.item_type = ItemType.objects.create(name="Fee")
+        self.invoices = {}
+        for name, iban in [
+            ("reference", ""),
+            ("account", "AT611904300234573201"),
+            ("name", ""),
+        ]:
+            user = create_testuser(name)
+            if name == "name":
+                user.first_name, user.last_name = "Jane", "Doe"
+                user.save()
+            PaymentProfile.objects.filter(user=user).update(
+                bank_account_iban=iban
+            )
+            invoice = Invoice.objects.create(
+                payment_from=Account.objects.get(user=user), status="open"
+            )
+            ItemEntry.objects.create(
+                type=self.item_type, price=25, amount=1, invoice=invoice
+            )
+            self.invoices[name] = invoice
+
+    def test_parse_camt053(self):
+        """Test that incoming payments are parsed from CAMT.053."""
+        statement = CAMT_STATEMENT.format(invoice=1).encode()
+        transactions = list(
+            parse_statement(io.BytesIO(statement), "statement.xml")
+        )
+        self.assertEqual(len(transactions), 3)
+        self.assertEqual(transactions[0].reference, "Invoice 1")
+        self.assertEqual(transactions[0].date, date(2023, 5, 2))
+        self.assertEqual(transactions[1].amount, 25)
+        self.assertEqual(transactions[1].iban, "AT611904300234573201")
+        self.assertEqual(transactions[2].name, "Jane Doe")
+
+    def test_parse_csv(self):
+        """Test that incoming payments are parsed from CSV."""
+        statement = (
+            "Buchungsdatum;Betrag;Verwendungszweck;IBAN;Auftraggeber\n"
+            "02.05.2023;1.025,50;Invoice 7;AT61 1904;Jane Doe\n"
+            "02.05.2023;-10,00;Rent;;\n"
+        ).encode()
+        transactions = list(parse_statement(io.BytesIO(statement)))
+        self.assertEqual(
+            transactions,
+            [
+                BankTransaction(
+                    amount=Decimal("1025.50"),
+                    date=date(2023, 5, 2),
+                    reference="Invoice 7",
+                    iban="AT611904",
+                    name="Jane Doe",
+                )
+            ],
+        )
+
+    def test_reconcile(self):
+        """Test that matched invoices are marked as paid."""
+        statement = CAMT_STATEMENT.format(
+            invoice=self.invoices["reference"].pk
+        ).encode()
+        file = SimpleUploadedFile("statement.xml", statement)
+        res = self.client.post(RECONCILE_URL, {"file": file, "dry_run": True})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data["matched"], 3)
+        self.assertEqual(res.data["paid"], 0)
+        self.assertFalse(Invoice.objects.filter(status="paid").exists())
+
+        file = SimpleUploadedFile("statement.xml", statement)
+        res = self.client.post(RECONCILE_URL, {"file": file})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data["paid"], 3)
+        self.assertEqual(
+            res.data["methods"], {"reference": 1, "account": 1, "name": 1}
+        )
+        self.assertEqual(res.data["unmatched"], [])
+        for invoice in self.invoices.values():
+            invoice.refresh_from_db()
+            self.assertEqual(invoice.status, "paid")
+            self.assertEqual(invoice.history.first().status, "paid")
+        self.assertEqual(
+            self.invoices["reference"].date_paid, date(2023, 5, 2)
+        )
+        self.assertEqual(self.invoices["account"].date_paid, date(2023, 5, 3))
+
+        # Paid invoices are not matched again
+        file = SimpleUploadedFile("statement.xml", statement)
+        res = self.client.post(RECONCILE_URL, {"file": file})
+        self.assertEqual(res.data["matched"], 0)
+        self.assertEqual(len(res.data["unmatched"]), 3)
+
+    def test_invalid_statement(self):
+        """Test that invalid statements are rejected."""
+        for content in [
+            b"date;name\n",
+            b"date;amount\n02.05.2023;\xff\n",
+            b'amount\n"' + b"1" * 200000 + b'"\n',
+            b"<?xml version='1.0'?><!DOCTYPE x [<!ENTITY a 'b'>]><x>&a;</x>",
+        ]:
+            file = SimpleUploadedFile("statement.csv", content)
+            res = self.client.post(RECONCILE_URL, {"file": file})
+            self.assertEqual(res.status_code, 400)
+
+    def test_parse_csv_short_rows(self):
+        """Test that rows without an amount are skipped."""
+        statement = (
+            b"date;amount;reference;name\n"
+            b"02.05.2023;10,00;Invoice 1\n\nTotal\n"
+        )
+        transactions = list(parse_statement(io.BytesIO(statement)))
+        self.assertEqual(
+            transactions,
+            [
+                BankTransaction(
+                    amount=Decimal(10),
+                    date=date(2023, 5, 2),
+                    reference="Invoice 1",
+                )
+            ],
+        )
+
+
+class AccountBalanceTests(TestCase):
+    """Tests of the balances of accounts."""
+
+    def setUp(self):
+        """Create an invoice with items of different categories."""
+        self.client = APIClient()
+        self.client.force_authenticate(create_testadmin())
+        self.user = create_testuser()
+        self.account = Account.objects.get(user=self.user)
+        self.shares = ItemTypeCategory.objects.create(name="Shares")
+        self.fees = ItemTypeCategory.objects.create(name="Fees")
+        self.invoice = Invoice.objects.create(
+            payment_from=self.account, status="open"
+        )
+        self.share_item = ItemEntry.objects.create(
+            type=ItemType.objects.create(name="Share", category=self.shares),
+            price=50,
+            amount=2,
+            invoice=self.invoice,
+        )
+        ItemEntry.objects.create(
+            type=ItemType.objects.create(name="Fee", category=self.fees),
+            price=10,
+            invoice=self.invoice,
+        )
+
+    def get_balances(self):
+        """Get the balances of the account."""
+        return {
+            (b.category.name, b.status): b.total
+            for b in self.account.balances.select_related("category")
+        }
+
+    def test_balances_are_updated(self):
+        """Test that balances follow changes of invoices and items."""
+        self.assertEqual(
+            self.get_balances(),
+            {("Shares", "open"): 100, ("Fees", "open"): 10},
+        )
+        self.share_item.amount = 3
+        self.share_item.save()
+        self.assertEqual(self.get_balances()[("Shares", "open")], 150)
+
+        self.invoice.status = "paid"
+        self.invoice.save()
+        self.assertEqual(
+            self.get_balances(),
+            {("Shares", "paid"): 150, ("Fees", "paid"): 10},
+        )
+
+        self.share_item.delete()
+        self.assertEqual(self.get_balances(), {("Fees", "paid"): 10})
+        self.invoice.delete()
+        self.assertEqual(self.get_balances(), {})
+
+    def test_list_debtors(self):
+        """Test that debtors can be listed from the balances."""
+        other = Account.objects.get(user=create_testuser("other"))
+        Invoice.objects.create(payment_from=other, status="open")
+        res = self.client.get(BALANCES_URL + "?status=open&total__gt=50")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            [(b["account"], b["category"]) for b in res.data],
+            [(self.account.pk, self.shares.pk)],
+        )
+
+        res = self.client.get(ACCOUNTS_URL + f"?id={self.account.pk}")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(res.data[0]["balances"]), 2)
@@ -10,6 +10,8 @@ app_name = "collectivo.payments"
 
 router = DefaultRouter()
 router.register("profiles", views.ProfileViewSet)
+router.register("accounts", views.AccountViewSet)
+router.register("balances", views.AccountBalanceViewSet)
 router.register("invoices", views.InvoiceViewSet)
 router.register("subscriptions", views.SubscriptionViewSet)
 
@@ -1,11 +1,22 @@
 """Views of the payments extension."""
+from django.http import StreamingHttpResponse
+from drf_spectacular.utils import OpenApiResponse, extend_schema
 from rest_framework import mixins, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
 
 from collectivo.utils.filters import get_filterset, get_ordering_fields
 from collectivo.utils.mixins import HistoryMixin, SchemaMixin, SelfMixin
 from collectivo.utils.permissions import HasPerm, IsAuthenticated
 
 from . import models, serializers
+from .reconciliation import (
+    ReconciliationError,
+    parse_statement,
+    reconcile,
+)
+from .sepa import get_sepa_config, stream_sepa_export
 
 
 class ProfileViewSet(SchemaMixin, viewsets.ModelViewSet):
@@ -39,6 +50,31 @@ class ProfileSelfViewSet(
     ordering_fields = get_ordering_fields(serializer_class)
 
 
+class AccountViewSet(SchemaMixin, viewsets.ReadOnlyModelViewSet):
+    """ViewSet for admins to view accounts and their balances."""
+
+    permission_classes = [HasPerm]
+    required_perms = {"GET": [("view_payments", "payments")]}
+    serializer_class = serializers.AccountSerializer
+    queryset = models.Account.objects.prefetch_related("balances")
+    filterset_class = get_filterset(serializer_class)
+    ordering_fields = get_ordering_fields(serializer_class)
+
+
+class AccountBalanceViewSet(SchemaMixin, viewsets.ReadOnlyModelViewSet):
+    """ViewSet for admins to list the balances of accounts.
+
+    For example, debtors can be listed with ?status=open&total__gt=0.
+    """
+
+    permission_classes = [HasPerm]
+    required_perms = {"GET": [("view_payments", "payments")]}
+    serializer_class = serializers.AccountBalanceSerializer
+    queryset = models.AccountBalance.objects.all()
+    filterset_class = get_filterset(serializer_class)
+    ordering_fields = get_ordering_fields(serializer_class)
+
+
 class InvoiceViewSet(HistoryMixin, SchemaMixin, viewsets.ModelViewSet):
     """ViewSet for admins to manage subscriptions."""
 
@@ -52,6 +88,51 @@ class InvoiceViewSet(HistoryMixin, SchemaMixin, viewsets.ModelViewSet):
     filterset_class = get_filterset(serializer_class)
     ordering_fields = get_ordering_fields(serializer_class)
 
+    @extend_schema(responses={200: OpenApiResponse()})
+    @action(
+        detail=False,
+        methods=["POST"],
+        url_path="sepa",
+        url_name="sepa",
+    )
+    def sepa(self, request):
+        """Export open invoices of SEPA accounts as direct debit file.
+
+        The exported invoices are marked as pending.
+        """
+        get_sepa_config()
+        response = StreamingHttpResponse(
+            stream_sepa_export(), content_type="application/xml"
+        )
+        disposition = 'attachment; filename="direct-debits.xml"'
+        response["Content-Disposition"] = disposition
+        return response
+
+    @extend_schema(responses={200: OpenApiResponse()})
+    @action(
+        detail=False,
+        methods=["POST"],
+        url_path="reconcile",
+        url_name="reconcile",
+    )
+    def reconcile(self, request):
+        """Mark open invoices as paid that match a bank statement.
+
+        The statement is uploaded as 'file' in the format CAMT.053 or CSV.
+        If 'dry_run' is true, matches are returned without changes.
+        """
+        file = request.FILES.get("file")
+        if file is None:
+            raise ValidationError("No statement file was uploaded.")
+        dry_run = str(request.data.get("dry_run", "")).lower() == "true"
+        try:
+            result = reconcile(
+                parse_statement(file, file.name), apply=not dry_run
+            )
+        except ReconciliationError as e:
+            raise ValidationError(str(e))
+        return Response(result)
+
 
 class SubscriptionViewSet(HistoryMixin, SchemaMixin, viewsets.ModelViewSet):
     """ViewSet for admins to manage subscriptions."""
@@ -7,6 +7,8 @@ from .models import UserProfile
 
 def create_user_profile(sender, instance, created, **kwargs):
     """Create user profile when a user is created."""
+    if kwargs.get("raw"):
+        return
     UserProfile.objects.get_or_create(user=instance)
 
 
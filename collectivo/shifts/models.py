@@ -1,7 +1,8 @@
 """Models of the shift module."""
 from django.contrib.auth import get_user_model
 from django.db import models
-from simple_history.models import HistoricalRecords
+
+from collectivo.utils.history import HistoricalRecords
 
 
 class Shift(models.Model):
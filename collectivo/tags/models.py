@@ -1,8 +1,8 @@
 """Models of the tags extension."""
 from django.contrib.auth import get_user_model
 from django.db import models
-from simple_history.models import HistoricalRecords
 
+from collectivo.utils.history import HistoricalRecords
 from collectivo.utils.texts import EXTENSION_HELP_TEXT
 
 
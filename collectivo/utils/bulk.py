@@ -0,0 +1,291 @@
+"""Bulk updates of objects with the serializer of a viewset."""
+from collections import defaultdict
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError, transaction
+from rest_framework.exceptions import ValidationError
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField
+from rest_framework.serializers import as_serializer_error
+from rest_framework.validators import UniqueTogetherValidator
+from rest_framework.viewsets import GenericViewSet
+
+CHUNK_SIZE = 500
+
+
+class RelatedObjects:
+    """Related objects of a serializer field that have been loaded in bulk.
+
+    Replaces the queryset of the field, so that rows are validated without
+    a query per relation.
+    """
+
+    def __init__(self, model, objects: dict):
+        """Store the loaded objects by their primary key."""
+        self.model = model
+        self.objects = objects
+
+    def get(self, pk=None):
+        """Get a loaded object by its primary key."""
+        try:
+            pk = self.model._meta.pk.to_python(pk)
+        except DjangoValidationError:
+            raise ValueError(pk)
+        if pk not in self.objects:
+            raise self.model.DoesNotExist
+        return self.objects[pk]
+
+
+def to_pk(model, value):
+    """Convert a value to a primary key of a model or return None."""
+    try:
+        return model._meta.pk.to_python(value)
+    except (DjangoValidationError, TypeError):
+        return None
+
+
+def get_relations(serializer) -> dict:
+    """Get the writable primary key relations of a serializer."""
+    relations = {}
+    for name, field in serializer.fields.items():
+        if field.read_only:
+            continue
+        if isinstance(field, ManyRelatedField):
+            field = field.child_relation
+        if isinstance(field, PrimaryKeyRelatedField) and not field.pk_field:
+            relations[name] = field
+    return relations
+
+
+def load_relations(serializer, rows: list[dict]) -> dict:
+    """Load the related objects of all rows with one query per field."""
+    relations = {}
+    for name, field in get_relations(serializer).items():
+        queryset = field.get_queryset()
+        pks = set()
+        for row in rows:
+            values = row.get(name)
+            for value in values if isinstance(values, list) else [values]:
+                pks.add(to_pk(queryset.model, value))
+        pks.discard(None)
+        relations[name] = RelatedObjects(queryset.model, queryset.in_bulk(pks))
+    return relations
+
+
+def get_row_serializer(
+    self: GenericViewSet, instance, row, partial, relations
+):
+    """Get a serializer of a row that uses the loaded related objects.
+
+    Unique together validators are removed, since uniqueness is checked
+    for all plain rows together, see find_unique_conflicts, and for rows
+    with nested data when they are saved, see save_row.
+    """
+    serializer = self.get_serializer(instance, data=row, partial=partial)
+    for name, related in relations.items():
+        field = serializer.fields[name]
+        if isinstance(field, ManyRelatedField):
+            field = field.child_relation
+        field.queryset = related
+    serializer.validators = [
+        validator
+        for validator in serializer.validators
+        if not isinstance(validator, UniqueTogetherValidator)
+    ]
+    return serializer
+
+
+def find_unique_conflicts(model, objects: list) -> dict:
+    """Find objects that violate a unique together constraint.
+
+    Objects are checked against each other and against the stored objects
+    with one query per constraint. Returns the errors per primary key.
+    If objects share a key, all but the first are reported.
+    """
+    errors = {}
+    pks = [obj.pk for obj in objects]
+    for names in model._meta.unique_together:
+        attnames = [model._meta.get_field(name).attname for name in names]
+        keys = defaultdict(list)
+        for obj in objects:
+            key = tuple(getattr(obj, attname) for attname in attnames)
+            if None not in key:
+                keys[key].append(obj.pk)
+        stored = set(
+            model._default_manager.filter(
+                **{f"{attnames[0]}__in": {key[0] for key in keys}}
+            )
+            .exclude(pk__in=pks)
+            .values_list(*attnames)
+        )
+        message = f"The fields {', '.join(names)} must make a unique set."
+        for key, key_pks in keys.items():
+            # The first object with a key is valid if the key is not stored
+            for pk in key_pks if key in stored else key_pks[1:]:
+                errors[pk] = {"non_field_errors": [message]}
+    return errors
+
+
+def apply_data(instance, data: dict) -> tuple[list[str], dict]:
+    """Set validated data on an instance.
+
+    Returns the names of the changed fields and the values of many-to-many
+    fields, which are set after the instance has been saved.
+    """
+    fields, many = [], {}
+    for name, value in data.items():
+        field = instance._meta.get_field(name)
+        if field.many_to_many:
+            many[name] = value
+        else:
+            setattr(instance, name, value)
+            fields.append(name)
+    return fields, many
+
+
+def is_plain(model, data: dict) -> bool:
+    """Check if validated data contains only fields of a model.
+
+    Data of related objects, e.g. from a serializer field with the source
+    user.tags, is stored as a dictionary under the name of the relation.
+    """
+    for name, value in data.items():
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return False
+        if not (field.concrete or field.many_to_many):
+            return False
+        if field.is_relation and isinstance(value, dict):
+            return False
+    return True
+
+
+def save_row(serializer) -> dict | None:
+    """Save a row with nested data in a savepoint.
+
+    The unique together validators are run for the row, since it is not
+    checked by find_unique_conflicts. Returns the errors of the row if it
+    cannot be saved.
+    """
+    # Fields that are not in the data are taken from the instance
+    attrs = {
+        name: value
+        for name, value in serializer.validated_data.items()
+        if not isinstance(value, dict)
+    }
+    try:
+        for validator in serializer.get_validators():
+            if isinstance(validator, UniqueTogetherValidator):
+                validator(attrs, serializer)
+        with transaction.atomic():
+            serializer.save()
+    except ValidationError as e:
+        return as_serializer_error(e)
+    except IntegrityError:
+        return {"non_field_errors": ["The object conflicts with another."]}
+    return None
+
+
+def update_chunk(
+    self: GenericViewSet, rows: list, start: int, partial: bool, user=None
+) -> tuple[int, list]:
+    """Validate and update a chunk of rows.
+
+    Returns the number of changed objects and the errors per row.
+    """
+    queryset = self.get_queryset()
+    model = queryset.model
+    errors = []
+    data = []
+    for i, row in enumerate(rows, start):
+        if not isinstance(row, dict) or to_pk(model, row.get("id")) is None:
+            errors.append(
+                {"row": i, "errors": {"id": ["Invalid data (expected id)."]}}
+            )
+        else:
+            data.append((i, row))
+    instances = queryset.in_bulk({to_pk(model, row["id"]) for _, row in data})
+    relations = load_relations(self.get_serializer(), [r for _, r in data])
+
+    valid = {}
+    for i, row in data:
+        instance = instances.get(to_pk(model, row["id"]))
+        if instance is None:
+            errors.append(
+                {"row": i, "errors": {"id": ["Object does not exist."]}}
+            )
+            continue
+        serializer = get_row_serializer(
+            self, instance, row, partial, relations
+        )
+        if not serializer.is_valid():
+            errors.append({"row": i, "errors": serializer.errors})
+            continue
+        if instance.pk in valid:
+            errors.append(
+                {"row": i, "errors": {"id": ["Object is updated twice."]}}
+            )
+            continue
+        valid[instance.pk] = (i, serializer)
+
+    # Serializers with nested data are saved one by one
+    changed = 0
+    fields, many = set(), {}
+    for pk, (i, serializer) in list(valid.items()):
+        if not is_plain(model, serializer.validated_data):
+            del valid[pk]
+            row_errors = save_row(serializer)
+            if row_errors:
+                errors.append({"row": i, "errors": row_errors})
+            else:
+                changed += 1
+            continue
+        instance_fields, many[pk] = apply_data(
+            serializer.instance, serializer.validated_data
+        )
+        fields.update(instance_fields)
+
+    conflicts = find_unique_conflicts(
+        model, [serializer.instance for _, serializer in valid.values()]
+    )
+    for pk, pk_errors in conflicts.items():
+        errors.append({"row": valid.pop(pk)[0], "errors": pk_errors})
+
+    objects = [serializer.instance for _, serializer in valid.values()]
+    if objects and fields:
+        changed += len(self.perform_bulk_update(objects, sorted(fields), user))
+    for obj in objects:
+        for name, value in many[obj.pk].items():
+            getattr(obj, name).set(value)
+    return changed, errors
+
+
+def bulk_update(
+    self: GenericViewSet,
+    rows: list,
+    partial: bool = False,
+    user=None,
+    chunk_size: int = CHUNK_SIZE,
+) -> dict:
+    """Update objects from a list of rows with the serializer of a viewset.
+
+    Each row needs the id of an object. Rows are processed in chunks. The
+    objects of a chunk are loaded and validated together, and their fields
+    are written with the method perform_bulk_update of the viewset in one
+    transaction. The update method of the serializer is only called for
+    rows with nested data. Invalid rows are skipped and reported.
+
+    Returns a report with the number of changed objects and the errors
+    per row, counting from zero.
+    """
+    report = {"updated": 0, "errors": []}
+    for start in range(0, len(rows), chunk_size):
+        with transaction.atomic():
+            changed, errors = update_chunk(
+                self, rows[start : start + chunk_size], start, partial, user
+            )
+        report["updated"] += changed
+        report["errors"] += errors
+    report["errors"].sort(key=lambda error: error["row"])
+    return report
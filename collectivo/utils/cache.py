@@ -0,0 +1,15 @@
+"""Cache functions for the collectivo app."""
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def get_cache_timeout(timeout: int | None, local_timeout: int) -> int | None:
+    """Return the timeout of a cache entry that is cleared on changes.
+
+    A local memory cache is only cleared in the current process, so other
+    processes, e.g. Celery workers, keep old entries until the short local
+    timeout expires.
+    """
+    if isinstance(caches["default"], LocMemCache):
+        return local_timeout
+    return timeout
@@ -0,0 +1,105 @@
+"""Utilities for the history of collectivo models."""
+from django.core.exceptions import ValidationError
+from simple_history import models as history_models
+from simple_history import utils as history_utils
+
+CHUNK_SIZE = 1000
+
+
+def get_prep_values(fields, values) -> tuple:
+    """Convert values of fields into comparable database values.
+
+    Values that cannot be converted are returned unchanged, so that they
+    are treated as changed if they differ from the stored values.
+    """
+    prepared = []
+    for field, value in zip(fields, values):
+        try:
+            value = field.get_prep_value(value)
+        except (TypeError, ValueError, ValidationError):
+            pass
+        prepared.append(value)
+    return tuple(prepared)
+
+
+class HistoricalRecords(history_models.HistoricalRecords):
+    """Historical records that are only written if a field has changed.
+
+    Saves of existing objects are compared with the latest historical record
+    of the object. If no tracked field has changed, no record is written,
+    unless a change reason has been set on the object.
+    """
+
+    def post_save(self, instance, created, using=None, **kwargs):
+        """Create a historical record if the instance has changed."""
+        if (
+            not created
+            and not kwargs.get("raw", False)
+            and not hasattr(instance, "skip_history_when_saving")
+            and not getattr(instance, "_change_reason", None)
+            and not self.has_changed(instance, using)
+        ):
+            return
+        super().post_save(instance, created, using=using, **kwargs)
+
+    def has_changed(self, instance, using=None) -> bool:
+        """Check if a tracked field differs from the latest record."""
+        fields = self.fields_included(instance)
+        attnames = [field.attname for field in fields]
+        records = getattr(instance, self.manager_name)
+        if self.use_base_model_db and using:
+            records = records.using(using)
+        latest = records.values_list(*attnames).first()
+        if latest is None:
+            return True
+        current = [getattr(instance, attname) for attname in attnames]
+        return get_prep_values(fields, current) != get_prep_values(
+            fields, latest
+        )
+
+
+def bulk_update_with_history(
+    objs,
+    model,
+    fields: list[str],
+    batch_size: int = None,
+    default_user=None,
+    default_change_reason: str = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> list:
+    """Bulk update objects and write historical records of changed objects.
+
+    The stored values of the fields are loaded with one query per chunk.
+    Objects without changes are neither updated nor recorded in the
+    history. Returns the changed objects.
+    """
+    objs = list(objs)
+    model_fields = [model._meta.get_field(name) for name in fields]
+    attnames = [field.attname for field in model_fields]
+    changed = []
+    for i in range(0, len(objs), chunk_size):
+        chunk = objs[i : i + chunk_size]
+        stored = {
+            row[0]: get_prep_values(model_fields, row[1:])
+            for row in model._default_manager.filter(
+                pk__in=[obj.pk for obj in chunk]
+            ).values_list("pk", *attnames)
+        }
+        changed += [
+            obj
+            for obj in chunk
+            if stored.get(obj.pk)
+            != get_prep_values(
+                model_fields, [getattr(obj, name) for name in attnames]
+            )
+        ]
+    if changed:
+        history_utils.bulk_update_with_history(
+            changed,
+            model,
+            fields,
+            batch_size=batch_size,
+            default_user=default_user,
+            default_change_reason=default_change_reason,
+        )
+    return changed
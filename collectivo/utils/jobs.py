@@ -0,0 +1,143 @@
+"""Background jobs that run a viewset method in chunks."""
+import json
+import time
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework.renderers import BaseRenderer
+
+from collectivo.core.models import Job
+
+from .tasks import LogErrorRetryTask
+
+CHUNK_SIZE = 500
+EVENT_INTERVAL = 1
+EVENT_TIMEOUT = 30
+FINISHED_STATUSES = ["success", "failure"]
+
+
+class JobTask(LogErrorRetryTask):
+    """A task of a job that marks the job as failed after its last retry.
+
+    The first argument of the task must be the id of the job.
+    """
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        """Mark the job as failed and log the exception."""
+        fail_job(args[0], str(exc))
+        super().on_failure(exc, task_id, args, kwargs, einfo)
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Renderer that accepts requests for server-sent events.
+
+    Streams are returned as responses directly, other data as JSON.
+    """
+
+    media_type = "text/event-stream"
+    format = "sse"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Render data as JSON."""
+        return json.dumps(data, cls=DjangoJSONEncoder).encode()
+
+
+def start_job(
+    view, method: str, items: list, user=None, chunk_size=CHUNK_SIZE, **options
+) -> Job:
+    """Create a job that calls a method of a viewset for chunks of items.
+
+    The method is called with a chunk of items, the index of its first item,
+    the user, and the options of the job. It returns a report, in which
+    numbers are added to the result of the job and the list 'errors' is
+    added to the errors of the job. The job is queued after the current
+    transaction has been committed.
+    """
+    from collectivo.core.tasks import run_job_async
+
+    job = Job.objects.create(
+        action=f"{type(view).__module__}.{type(view).__qualname__}.{method}",
+        user=user,
+        total=len(items),
+        chunk_size=chunk_size,
+        data=items,
+        options=options,
+    )
+    transaction.on_commit(lambda: run_job_async.delay(job.pk))
+    return job
+
+
+def get_job_view(job: Job, method: str):
+    """Create the viewset of a job outside of a request."""
+    view_path = job.action.rsplit(".", 1)[0]
+    return import_string(view_path)(
+        request=None, format_kwarg=None, kwargs={}, action=method
+    )
+
+
+@transaction.atomic
+def run_job_chunk(job_id: int, start: int = 0) -> int | None:
+    """Run a chunk of a job and store its progress.
+
+    The chunk and its progress are saved in one transaction, so that a
+    retried chunk is not counted twice. Returns the index of the next
+    chunk, or None if the job is finished.
+    """
+    job = Job.objects.select_for_update().get(pk=job_id)
+    if job.status in FINISHED_STATUSES:
+        return None
+    method = job.action.rsplit(".", 1)[1]
+    view = get_job_view(job, method)
+    items = job.data[start : start + job.chunk_size]
+    report = getattr(view, method)(items, start, user=job.user, **job.options)
+
+    for key, value in report.items():
+        if key == "errors":
+            job.errors += value
+        elif isinstance(value, (int, float)):
+            job.result[key] = job.result.get(key, 0) + value
+    job.done = start + len(items)
+    job.status = "running"
+    # Only write the progress, the items of the job are not changed
+    fields = ["done", "status", "result", "errors", "date_finished"]
+    if job.done >= job.total:
+        job.status = "success"
+        job.date_finished = timezone.now()
+        job.data = []
+        fields.append("data")
+    job.save(update_fields=fields)
+    return None if job.status == "success" else job.done
+
+
+def fail_job(job_id: int, message: str):
+    """Mark a job as failed, unless it is finished already."""
+    Job.objects.filter(pk=job_id).exclude(status__in=FINISHED_STATUSES).update(
+        status="failure",
+        status_message=message[:255],
+        date_finished=timezone.now(),
+    )
+
+
+def stream_job_events(
+    job_id: int, serialize, interval=EVENT_INTERVAL, timeout=EVENT_TIMEOUT
+):
+    """Stream the state of a job as server-sent events.
+
+    The job is read again after each interval and an event is sent when
+    its state has changed. The stream ends when the job is finished or
+    after the timeout, after which clients can reconnect. Each stream
+    occupies a worker thread, so the timeout is kept short.
+    """
+    last = None
+    deadline = time.monotonic() + timeout
+    while True:
+        job = Job.objects.get(pk=job_id)
+        data = json.dumps(serialize(job), cls=DjangoJSONEncoder)
+        if data != last:
+            yield f"data: {data}\n\n"
+            last = data
+        if job.status in FINISHED_STATUSES or time.monotonic() > deadline:
+            return
+        time.sleep(interval)
@@ -6,12 +6,19 @@ class NameManager(models.Manager):
     """Manager with a register method for models with a name."""
 
     def register(self, name, *args, **kwargs):
-        """Update or create instance based on the attribute "name"."""
+        """Update or create instance based on the attribute "name".
+
+        Existing instances are only saved if one of the attributes changes.
+        """
         try:
             instance = self.get(name=name)
         except self.model.DoesNotExist:
             instance = self.model(name=name)
+        changed = instance._state.adding
         for key, value in kwargs.items():
-            setattr(instance, key, value)
-        instance.save()
+            if getattr(instance, key, None) != value:
+                setattr(instance, key, value)
+                changed = True
+        if changed:
+            instance.save()
         return instance
@@ -1,15 +1,41 @@
 """Mixin classes for collectivo viewsets."""
 
-from django.db import transaction
+from django.conf import settings
+from django.urls import reverse
+from django.utils.http import parse_etags
 from drf_spectacular.utils import OpenApiResponse, extend_schema
 from rest_framework.decorators import action
-from rest_framework.exceptions import ParseError
+from rest_framework.exceptions import NotFound, ParseError
 from rest_framework.request import Request
 from rest_framework.response import Response
 
 from collectivo.utils.permissions import IsAuthenticated, IsSuperuser
 
-from .schema import get_model_schema
+from .bulk import bulk_update, update_chunk
+from .history import bulk_update_with_history
+from .jobs import CHUNK_SIZE, start_job
+from .querysets import optimize_queryset
+from .schema import (
+    CHOICES_MODES,
+    get_cached_model_schema,
+    get_choices_label,
+    get_queryset,
+    is_relation,
+)
+
+CHOICES_LIMIT = 50
+CHOICES_MAX_LIMIT = 500
+
+
+def get_int_param(request: Request, name: str, default=None):
+    """Get an integer query parameter or raise a ParseError."""
+    value = request.query_params.get(name)
+    if value in (None, ""):
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ParseError(f"Parameter '{name}' must be an integer.")
 
 
 class RetrieveModelByExtAndNameMixin:
@@ -40,8 +66,36 @@ class SelfMixin:
             raise ParseError(f"{self.queryset.model} does not exist for user.")
 
 
+class OptimizeQuerysetMixin:
+    """Load the relations of the serializer with the queryset.
+
+    Relations are only loaded for the actions 'list' and 'retrieve', so that
+    prefetched objects cannot become outdated during an update.
+    """
+
+    optimize_actions = ["list", "retrieve"]
+
+    def get_queryset(self):
+        """Apply select_related and prefetch_related to the queryset."""
+        queryset = super().get_queryset()
+        if getattr(self, "action", None) in self.optimize_actions:
+            queryset = optimize_queryset(
+                queryset, self.get_serializer_class()
+            )
+        return queryset
+
+
 class SchemaMixin:
-    """Adds an action 'schema' to a viewset."""
+    """Adds the actions 'schema' and 'schema/choices' to a viewset.
+
+    Responses of the schema include an ETag. Requests with a matching
+    If-None-Match header receive an empty response with status 304.
+
+    The query parameter 'choices' of the schema can be 'inline' to list all
+    related objects as choices, or 'url' to only add the URL where choices can
+    be retrieved and their count. The default can be set through the setting
+    'schema_choices' in collectivo.yml.
+    """
 
     @extend_schema(responses={200: OpenApiResponse()})
     @action(
@@ -51,7 +105,64 @@ class SchemaMixin:
         permission_classes=[IsAuthenticated],
     )
     def _schema(self, request):
-        return Response(get_model_schema(self))
+        choices = request.query_params.get(
+            "choices", settings.COLLECTIVO.get("schema_choices", "inline")
+        )
+        if choices not in CHOICES_MODES:
+            raise ParseError(
+                f"Parameter 'choices' must be one of {CHOICES_MODES}."
+            )
+        schema, etag = get_cached_model_schema(self, choices)
+        if etag is None:
+            return Response(schema)
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            return Response(status=304, headers={"ETag": etag})
+        return Response(schema, headers={"ETag": etag})
+
+    @extend_schema(responses={200: OpenApiResponse()})
+    @action(
+        detail=False,
+        url_path=r"schema/choices/(?P<field>\w+)",
+        url_name="schema-choices",
+    )
+    def _schema_choices(self, request, field):
+        """Return choices of a related field as pairs of id and label.
+
+        Choices are ordered by id. Use the parameter 'search' to filter labels
+        that start with a given text, 'after' to get choices after a given id,
+        and 'limit' to set the number of choices.
+        """
+        serializer = self.get_serializer_class()()
+        field_obj = serializer.fields.get(field)
+        if field_obj is None or not is_relation(field_obj):
+            raise NotFound(f"Field '{field}' has no related choices.")
+
+        queryset = get_queryset(serializer.Meta.model, field_obj.source)
+        queryset = queryset.annotate(
+            _label=get_choices_label(queryset.model)
+        ).order_by("pk")
+        search = request.query_params.get("search")
+        if search:
+            queryset = queryset.filter(_label__istartswith=search)
+        after = get_int_param(request, "after")
+        if after is not None:
+            queryset = queryset.filter(pk__gt=after)
+        limit = get_int_param(request, "limit", CHOICES_LIMIT)
+        if limit < 1:
+            raise ParseError("Parameter 'limit' must be at least 1.")
+        limit = min(limit, CHOICES_MAX_LIMIT)
+
+        # Load one more choice to check if there is a next page
+        choices = list(queryset.values_list("pk", "_label")[: limit + 1])
+        next_url = None
+        if len(choices) > limit:
+            choices = choices[:limit]
+            params = request.query_params.copy()
+            params["after"] = choices[-1][0]
+            next_url = request.build_absolute_uri(
+                f"{request.path}?{params.urlencode()}"
+            )
+        return Response({"next": next_url, "results": choices})
 
 
 class HistoryMixin:
@@ -72,8 +183,45 @@ class HistoryMixin:
         return Response("Success")
 
 
-class BulkEditMixin:
-    """Adds an action 'bulk_update' to a viewset."""
+class JobMixin:
+    """Allows a viewset to run a method as a background job.
+
+    The method is called in chunks by a Celery task and the progress is
+    stored in a job, see collectivo.utils.jobs. Clients can poll the job
+    or open a stream of server-sent events on it.
+    """
+
+    job_chunk_size = CHUNK_SIZE
+
+    def start_job(self, method: str, items: list, **options) -> Response:
+        """Start a job and return its links with status 202."""
+        job = start_job(
+            self,
+            method,
+            items,
+            user=self.request.user,
+            chunk_size=self.job_chunk_size,
+            **options,
+        )
+        url = reverse("collectivo.core:job-detail", args=[job.pk])
+        events_url = reverse("collectivo.core:job-events", args=[job.pk])
+        return Response(
+            {
+                "job": job.pk,
+                "url": self.request.build_absolute_uri(url),
+                "events": self.request.build_absolute_uri(events_url),
+            },
+            status=202,
+        )
+
+
+class BulkEditMixin(JobMixin):
+    """Adds an action 'bulk_update' to a viewset.
+
+    Objects are validated and written in chunks with bulk queries, see
+    collectivo.utils.bulk. Invalid rows are skipped and reported. With the
+    query parameter 'async=true', the update is run as a background job.
+    """
 
     @action(
         detail=False,
@@ -85,14 +233,26 @@ class BulkEditMixin:
         """Update multiple objects with a single request."""
         if not isinstance(request.data, list):
             raise ParseError("Invalid data (expected a list)")
+        partial = request.method == "PATCH"
+
+        if request.query_params.get("async") == "true":
+            return self.start_job(
+                "bulk_update_chunk", request.data, partial=partial
+            )
+
+        return Response(
+            bulk_update(self, request.data, partial, user=request.user)
+        )
 
-        with transaction.atomic():
-            for data in request.data:
-                if not isinstance(data, dict) or "id" not in data:
-                    raise ParseError("Invalid data (expected object with id)")
-                instance = self.queryset.get(pk=data["id"])
-                serializer = self.get_serializer(instance, data=data)
-                serializer.is_valid(raise_exception=True)
-                serializer.save()
+    def bulk_update_chunk(
+        self, rows: list, start: int, user=None, partial=False
+    ) -> dict:
+        """Update a chunk of rows of a job."""
+        changed, errors = update_chunk(self, rows, start, partial, user)
+        return {"updated": changed, "errors": errors}
 
-        return Response()
+    def perform_bulk_update(self, objects: list, fields: list, user=None):
+        """Write the fields of objects and return the changed objects."""
+        return bulk_update_with_history(
+            objects, self.get_queryset().model, fields, default_user=user
+        )
@@ -0,0 +1,254 @@
+"""Pagination classes of collectivo."""
+import base64
+import binascii
+import datetime
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import FieldError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import F, Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .filters import get_ordering_fields
+
+COUNT_MODES = ["exact", "estimate", "none"]
+CURSOR_VALUE = "_cursor_value"
+
+
+def estimate_count(queryset) -> int | None:
+    """Estimate the number of rows of an unfiltered queryset.
+
+    The estimate is read from the statistics of the table in PostgreSQL.
+    Returns None if no estimate is available.
+    """
+    query = queryset.query
+    if query.where or query.distinct or query.is_sliced:
+        return None
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+            [queryset.model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    if row is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class CollectivoPagination(LimitOffsetPagination):
+    """Limit/offset pagination with an optional cursor mode.
+
+    Requests with the parameter `cursor` are paginated by the value of the
+    `ordering` field and the primary key of the last object of the previous
+    page, so that each page is found with an index instead of an offset.
+    The first page is requested with an empty cursor. The ordering field
+    must be one of the ordering fields of the view.
+
+    The parameter `count` selects how the total number of objects is found:
+    `exact` counts all objects (default with limit/offset), `estimate` uses
+    the statistics of the database for unfiltered lists, and `none` skips
+    the count (default with a cursor).
+    """
+
+    cursor_query_param = "cursor"
+    count_query_param = "count"
+    cursor_default_limit = 100
+
+    def get_count_mode(self, request, default: str) -> str:
+        """Get the requested count mode."""
+        mode = request.query_params.get(self.count_query_param) or default
+        if mode not in COUNT_MODES:
+            raise ValidationError(
+                {self.count_query_param: f"Must be one of {COUNT_MODES}."}
+            )
+        return mode
+
+    def get_total(self, queryset, mode: str) -> int | None:
+        """Count the objects of a queryset in the requested mode."""
+        if mode == "none":
+            return None
+        if mode == "estimate":
+            estimate = estimate_count(queryset)
+            if estimate is not None:
+                return estimate
+        return self.get_count(queryset)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Paginate a queryset with a cursor or with limit and offset."""
+        self.request = request
+        self.cursor_mode = self.cursor_query_param in request.query_params
+        if self.cursor_mode:
+            return self.paginate_cursor(queryset, request, view)
+
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.offset = self.get_offset(request)
+        self.count = self.get_total(
+            queryset, self.get_count_mode(request, "exact")
+        )
+        results = list(queryset[self.offset : self.offset + self.limit + 1])
+        self.has_next = len(results) > self.limit
+        return results[: self.limit]
+
+    def get_next_link(self):
+        """Get the link to the next page."""
+        if self.cursor_mode:
+            if self.next_cursor is None:
+                return None
+            url = self.request.build_absolute_uri()
+            return replace_query_param(
+                url, self.cursor_query_param, self.next_cursor
+            )
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(
+            url, self.offset_query_param, self.offset + self.limit
+        )
+
+    def get_previous_link(self):
+        """Get the link to the previous page, which cursors do not have."""
+        if self.cursor_mode:
+            return None
+        return super().get_previous_link()
+
+    def get_paginated_response(self, data):
+        """Return a page with the total number of objects, if counted."""
+        return Response(
+            OrderedDict(
+                [
+                    ("count", self.count),
+                    ("next", self.get_next_link()),
+                    ("previous", self.get_previous_link()),
+                    ("results", data),
+                ]
+            )
+        )
+
+    def get_cursor_ordering(self, request, view) -> tuple[str, bool]:
+        """Get the ordering field and direction of a cursor request."""
+        ordering = request.query_params.get("ordering", "").strip()
+        if not ordering:
+            return "pk", False
+        if "," in ordering:
+            raise ValidationError(
+                {"ordering": "Cursors support only one ordering field."}
+            )
+        descending = ordering.startswith("-")
+        field = ordering.lstrip("-")
+        allowed = getattr(view, "ordering_fields", None)
+        if allowed is None or allowed == "__all__":
+            serializer = view.get_serializer_class()
+            allowed = get_ordering_fields(serializer)
+        if field not in allowed and field not in ("pk", "id"):
+            raise ValidationError(
+                {"ordering": f"Cannot order by '{field}' with a cursor."}
+            )
+        return field, descending
+
+    def decode_cursor(self, cursor: str):
+        """Decode a cursor into the ordering value and primary key."""
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (ValueError, TypeError, binascii.Error):
+            raise ValidationError({self.cursor_query_param: "Invalid cursor."})
+        return value, pk
+
+    def encode_cursor(self, value, pk) -> str:
+        """Encode the ordering value and primary key of an object."""
+        if isinstance(value, (datetime.datetime, datetime.time)):
+            # Keep microseconds, which are cut off by the JSON encoder
+            value = value.isoformat()
+        data = json.dumps([value, pk], cls=DjangoJSONEncoder)
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def get_cursor_filter(self, field: str, descending: bool, value, pk):
+        """Get the filter of the objects after a cursor.
+
+        Empty values are ordered after all other values.
+        """
+        op = "lt" if descending else "gt"
+        if field == "pk":
+            return Q(**{f"pk__{op}": pk})
+        if value is None:
+            return Q(**{f"{field}__isnull": True, f"pk__{op}": pk})
+        return (
+            Q(**{f"{field}__{op}": value})
+            | Q(**{field: value, f"pk__{op}": pk})
+            | Q(**{f"{field}__isnull": True})
+        )
+
+    def paginate_cursor(self, queryset, request, view):
+        """Paginate a queryset by the ordering field after a cursor."""
+        self.limit = self.get_limit(request) or self.cursor_default_limit
+        field, descending = self.get_cursor_ordering(request, view)
+        self.count = self.get_total(
+            queryset, self.get_count_mode(request, "none")
+        )
+
+        value = F(field)
+        ordering = [
+            value.desc(nulls_last=True)
+            if descending
+            else value.asc(nulls_last=True),
+            "-pk" if descending else "pk",
+        ]
+        try:
+            queryset = queryset.annotate(**{CURSOR_VALUE: value}).order_by(
+                *ordering
+            )
+        except FieldError:
+            raise ValidationError(
+                {"ordering": f"Cannot order by '{field}' with a cursor."}
+            )
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            value, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(
+                self.get_cursor_filter(field, descending, value, pk)
+            )
+
+        results = list(queryset[: self.limit + 1])
+        self.next_cursor = None
+        if len(results) > self.limit:
+            last = results[self.limit - 1]
+            self.next_cursor = self.encode_cursor(
+                getattr(last, CURSOR_VALUE), last.pk
+            )
+        return results[: self.limit]
+
+    def get_paginated_response_schema(self, schema):
+        """Return the schema of a page, where the count can be empty."""
+        response = super().get_paginated_response_schema(schema)
+        response["properties"]["count"]["nullable"] = True
+        return response
+
+    def get_schema_operation_parameters(self, view):
+        """Add the cursor and count parameters to the schema."""
+        return super().get_schema_operation_parameters(view) + [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Cursor of the page, empty for the first page.",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.count_query_param,
+                "required": False,
+                "in": "query",
+                "description": "How to count objects: "
+                + ", ".join(COUNT_MODES),
+                "schema": {"type": "string", "enum": COUNT_MODES},
+            },
+        ]
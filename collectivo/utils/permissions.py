@@ -1,37 +1,127 @@
 """Core permissions of collectivo."""
 # Thanks to https://stackoverflow.com/a/19429199/14396787
 import logging
+from contextvars import ContextVar
+from typing import NamedTuple
 
+from django.core.cache import cache
+from django.db import transaction
 from rest_framework import permissions
 from rest_framework.permissions import BasePermission
 
-from collectivo.core.models import Permission
+from collectivo.core.models import PermissionGroup
+
+from .cache import get_cache_timeout
 
 logger = logging.getLogger(__name__)
 
+PERMISSIONS_CACHE_KEY = "collectivo.permissions.{}"
+PERMISSIONS_CACHE_TIMEOUT = 60 * 60
+PERMISSIONS_LOCAL_CACHE_TIMEOUT = 10
+
+
+class UserPermissions(NamedTuple):
+    """Resolved permissions of a user."""
+
+    perms: frozenset[tuple[str | None, str]]
+    superuser: bool
+
+
+# Permissions that have already been resolved during the current request
+_request_permissions: ContextVar[dict | None] = ContextVar(
+    "collectivo_request_permissions", default=None
+)
+
+
+def start_request_permissions(**kwargs):
+    """Start a new request-level memory of resolved permissions."""
+    _request_permissions.set({})
+
+
+def end_request_permissions(**kwargs):
+    """Discard the request-level memory of resolved permissions."""
+    _request_permissions.set(None)
+
+
+def load_user_permissions(user) -> UserPermissions:
+    """Resolve the permissions of a user from the database."""
+    perms = set()
+    superuser = False
+    for group_name, group_ext, perm_name, perm_ext in (
+        PermissionGroup.objects.filter(users=user)
+        .values_list(
+            "name",
+            "extension__name",
+            "permissions__name",
+            "permissions__extension__name",
+        )
+        .distinct()
+    ):
+        if group_name == "superuser" and group_ext == "core":
+            superuser = True
+        if perm_name is not None:
+            perms.add((perm_ext, perm_name))
+    return UserPermissions(frozenset(perms), superuser)
+
+
+def get_permissions_cache_timeout() -> int:
+    """Return the timeout of cached permissions, see get_cache_timeout."""
+    return get_cache_timeout(
+        PERMISSIONS_CACHE_TIMEOUT, PERMISSIONS_LOCAL_CACHE_TIMEOUT
+    )
+
+
+def get_user_permissions(user) -> UserPermissions | None:
+    """Return the resolved permissions of a user.
+
+    Permissions are loaded at most once per request and are shared between
+    requests through the cache until the permission groups change.
+    """
+    if getattr(user, "pk", None) is None:
+        return None
+    memory = _request_permissions.get()
+    if memory is not None and user.pk in memory:
+        return memory[user.pk]
+    key = PERMISSIONS_CACHE_KEY.format(user.pk)
+    user_perms = cache.get(key)
+    if user_perms is None:
+        user_perms = load_user_permissions(user)
+        cache.set(key, user_perms, get_permissions_cache_timeout())
+    if memory is not None:
+        memory[user.pk] = user_perms
+    return user_perms
+
+
+def clear_permissions_cache(user_ids):
+    """Remove the cached permissions of the given users."""
+    user_ids = list(user_ids or [])
+    if not user_ids:
+        return
+    memory = _request_permissions.get()
+    if memory is not None:
+        for user_id in user_ids:
+            memory.pop(user_id, None)
+    keys = [PERMISSIONS_CACHE_KEY.format(user_id) for user_id in user_ids]
+    cache.delete_many(keys)
+
+    # Clear again after commit in case another request cached old data
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
 
 def is_superuser(user):
     """Check if user is superuser."""
-    try:
-        return user.permission_groups.filter(
-            name="superuser", extension__name="core"
-        ).exists()
-    except AttributeError:
+    user_perms = get_user_permissions(user)
+    if user_perms is None:
         return None
+    return user_perms.superuser
 
 
 def has_permission(user, perm_name: str, ext_name: str = None) -> bool | None:
     """Check if user has permission."""
-    try:
-        return Permission.objects.filter(
-            name=perm_name,
-            extension__name=ext_name,
-            groups__in=user.permission_groups.all(),
-        ).exists()
-    except Permission.DoesNotExist:
-        return None
-    except AttributeError:
+    user_perms = get_user_permissions(user)
+    if user_perms is None:
         return None
+    return (ext_name, perm_name) in user_perms.perms
 
 
 class IsAuthenticated(BasePermission):
@@ -0,0 +1,93 @@
+"""Queryset functions for the collectivo app."""
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from rest_framework import serializers
+from rest_framework.relations import PrimaryKeyRelatedField
+
+
+def get_related_lookups(model: models.Model, source: list[str]) -> tuple:
+    """Get the lookups to load the relations of a source path.
+
+    Relations are joined with select_related until the first relation with
+    multiple objects. From there, the relations are prefetched.
+    Returns a tuple of the select lookup and the prefetch lookup.
+    """
+    relations = []
+    first_many = None
+    for name in source:
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            break
+        if not field.is_relation or field.related_model is None:
+            break
+        if first_many is None and (field.many_to_many or field.one_to_many):
+            first_many = len(relations)
+        relations.append(name)
+        model = field.related_model
+    if first_many is None:
+        return "__".join(relations), ""
+    return "__".join(relations[:first_many]), "__".join(relations)
+
+
+def _get_serializer_sources(
+    serializer: serializers.Serializer, prefix: list[str]
+) -> list:
+    """Get the source paths of all fields that are read by a serializer."""
+    sources = []
+    for field_obj in serializer.fields.values():
+        if field_obj.write_only or field_obj.source == "*":
+            continue
+        source = prefix + field_obj.source_attrs
+        if isinstance(field_obj, serializers.ListSerializer):
+            field_obj = field_obj.child
+        if isinstance(field_obj, serializers.Serializer):
+            sources += _get_serializer_sources(field_obj, source)
+        elif isinstance(field_obj, PrimaryKeyRelatedField):
+            # The primary key is read from the foreign key without a query
+            source = source[:-1]
+        sources.append(source)
+    return sources
+
+
+@lru_cache
+def get_queryset_plan(serializer_class: type) -> tuple[list, list]:
+    """Get the related lookups that are needed to serialize a model.
+
+    The dotted sources of all readable serializer fields are followed on the
+    model of the serializer, including the fields of nested serializers.
+    Returns a tuple of lookups for select_related and prefetch_related.
+    """
+    model = serializer_class.Meta.model
+    select, prefetch = set(), set()
+    for source in _get_serializer_sources(serializer_class(), []):
+        select_lookup, prefetch_lookup = get_related_lookups(model, source)
+        if select_lookup:
+            select.add(select_lookup)
+        if prefetch_lookup:
+            prefetch.add(prefetch_lookup)
+
+    # Remove lookups that are included in longer lookups
+    select = [
+        a for a in select if not any(b.startswith(f"{a}__") for b in select)
+    ]
+    prefetch = [
+        a
+        for a in prefetch
+        if not any(b.startswith(f"{a}__") for b in prefetch)
+    ]
+    return sorted(select), sorted(prefetch)
+
+
+def optimize_queryset(
+    queryset: models.QuerySet, serializer_class: type
+) -> models.QuerySet:
+    """Apply select_related and prefetch_related needed by a serializer."""
+    select, prefetch = get_queryset_plan(serializer_class)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset
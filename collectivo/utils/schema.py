@@ -1,21 +1,35 @@
 """Schema mixin for collectivo viewsets."""
+import hashlib
+import json
+import uuid
 from collections import OrderedDict
 from typing import Literal, TypedDict
 
+from django.apps import apps
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Cast, Coalesce, Concat, NullIf
 from django.urls import reverse
 from django.urls.exceptions import NoReverseMatch
 from rest_framework import mixins
-from rest_framework.fields import empty
+from rest_framework.fields import Field, empty
+from rest_framework.relations import ManyRelatedField, RelatedField
 from rest_framework.serializers import Serializer
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework.viewsets import GenericViewSet
 
+from collectivo.version import __version__
+
 # TODO Default does not work yet
 # TODO Special case for user model
 # TODO Remove choices from schema if choices_endpoint is set,
 # once implemented in frontend
 
+ChoicesMode = Literal["inline", "url"]
+CHOICES_MODES = ("inline", "url")
+
 
 class SchemaCondition(TypedDict):
     """A condition of a schema field."""
@@ -43,6 +57,7 @@ class SchemaField(TypedDict):
     write_only: bool
     choices: OrderedDict
     choices_url: str
+    choices_count: int
 
 
 class SchemaSection(TypedDict):
@@ -114,11 +129,51 @@ def get_queryset(model, source):
     return model.objects.all()
 
 
+def get_label_relations(model: models.Model) -> list:
+    """Return the forward relations that the label of a model can use.
+
+    Labels often include fields of related objects, e.g. the name of the
+    user of an account.
+    """
+    return [
+        field
+        for field in model._meta.get_fields()
+        if field.concrete and (field.many_to_one or field.one_to_one)
+    ]
+
+
 def get_choices(queryset) -> OrderedDict:
     """Generate choices for a field."""
+    relations = get_label_relations(queryset.model)
+    queryset = queryset.select_related(*[field.name for field in relations])
     return OrderedDict([(item.pk, item.__str__()) for item in queryset])
 
 
+def get_choices_label(model: models.Model) -> models.Expression:
+    """Get a database expression for the choice labels of a model.
+
+    Models can define the attribute `choices_label` to customize the label.
+    Otherwise the name of users, the label or name field, or the primary key
+    is used.
+    """
+    if hasattr(model, "choices_label"):
+        return model.choices_label
+    if model is get_user_model():
+        return Concat("first_name", Value(" "), "last_name")
+    field_names = [field.name for field in model._meta.get_fields()]
+    if "label" in field_names and "name" in field_names:
+        return Coalesce(NullIf("label", Value("")), "name")
+    for name in ["label", "name"]:
+        if name in field_names:
+            return F(name)
+    return Cast("pk", output_field=models.CharField())
+
+
+def is_relation(field_obj: Field) -> bool:
+    """Check if a serializer field has objects of another model as choices."""
+    return isinstance(field_obj, (RelatedField, ManyRelatedField))
+
+
 def get_endpoint(model: models.Model, source: str = None) -> str:
     """Get the endpoint for a model field with a specific source."""
     model = get_source(model, source)
@@ -134,8 +189,14 @@ def get_endpoint(model: models.Model, source: str = None) -> str:
         return None
 
 
-def get_serializer_schema(serializer: Serializer):
-    """Get the schema for a serializer."""
+def get_serializer_schema(
+    serializer: Serializer, choices: ChoicesMode = "inline"
+):
+    """Get the schema for a serializer.
+
+    If choices is "url", related objects are not listed as choices. Instead,
+    only the URL where choices can be retrieved and their count is added.
+    """
     if hasattr(serializer.Meta, "schema"):
         if callable(serializer.Meta.schema):
             settings = serializer.Meta.schema(serializer)
@@ -151,7 +212,7 @@ def get_serializer_schema(serializer: Serializer):
             data[field_name] = field_data = {
                 "field_type": field_type,
                 "input_type": field_type,
-                "schema": get_serializer_schema(field_obj),
+                "schema": get_serializer_schema(field_obj, choices),
             }
         else:
             field_type = field_obj.__class__.__name__
@@ -165,29 +226,31 @@ def get_serializer_schema(serializer: Serializer):
             data[field_name]["input_type"] = "textarea"
 
         for attr in field_attrs:
-            if hasattr(field_obj, attr):
-                # Add URL path where choices can be retrieved
-                if attr == "choices" and (
-                    hasattr(field_obj, "child_relation")
-                    or hasattr(field_obj, "get_queryset")
-                ):
-                    choices_url = get_endpoint(
-                        serializer.Meta.model,
-                        field_obj.source,
-                    )
-                    data[field_name]["choices_url"] = choices_url
-
-                    # TODO: This should be removed once frontend uses url
-                    queryset = get_queryset(
-                        serializer.Meta.model,
-                        field_obj.source,
-                    )
-                    value = get_choices(queryset)
-
-                else:
-                    value = getattr(field_obj, attr)
-                if value is not empty and value is not None:
-                    data[field_name][attr] = value
+            # Add URL path where choices can be retrieved
+            # Checked first, since the attribute choices loads all objects
+            if attr == "choices" and is_relation(field_obj):
+                choices_url = get_endpoint(
+                    serializer.Meta.model,
+                    field_obj.source,
+                )
+                data[field_name]["choices_url"] = choices_url
+                queryset = get_queryset(
+                    serializer.Meta.model,
+                    field_obj.source,
+                )
+                if choices == "url":
+                    data[field_name]["choices_count"] = queryset.count()
+                    continue
+
+                # TODO: This should be removed once frontend uses url
+                value = get_choices(queryset)
+
+            elif hasattr(field_obj, attr):
+                value = getattr(field_obj, attr)
+            else:
+                continue
+            if value is not empty and value is not None:
+                data[field_name][attr] = value
 
         # Add custom schema attributes from serializer (legacy version)
         if (
@@ -231,10 +294,24 @@ def get_serializer_schema(serializer: Serializer):
     return schema
 
 
-def get_model_schema(self: GenericViewSet):
+def get_model_schema(self: GenericViewSet, choices: ChoicesMode = "inline"):
     """Return model schema."""
     serializer: Serializer = self.get_serializer_class()()
-    schema = get_serializer_schema(serializer)
+    schema = get_serializer_schema(serializer, choices)
+
+    # Refer to the choices action of the viewset if available
+    if choices == "url" and hasattr(self, "_schema_choices"):
+        for field_name, field_data in schema["fields"].items():
+            if "choices_url" not in field_data:
+                continue
+            try:
+                field_data["choices_url"] = self.reverse_action(
+                    "schema-choices",
+                    kwargs={"field": field_name},
+                    request=None,
+                )
+            except NoReverseMatch:
+                pass
 
     # Dynamic changes from database settings
     if "settings" in schema and hasattr(serializer.Meta, "settings"):
@@ -274,3 +351,124 @@ def get_model_schema(self: GenericViewSet):
             actions.append("update-bulk")
 
     return schema
+
+
+SCHEMA_CACHE_KEY = "collectivo.schema.{}"
+SCHEMA_VERSION_KEY = "collectivo.schema.version.{}"
+SCHEMA_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def get_schema_models(serializer: Serializer) -> set[str]:
+    """Return the labels of the models whose objects are used as choices.
+
+    This includes the related models that the labels of the choices can
+    use, so that a changed user name also updates the labels of accounts.
+    """
+    labels = set()
+    for field_obj in serializer.fields.values():
+        if isinstance(field_obj, Serializer):
+            labels |= get_schema_models(field_obj)
+        elif is_relation(field_obj):
+            model = get_source(serializer.Meta.model, field_obj.source)
+            labels.add(model._meta.label_lower)
+            for field in get_label_relations(model):
+                labels.add(field.related_model._meta.label_lower)
+    return labels
+
+
+def get_choices_models() -> list:
+    """Return the models whose objects can be choices of a relation.
+
+    These are the targets of relations and both sides of many-to-many
+    relations. Historical models are never used as choices.
+    """
+    choice_models = set()
+    for model in apps.get_models():
+        if hasattr(model, "instance_type"):
+            continue
+        for field in model._meta.get_fields():
+            if field.auto_created or not field.is_relation:
+                continue
+            if field.many_to_many:
+                choice_models.add(model)
+            if field.related_model is not None:
+                choice_models.add(field.related_model)
+    return sorted(choice_models, key=lambda model: model._meta.label)
+
+
+def get_schema_version(labels) -> str:
+    """Return a token that changes whenever one of the models changes."""
+    keys = [SCHEMA_VERSION_KEY.format(label) for label in sorted(labels)]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            versions[key] = uuid.uuid4().hex
+            cache.set(key, versions[key], None)
+    return ":".join(versions[key] for key in keys)
+
+
+def update_schema_version(sender, **kwargs):
+    """Invalidate cached schemas that list objects of the sender as choices.
+
+    Connected to the models of get_choices_models. Historical models are
+    ignored, since they are never used as choices.
+    """
+    if hasattr(sender, "instance_type"):
+        return
+    key = SCHEMA_VERSION_KEY.format(sender._meta.label_lower)
+    cache.set(key, uuid.uuid4().hex, None)
+
+    # Update again after commit in case another request cached old data
+    transaction.on_commit(lambda: cache.set(key, uuid.uuid4().hex, None))
+
+
+def get_cached_model_schema(
+    self: GenericViewSet, choices: ChoicesMode = "inline"
+) -> tuple[dict, str | None]:
+    """Return model schema and its ETag, using the cache if possible.
+
+    Schemas are cached per viewset and serializer and are invalidated when
+    an object of a model that is used for choices is saved or deleted.
+    Schemas with database settings depend on the requested object and are
+    not cached, in which case the returned ETag is None.
+    """
+    serializer_class = self.get_serializer_class()
+    if hasattr(serializer_class.Meta, "settings"):
+        return get_model_schema(self, choices), None
+
+    name = ":".join(
+        [
+            __version__,
+            choices,
+            f"{type(self).__module__}.{type(self).__qualname__}",
+            f"{serializer_class.__module__}.{serializer_class.__qualname__}",
+        ]
+    )
+    key = SCHEMA_CACHE_KEY.format(
+        hashlib.sha1(name.encode(), usedforsecurity=False).hexdigest()
+    )
+
+    cached = cache.get(key)
+    labels = (
+        cached["models"]
+        if cached is not None
+        else get_schema_models(serializer_class())
+    )
+    version = get_schema_version(labels)
+    etag = '"{}"'.format(
+        hashlib.sha1(
+            f"{key}:{version}".encode(), usedforsecurity=False
+        ).hexdigest()
+    )
+    if cached is not None and cached["etag"] == etag:
+        return cached["schema"], etag
+
+    # Store schema as it will be rendered, since lazy labels cannot be pickled
+    schema = get_model_schema(self, choices)
+    schema = json.loads(json.dumps(schema, cls=JSONEncoder))
+    cache.set(
+        key,
+        {"models": labels, "etag": etag, "schema": schema},
+        SCHEMA_CACHE_TIMEOUT,
+    )
+    return schema, etag
@@ -1,6 +1,7 @@
 """Serializer utilities for collectivo."""
 from html import escape
 
+from django.db.models import OuterRef, Q, Subquery
 from django.utils.html import format_html
 from rest_framework import serializers
 
@@ -30,6 +31,78 @@ class UserFields(serializers.ModelSerializer):
     )
 
 
+def get_history_neighbour(model, object_id: str, previous: bool):
+    """Get a subquery of the previous or next record of a history record."""
+    lookup, sign = ("lt", "-") if previous else ("gt", "")
+    return Subquery(
+        model.objects.filter(
+            Q(**{f"history_date__{lookup}": OuterRef("history_date")})
+            | Q(
+                history_date=OuterRef("history_date"),
+                **{f"history_id__{lookup}": OuterRef("history_id")},
+            ),
+            **{object_id: OuterRef(object_id)},
+        )
+        .order_by(f"{sign}history_date", f"{sign}history_id")
+        .values("history_id")[:1]
+    )
+
+
+def prefetch_history_neighbours(records: list):
+    """Find the previous record and the changes of many history records.
+
+    The neighbours of the records are found with one query over the records
+    of the page, and the previous records are loaded with a second query.
+    The changes are then calculated in memory.
+    """
+    if not records:
+        return
+    model = type(records[0])
+    object_id = model.instance_type._meta.pk.attname
+    neighbours = {
+        history_id: (prev_id, next_id)
+        for history_id, prev_id, next_id in model.objects.filter(
+            history_id__in=[record.history_id for record in records]
+        )
+        .annotate(
+            prev_id=get_history_neighbour(model, object_id, previous=True),
+            next_id=get_history_neighbour(model, object_id, previous=False),
+        )
+        .values_list("history_id", "prev_id", "next_id")
+        .order_by()
+    }
+    previous = model.objects.in_bulk(
+        {prev_id for prev_id, _ in neighbours.values() if prev_id}
+    )
+    for record in records:
+        prev_id, next_id = neighbours.get(record.history_id, (None, None))
+        prev_record = previous.get(prev_id)
+        record._history_is_latest = next_id is None
+        record._history_delta = (
+            record.diff_against(prev_record) if prev_record else None
+        )
+
+
+def get_history_delta(record):
+    """Get the changes of a history record to its previous record."""
+    if not hasattr(record, "_history_delta"):
+        prev_record = record.prev_record
+        record._history_delta = (
+            record.diff_against(prev_record) if prev_record else None
+        )
+    return record._history_delta
+
+
+class HistoryListSerializer(serializers.ListSerializer):
+    """Serializer for lists of history records with their changes."""
+
+    def to_representation(self, data):
+        """Find the changes of all records before they are serialized."""
+        records = list(data.all() if hasattr(data, "all") else data)
+        prefetch_history_neighbours(records)
+        return super().to_representation(records)
+
+
 def create_history_serializer(origin_model):
     """Create a serializer for the history of a model."""
 
@@ -45,6 +118,7 @@ def create_history_serializer(origin_model):
 
             model = origin_model.history.model
             fields = "__all__"
+            list_serializer_class = HistoryListSerializer
             schema = {
                 "fields": {
                     "history_changes": {
@@ -57,6 +131,8 @@ def create_history_serializer(origin_model):
         def get_history_is_latest(self, obj):
             """Get boolean on whether this object is the latest."""
 
+            if hasattr(obj, "_history_is_latest"):
+                return obj._history_is_latest
             if obj.next_record:
                 return False
             return True
@@ -64,8 +140,8 @@ def create_history_serializer(origin_model):
         def get_history_changed_fields(self, obj):
             """Get changed fields."""
 
-            if obj.prev_record:
-                delta = obj.diff_against(obj.prev_record)
+            delta = get_history_delta(obj)
+            if delta:
                 return delta.changed_fields
             return None
 
@@ -73,18 +149,17 @@ def create_history_serializer(origin_model):
             """Get changes."""
 
             fields = ""
-            if obj.prev_record:
-                delta = obj.diff_against(obj.prev_record)
-
+            delta = get_history_delta(obj)
+            if delta:
                 for change in delta.changes:
                     fields += str(
                         "<strong>{}</strong> changed from <span"
                         " style='background-color:#ffb5ad'>{}</span> to <span"
                         " style='background-color:#b3f7ab'>{}</span> . <br/>"
                         .format(
-                            escape(change.field),
-                            escape(change.old),
-                            escape(change.new),
+                            escape(str(change.field)),
+                            escape(str(change.old)),
+                            escape(str(change.new)),
                         )
                     )
                 return format_html(fields)
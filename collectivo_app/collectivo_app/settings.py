@@ -109,8 +109,8 @@ DATABASES = {
 CELERY_TASK_SERIALIZER = "pickle"
 CELERY_RESULT_SERIALIZER = "pickle"
 CELERY_EVENT_SERIALIZER = "pickle"
-CELERY_ACCEPT_CONTENT = ["pickle"]
-CELERY_TASK_ACCEPT_CONTENT = ["pickle"]
+CELERY_ACCEPT_CONTENT = ["pickle", "json"]
+CELERY_TASK_ACCEPT_CONTENT = ["pickle", "json"]
 CELERY_RESULT_ACCEPT_CONTENT = ["pickle"]
 CELERY_EVENT_ACCEPT_CONTENT = ["pickle"]
 CELERY_BROKER_URL = os.environ.get("CELERY_BROKER", "redis://127.0.0.1:6379/0")
@@ -119,6 +119,23 @@ CELERY_RESULT_BACKEND = os.environ.get(
 )
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# The local memory cache is not shared between processes, so permissions
+# are only cached for a few seconds. Use CACHE_LOCATION in production.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+if os.environ.get("CACHE_LOCATION"):
+    CACHES["default"] = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.environ["CACHE_LOCATION"],
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -174,7 +191,7 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 REST_FRAMEWORK = {
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
     "DEFAULT_PAGINATION_CLASS": (
-        "rest_framework.pagination.LimitOffsetPagination"
+        "collectivo.utils.pagination.CollectivoPagination"
     ),
     "DEFAULT_VERSIONING_CLASS": (
         "rest_framework.versioning.AcceptHeaderVersioning"